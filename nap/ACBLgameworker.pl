@@ -0,0 +1,57 @@
+#!/usr/bin/perl
+#
+# ACBLgameworker.pl
+#
+# Long-lived companion to ACBLgamedump.pl, for callers that decode many
+# game files and do not want to pay for a perl interpreter per file.
+#
+# This software is released under the GNU General Public License GPLv3
+# See: http://www.gnu.org/licenses/gpl.html for full license.
+#
+# Reads one ACBLscore game file name per line on STDIN. For each one, writes
+# exactly one line of JSON to STDOUT, then flushes:
+#
+#   {"file": fname, "game": {...}}     decoded game (as ACBLgamedump.pl)
+#   {"file": fname, "error": "..."}    the file could not be decoded
+#
+# Accepts the -nb, -ne and -sc switches of ACBLgamedump.pl. Exits at EOF.
+
+use strict;
+use FindBin;
+use lib $FindBin::Bin;
+
+use JSON::PP;
+use ACBLgamedecode;
+
+my %opt;
+foreach my $arg (@ARGV) {
+  if    ($arg eq '-nb') { $opt{'noboards'} = 1; }
+  elsif ($arg eq '-ne') { $opt{'noentries'} = 1; }
+  elsif ($arg eq '-sc') { $opt{'sectionsonly'} = 1; }
+  else { print STDERR "Unrecognized switch: $arg\n"; }
+}
+
+my $js = JSON::PP->new->ascii;
+$| = 1;
+
+while (my $fname = <STDIN>) {
+  chomp($fname);
+  next if $fname eq '';
+  my ($err, $gm);
+  eval { ($err, $gm) = ACBLgamedecode::decode($fname, \%opt); };
+  if ($@) {
+    (my $msg = $@) =~ s/\s+$//;
+    print $js->encode({'file' => $fname, 'error' => "Decoder failed: $msg"}), "\n";
+  }
+  elsif ($err == -257) {
+    print $js->encode({'file' => $fname, 'error' => "Not an ACBLscore game file: $fname (skipped)"}), "\n";
+  }
+  elsif ($err) {
+    print $js->encode({'file' => $fname, 'error' => "Unable to read $fname"}), "\n";
+  }
+  else {
+    print $js->encode({'file' => $fname, 'game' => [$gm]}), "\n";
+  }
+}
+
+exit(0);
@@ -3,7 +3,8 @@
 Major dependency, sub-package "gamefile"
 
 Grateful acknowledgement to Matthew J. Kidd of lajollabridge.com for his
-perl gamefile parsing tools, which are included here as package_data.
+perl gamefile parsing tools, which are included here as package_data, and
+on which the native decoder in gamefile.acbl_decode is based.
 
 ACBLgamedump is described at this link:
   https://lajollabridge.com/Software/ACBLgamedump/ACBLgamedump-About.htm
@@ -13,6 +14,6 @@ This software is released under the GNU General Public License GPLv3
 See: http://www.gnu.org/licenses/gpl.html for full license.
 
 """
-__version_info__ = ('0', '7', '1')
+__version_info__ = ('0', '8', '0')
 __version__ = '.'.join(__version_info__)
 
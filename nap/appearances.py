@@ -0,0 +1,254 @@
+"""Columnar table of every player appearance in a set of games
+
+Each row is one player in one game: integer ids of the player, game and
+club, the date as an ordinal, the strat of the player's entry, and the
+player's qualifications as a qual_map bit mask (A=4, B=2, C=1, as for CSV
+exports). The columns are NumPy arrays, so season and multi-season totals
+are array masks and bincounts rather than walks over Player objects.
+
+NumPy is an optional dependency (pip install nap[stats]). This module
+imports it, so import this module only when a table is wanted; nap.py
+does so on first use.
+
+Classes:
+    AppearanceTable: The appearances of a list of games
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import array
+import numpy
+
+# qual_map bit of each flight
+FLIGHT_BITS = {
+  'a': 4,
+  'b': 2,
+  'c': 1,
+}
+
+# Strat letters, by strat index
+STRATS = 'abcde'
+
+
+class AppearanceTable(object):
+  """The player appearances of a list of games, column by column
+
+  Ids are indexes into the lists of players, games and clubs, in the
+  order first seen. Games are taken in the order given, so for games from
+  Nap.get_game_list() the game ids are in date order.
+
+  Dummy players (pnum "dummy") fill out CSV exports and are left out.
+
+  Attributes:
+    player: Player id of each appearance (int32 array)
+    game: Game id of each appearance (int32 array)
+    club: Club id of each appearance (int32 array)
+    date: Date ordinal of each appearance's game (int32 array)
+    strat: Strat index of each appearance's entry, 0 for A, 1 for B and
+        so on, -1 if unknown (int8 array)
+    qual_map: Qualification bit mask of each appearance (uint8 array)
+    game_club: Club id of each game, by game id (int32 array)
+    players: List of player id to the first Player seen with that key
+    player_ids: Dictionary of Player.get_key() to player id
+    games: List of game id to Gamefile
+    game_ids: Dictionary of Gamefile.get_key() to game id
+    clubs: List of club id to Club
+    club_ids: Dictionary of club number to club id
+  """
+
+  def __init__(self,games):
+    self.players = []
+    self.player_ids = {}
+    self.games = []
+    self.game_ids = {}
+    self.clubs = []
+    self.club_ids = {}
+    player = array.array('i')
+    game = array.array('i')
+    club = array.array('i')
+    date = array.array('i')
+    strat = array.array('b')
+    qual_map = array.array('B')
+    game_club = array.array('i')
+
+    for g in games:
+      game_id = len(self.games)
+      self.games.append(g)
+      self.game_ids[g.get_key()] = game_id
+      c = g.get_club()
+      club_id = self.club_ids.get(c.number)
+      if club_id is None:
+        club_id = len(self.clubs)
+        self.clubs.append(c)
+        self.club_ids[c.number] = club_id
+      game_club.append(club_id)
+      ordinal = g.get_qualdate().ptime.toordinal()
+      for section in g.get_sections():
+        for (p, letter, bits) in zip(section.players,section.player_strats,
+                                     section.player_quals):
+          if p.pnum == 'dummy':
+            continue
+          key = p.get_key()
+          player_id = self.player_ids.get(key)
+          if player_id is None:
+            player_id = len(self.players)
+            self.players.append(p)
+            self.player_ids[key] = player_id
+          player.append(player_id)
+          game.append(game_id)
+          club.append(club_id)
+          date.append(ordinal)
+          strat.append(STRATS.find(letter) if letter else -1)
+          qual_map.append(bits)
+
+    self.player = numpy.array(player,dtype=numpy.int32)
+    self.game = numpy.array(game,dtype=numpy.int32)
+    self.club = numpy.array(club,dtype=numpy.int32)
+    self.date = numpy.array(date,dtype=numpy.int32)
+    self.strat = numpy.array(strat,dtype=numpy.int8)
+    self.qual_map = numpy.array(qual_map,dtype=numpy.uint8)
+    self.game_club = numpy.array(game_club,dtype=numpy.int32)
+
+  @classmethod
+  def from_columns(cls,columns,players,games,game_keys,clubs):
+    """A table of columns already built, such as those of a snapshot.
+
+    Args:
+      columns: Dictionary of attribute name (player, game, club, date,
+          strat, qual_map, game_club) to its array
+      players: Sequence of player id to Player
+      games: Sequence of game id to Gamefile
+      game_keys: Gamefile.get_key() of each game id
+      clubs: Sequence of club id to Club
+    """
+    table = cls([])
+    for (name, column) in columns.items():
+      setattr(table,name,column)
+    table.players = players
+    table.player_ids = dict((p.get_key(), i) for (i, p) in enumerate(players))
+    table.games = games
+    table.game_ids = dict((k, i) for (i, k) in enumerate(game_keys))
+    table.clubs = clubs
+    table.club_ids = dict((c.number, i) for (i, c) in enumerate(clubs))
+    return table
+
+  def __len__(self):
+    return len(self.player)
+
+  def qualified(self,flight):
+    """Mask of the appearances that qualified in a flight ('a', 'b' or 'c')"""
+    return (self.qual_map & FLIGHT_BITS[flight]) != 0
+
+  def player_mask(self,players):
+    """Mask of the appearances of the given Players (by key)"""
+    ids = [self.player_ids[p.get_key()] for p in players
+           if p.get_key() in self.player_ids]
+    return numpy.in1d(self.player,numpy.array(ids,dtype=numpy.int32))
+
+  def qualifier_ids(self,flight,mask=None):
+    """Sorted array of the ids of players who qualified in a flight.
+
+    Args:
+      flight: One of {'a','b','c'}
+      mask: If given, only appearances in this mask count
+    """
+    qualified = self.qualified(flight)
+    if mask is not None:
+      qualified &= mask
+    return numpy.unique(self.player[qualified])
+
+  def qualifiers(self,flight,mask=None):
+    """The Players who qualified in a flight, as for qualifier_ids()"""
+    return [self.players[i] for i in self.qualifier_ids(flight,mask)]
+
+  def flight_totals(self,mask=None):
+    """Number of players qualified in each flight.
+
+    Args:
+      mask: If given, only appearances in this mask count
+    Returns:
+      dictionary of counts by flight letter, as Nap.flight_totals()
+    """
+    totals = {}
+    for flight in ('a','b','c'):
+      totals[flight] = len(self.qualifier_ids(flight,mask))
+    return totals
+
+  def first_qualified(self,flight):
+    """Each player's first qualification in a flight.
+
+    Returns:
+      (player ids, date ordinals) arrays, sorted by player id
+    """
+    qualified = self.qualified(flight)
+    player = self.player[qualified]
+    date = self.date[qualified]
+    order = numpy.lexsort((date,player))
+    (ids, first) = numpy.unique(player[order],return_index=True)
+    return (ids, date[order][first])
+
+  def cumulative_qualifiers(self,ends):
+    """Number of players qualified in each flight on or before each date.
+
+    Args:
+      ends: Date ordinals, ascending
+    Returns:
+      dictionary of an int array of counts, one per end, by flight letter
+    """
+    ends = numpy.asarray(ends,dtype=numpy.int32)
+    totals = {}
+    for flight in ('a','b','c'):
+      first = numpy.sort(self.first_qualified(flight)[1])
+      totals[flight] = numpy.searchsorted(first,ends,side='right')
+    return totals
+
+  def club_totals(self):
+    """Games, appearances and qualifiers of each club.
+
+    Returns:
+      list of dictionaries, one per club id, of club (the Club), games,
+      appearances, players (distinct), and qualifiers per flight
+      letter (distinct players)
+    """
+    nclubs = len(self.clubs)
+    games = numpy.bincount(self.game_club,minlength=nclubs)
+    appearances = numpy.bincount(self.club,minlength=nclubs)
+
+    # Each (club, player) pair once, then count pairs per club
+    def distinct_players(mask=None):
+      club = self.club if mask is None else self.club[mask]
+      player = self.player if mask is None else self.player[mask]
+      pairs = numpy.unique(club.astype(numpy.int64) * len(self.players) + player)
+      return numpy.bincount(pairs // max(1,len(self.players)),minlength=nclubs)
+
+    players = distinct_players()
+    qualifiers = {}
+    for flight in ('a','b','c'):
+      qualifiers[flight] = distinct_players(self.qualified(flight))
+
+    totals = []
+    for club_id in range(nclubs):
+      totals.append({
+        'club': self.clubs[club_id],
+        'games': int(games[club_id]),
+        'appearances': int(appearances[club_id]),
+        'players': int(players[club_id]),
+        'a': int(qualifiers['a'][club_id]),
+        'b': int(qualifiers['b'][club_id]),
+        'c': int(qualifiers['c'][club_id]),
+      })
+    return totals
+
+  def strat_totals(self,game_id=None):
+    """Number of appearances in each strat, by strat letter.
+
+    Args:
+      game_id: If given, count the appearances of this game only
+    """
+    strat = self.strat if game_id is None else self.strat[self.game == game_id]
+    counts = numpy.bincount(strat[strat >= 0].astype(numpy.int32),minlength=len(STRATS))
+    totals = {}
+    for (idx, letter) in enumerate(STRATS):
+      totals[letter] = int(counts[idx])
+    return totals
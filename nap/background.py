@@ -0,0 +1,85 @@
+"""Calls that run on a thread of their own, without the caller waiting
+
+Loading a tree of game files takes a while. A caller that has to stay
+responsive, such as the event loop of a web front end while clubs upload
+their files, starts the load as a BackgroundTask and carries on. It can
+then ask whether the load is done, wait for its result with a time limit,
+or be called back when it finishes.
+
+Classes:
+    BackgroundTask: One call running on a daemon thread, and its outcome
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import sys
+import threading
+
+
+class BackgroundTask(object):
+  """One call running on a daemon thread, and its outcome
+
+  Attributes:
+    value: What the call returned, once it is done
+    error: sys.exc_info() of what the call raised, or None
+  """
+
+  def __init__(self,function,args=(),kwargs=None,lock=None,callback=None,name='nap-background'):
+    """Start the call.
+
+    Args:
+      function, args, kwargs: The call
+      lock: If given, held for the whole of the call, so that readers who
+          hold it too never see its work half done
+      callback: If given, called with the task once the call has returned
+          or raised. It runs on the task's thread, so an event loop would
+          have it hand the task back to the loop's own thread.
+      name: Name of the thread
+    """
+    self.function = function
+    self.args = args
+    self.kwargs = kwargs or {}
+    self.lock = lock
+    self.callback = callback
+    self.value = None
+    self.error = None
+    self.finished = threading.Event()
+    self.thread = threading.Thread(target=self.run,name=name)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def run(self):
+    try:
+      if self.lock is not None:
+        with self.lock:
+          self.value = self.function(*self.args,**self.kwargs)
+      else:
+        self.value = self.function(*self.args,**self.kwargs)
+    except Exception:
+      self.error = sys.exc_info()
+    self.finished.set()
+    if self.callback is not None:
+      self.callback(self)
+
+  def done(self):
+    """True once the call has returned or raised"""
+    return self.finished.is_set()
+
+  def wait(self,timeout=None):
+    """Wait for the call to finish, for up to timeout seconds. Returns done()."""
+    self.finished.wait(timeout)
+    return self.done()
+
+  def result(self,timeout=None):
+    """What the call returned, waiting for up to timeout seconds for it.
+
+    Exceptions:
+      Whatever the call raised, with its traceback
+      RuntimeError if the call has not finished in time
+    """
+    if not self.wait(timeout):
+      raise RuntimeError("%s has not finished" % self.thread.name)
+    if self.error is not None:
+      raise self.error[0], self.error[1], self.error[2]
+    return self.value
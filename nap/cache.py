@@ -0,0 +1,479 @@
+"""Caches of decoded game files
+
+A game file dict is looked for in up to three tiers, fastest first: a
+bounded store in this process, memcached, and a sqlite database on disk.
+What one tier misses and a slower one has is copied into the faster ones.
+Values are the game file dicts marshalled and zlib compressed, so a tier
+holds bytes, not live dicts that a compact Nap has let go of.
+
+Files that fail to parse, such as files that are not ACBLscore game
+files or are not NAP games, are quarantined on disk with the reason, and
+not decoded again until they change.
+
+Classes:
+    MemoryCache: A size-bounded, least recently used store in this process
+    DiskCache: A size-bounded sqlite store of decoded game file dicts that
+        persists between runs, no server required
+    GameCache: The tiers together, batched
+
+Functions:
+    file_identity: (size, mtime, content hash) of a file on local storage
+    default_cache_dir: Where the disk cache lives unless told otherwise
+    open_disk_cache: Open a DiskCache, degrading to None on failure
+    memory_cache: The MemoryCache shared by every Nap in this process
+    pack, unpack: A game file dict to and from a cache value
+    failure_reason: The text a failure is quarantined with
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import os
+import sys
+import time
+import zlib
+import marshal
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from os.path import join
+from gamefile.acbl_decode import DECODE_FORMAT_VERSION, DECODER_REVISION
+from decoder import QUALIFIER
+
+# Bump when the layout of the cache database or its values changes
+CACHE_SCHEMA = 3
+
+# Any change to this stamp discards everything in an existing cache
+CACHE_VERSION = "%s.%s.%s.%s" % (CACHE_SCHEMA, DECODE_FORMAT_VERSION,
+                                 DECODER_REVISION, marshal.version)
+
+# memcached refuses larger values (its default item size limit)
+MEMCACHE_MAX_VALUE = 1024 * 1024
+
+# Memcache keys of values derived from the loaded games, stale once a
+# game is added
+DERIVED_KEYS = ('CLUBS',)
+
+
+def pack(game_dict):
+  """The cache value of a game file dict: marshalled, zlib compressed"""
+  return zlib.compress(marshal.dumps(game_dict))
+
+
+def unpack(data):
+  return marshal.loads(zlib.decompress(data))
+
+
+def failure_reason(e):
+  """The message of a GamefileException, as text"""
+  return e.value if isinstance(e.value,basestring) else str(e.value)
+
+
+def file_identity(path):
+  """Identify the contents of a file.
+
+  Args:
+    path: Path string to a file on local storage
+
+  Returns:
+    (size, mtime, sha1 hex digest)
+
+  Exceptions:
+    IOError, OSError if the file cannot be read
+  """
+  with open(path,'rb') as f:
+    st = os.fstat(f.fileno())
+    digest = hashlib.sha1(f.read()).hexdigest()
+  return (st.st_size, st.st_mtime, digest)
+
+
+def default_cache_dir():
+  """$NAP_CACHE, or nap/ under $XDG_CACHE_HOME (default ~/.cache)"""
+  if 'NAP_CACHE' in os.environ:
+    return os.environ['NAP_CACHE']
+  base = os.environ.get('XDG_CACHE_HOME',join(os.path.expanduser('~'),'.cache'))
+  return join(base,'nap')
+
+
+class MemoryCache(object):
+  """Least recently used cache values, kept in this process
+
+  Bounded by the total length of the values. Safe to share between
+  threads.
+
+  Attributes:
+    max_bytes: Upper bound on the total size of stored values
+  """
+
+  def __init__(self,max_bytes=32*1024*1024):
+    self.max_bytes = max_bytes
+    self.entries = OrderedDict()
+    self.size = 0
+    self.lock = threading.Lock()
+
+  def get_multi(self,keys):
+    """Dictionary of those keys found to their values"""
+    found = {}
+    with self.lock:
+      for key in keys:
+        data = self.entries.pop(key,None)
+        if data is not None:
+          self.entries[key] = data
+          found[key] = data
+    return found
+
+  def set_multi(self,mapping):
+    with self.lock:
+      for (key, data) in mapping.items():
+        old = self.entries.pop(key,None)
+        if old is not None:
+          self.size -= len(old)
+        if len(data) > self.max_bytes:
+          continue
+        self.entries[key] = data
+        self.size += len(data)
+      while self.size > self.max_bytes:
+        (key, data) = self.entries.popitem(last=False)
+        self.size -= len(data)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.size = 0
+
+
+# The MemoryCache of this process, see memory_cache()
+_memory_cache = None
+
+
+def memory_cache():
+  """The MemoryCache shared by every Nap in this process, such as the
+  partitions of a tree as they are loaded and unloaded"""
+  global _memory_cache
+  if _memory_cache is None:
+    _memory_cache = MemoryCache()
+  return _memory_cache
+
+
+class DiskCache(object):
+  """Persistent cache of decoded game file dicts
+
+  Entries are stored per game file path and decode profile. An entry is
+  only returned if the file's size, mtime and content hash still match the
+  ones recorded when it was stored, so a rewritten file is decoded again.
+
+  Values are the game file dicts, marshalled and zlib compressed. When the
+  stored values grow past max_bytes, the least recently used entries are
+  evicted. Their total size is summed from the table when the cache is
+  opened, and kept up to date as values are stored, rather than summed
+  on every commit.
+
+  Files that failed to parse are kept apart, in quarantine, with the
+  reason they failed and the identity they had, for each decoder backend:
+  one that fails with the Python decoder is still tried with perl. A
+  quarantined file is released once it changes, or parses after all.
+
+  Changes are written in one transaction per commit() call. The cache may
+  be shared between threads, such as a server's reload thread and the
+  threads answering its queries (see server.py).
+
+  Attributes:
+    path: Path string of the sqlite database
+    max_bytes: Upper bound on the total size of stored values
+    size: Total size of the stored values, as far as this object knows.
+        Other processes sharing the database are counted when it is
+        opened, and again before evicting.
+  """
+
+  FILENAME = 'parse-cache.sqlite'
+
+  def __init__(self,cache_dir=None,max_bytes=256*1024*1024):
+    if cache_dir is None:
+      cache_dir = default_cache_dir()
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    self.path = join(cache_dir,DiskCache.FILENAME)
+    self.max_bytes = max_bytes
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(self.path,timeout=30,check_same_thread=False)
+    self.db.text_factory = str
+    self.db.execute("""CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY, value TEXT)""")
+    row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if not row or row[0] != CACHE_VERSION:
+      # A new decoder may parse what the old one could not, and a new
+      # schema may lay the tables out differently
+      self.db.execute("DROP TABLE IF EXISTS games")
+      self.db.execute("DROP TABLE IF EXISTS failures")
+      self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)",(CACHE_VERSION,))
+    self.db.execute("""CREATE TABLE IF NOT EXISTS games (
+        path TEXT, profile TEXT, size INTEGER, mtime REAL, hash TEXT,
+        data BLOB, last_used REAL, PRIMARY KEY (path, profile))""")
+    self.db.execute("""CREATE TABLE IF NOT EXISTS failures (
+        path TEXT, profile TEXT, decoder TEXT, size INTEGER, mtime REAL, hash TEXT,
+        reason TEXT, since REAL, PRIMARY KEY (path, profile, decoder))""")
+    self.db.commit()
+    self.size = self.stored_size()
+
+  def stored_size(self):
+    """Total size of the stored values, summed from the table"""
+    (total,) = self.db.execute("SELECT COALESCE(SUM(LENGTH(data)),0) FROM games").fetchone()
+    return total
+
+  def get(self,path,profile,identity):
+    """Return the packed game file dict (see unpack()), or None.
+
+    Args:
+      path: Path string of the game file
+      profile: Decode profile the dict was produced with
+      identity: (size, mtime, hash) of the file now, see file_identity()
+    """
+    with self.lock:
+      row = self.db.execute("""SELECT size, mtime, hash, data FROM games
+          WHERE path = ? AND profile = ?""",(path,profile)).fetchone()
+      if not row or tuple(row[0:3]) != tuple(identity):
+        return None
+      self.db.execute("UPDATE games SET last_used = ? WHERE path = ? AND profile = ?",
+                      (time.time(),path,profile))
+      return str(row[3])
+
+  def set(self,path,profile,identity,data):
+    """Store a packed game file dict (see pack()) under the file's current identity"""
+    with self.lock:
+      (size, mtime, digest) = identity
+      row = self.db.execute("SELECT LENGTH(data) FROM games WHERE path = ? AND profile = ?",
+                            (path,profile)).fetchone()
+      if row:
+        self.size -= row[0]
+      self.db.execute("INSERT OR REPLACE INTO games VALUES (?,?,?,?,?,?,?)",
+                      (path,profile,size,mtime,digest,sqlite3.Binary(data),time.time()))
+      self.size += len(data)
+      self.db.execute("DELETE FROM failures WHERE path = ? AND profile = ?",(path,profile))
+
+  def get_failure(self,path,profile,decoder,identity):
+    """The reason a file is quarantined for a decoder backend, or None if it
+    is not, or has changed since"""
+    with self.lock:
+      row = self.db.execute("""SELECT size, mtime, hash, reason FROM failures
+          WHERE path = ? AND profile = ? AND decoder = ?""",(path,profile,decoder)).fetchone()
+      if not row or tuple(row[0:3]) != tuple(identity):
+        return None
+      return row[3]
+
+  def set_failure(self,path,profile,decoder,identity,reason):
+    """Quarantine a file that failed to parse with a decoder backend, under its
+    current identity"""
+    with self.lock:
+      (size, mtime, digest) = identity
+      self.db.execute("INSERT OR REPLACE INTO failures VALUES (?,?,?,?,?,?,?,?)",
+                      (path,profile,decoder,size,mtime,digest,reason,time.time()))
+
+  def failures(self,profile,decoder):
+    """(path, identity, reason, since) of each file quarantined for a decoder
+    backend, by path"""
+    with self.lock:
+      rows = self.db.execute("""SELECT path, size, mtime, hash, reason, since FROM failures
+          WHERE profile = ? AND decoder = ? ORDER BY path""",(profile,decoder)).fetchall()
+      return [(r[0], tuple(r[1:4]), r[4], r[5]) for r in rows]
+
+  def commit(self):
+    """Evict down to max_bytes, and write out pending changes"""
+    with self.lock:
+      if self.size > self.max_bytes:
+        # Count again first: other processes may have stored or evicted
+        self.size = self.stored_size()
+      if self.size > self.max_bytes:
+        rows = self.db.execute("""SELECT path, profile, LENGTH(data) FROM games
+            ORDER BY last_used""").fetchall()
+        for (path, profile, length) in rows:
+          if self.size <= self.max_bytes:
+            break
+          self.db.execute("DELETE FROM games WHERE path = ? AND profile = ?",(path,profile))
+          self.size -= length
+      self.db.commit()
+
+  def clear(self):
+    """Discard every entry, and release every quarantined file"""
+    with self.lock:
+      self.db.execute("DELETE FROM games")
+      self.db.execute("DELETE FROM failures")
+      self.db.commit()
+      self.size = 0
+
+  def close(self):
+    with self.lock:
+      self.db.close()
+
+
+def open_disk_cache(cache_dir=None):
+  """Open a DiskCache, or return None with a warning if that fails.
+
+  A cache that cannot be opened (an unwritable home directory under a
+  web server, say) should slow things down, not stop them.
+  """
+  try:
+    return DiskCache(cache_dir)
+  except (OSError, IOError, sqlite3.Error), e:
+    print >>sys.stderr, "Disk cache disabled:", e
+    return None
+
+
+class GameCache(object):
+  """The tiers of the parse cache for one decode profile, fastest first
+
+  Lookups and stores take whole batches, so a tree load makes one
+  memcached round trip for its hits and one for its stores. memcached,
+  shared between processes and limited in item size, holds only
+  qualifier profile values; full profile dicts, boards and all, are kept
+  by the other tiers.
+
+  Memcache keys are the file's content hash, so a changed file is never
+  answered with its old game, and copies of a file share one entry. The
+  disk cache is keyed by path and checks the whole identity.
+
+  The dict of an ACBLscore CSV export depends on more than its contents:
+  the club name is taken from its directory, and the creation time from
+  its mtime (see Gamefile.init_from_csv_file()). Its keys take in the
+  path and mtime as well, so copies elsewhere are parsed on their own.
+
+  Attributes:
+    profile: Decode profile of the values
+    decoder: Name of the decoder backend, which failures are quarantined for
+    memory: MemoryCache, or None
+    mc: memcache.Client, or None
+    mc_tier: mc if it holds values of this profile, else None
+    disk: DiskCache, or None
+  """
+
+  def __init__(self,profile,memory=None,mc=None,disk=None,decoder=None):
+    self.profile = profile
+    self.decoder = decoder
+    self.memory = memory
+    self.mc = mc
+    self.mc_tier = mc if profile == QUALIFIER else None
+    self.disk = disk
+    self.invalidated = False
+
+  def key(self,gamefile,identity):
+    """The memory and memcached key of a game file with this identity"""
+    key = "nap:%s:%s:%s" % (CACHE_VERSION, self.profile, identity[2])
+    if gamefile.lower().endswith('.csv'):
+      # Hashed, since memcached keys may not have spaces
+      key += ":%s:%r" % (hashlib.sha1(gamefile).hexdigest(), identity[1])
+    return key
+
+  def get_many(self,items):
+    """Look up a batch of game files.
+
+    Args:
+      items: List of (gamefile, identity) pairs, see file_identity(). Files
+          with no identity are not looked up.
+    Returns:
+      Dictionary of the game files found to their game file dicts
+    """
+    wanted = {}
+    for (gamefile, identity) in items:
+      if identity:
+        wanted.setdefault(self.key(gamefile,identity),[]).append((gamefile, identity))
+    found = {}
+    if self.memory and wanted:
+      found.update(self.memory.get_multi(wanted.keys()))
+    missing = [k for k in wanted if k not in found]
+    if self.mc_tier and missing:
+      hits = self.mc_tier.get_multi(missing)
+      found.update(hits)
+      if self.memory and hits:
+        self.memory.set_multi(hits)
+    missing = [k for k in wanted if k not in found]
+    if self.disk and missing:
+      hits = {}
+      for key in missing:
+        for (gamefile, identity) in wanted[key]:
+          data = self.disk.get(gamefile,self.profile,identity)
+          if data is not None:
+            hits[key] = data
+            break
+      found.update(hits)
+      if hits:
+        self.share(hits)
+
+    games = {}
+    for (key, data) in found.items():
+      game_dict = unpack(data)
+      for (gamefile, identity) in wanted[key]:
+        games[gamefile] = game_dict
+    return games
+
+  def set_many(self,items):
+    """Store a batch of game file dicts.
+
+    Args:
+      items: List of (gamefile, identity, game_dict). Those with no
+          identity are not stored.
+    """
+    values = {}
+    for (gamefile, identity, game_dict) in items:
+      if not identity:
+        continue
+      key = self.key(gamefile,identity)
+      if key not in values:
+        values[key] = pack(game_dict)
+      if self.disk:
+        self.disk.set(gamefile,self.profile,identity,values[key])
+    if values:
+      self.share(values)
+      self.invalidated = True
+
+  def get_failures(self,items):
+    """Look up a batch of game files in quarantine, on disk.
+
+    Args:
+      items: List of (gamefile, identity) pairs
+    Returns:
+      Dictionary of the quarantined game files to the reasons they failed
+    """
+    reasons = {}
+    if self.disk:
+      for (gamefile, identity) in items:
+        if identity:
+          reason = self.disk.get_failure(gamefile,self.profile,self.decoder,identity)
+          if reason is not None:
+            reasons[gamefile] = reason
+    return reasons
+
+  def set_failures(self,items):
+    """Quarantine a batch of game files.
+
+    Args:
+      items: List of (gamefile, identity, GamefileException). Those with
+          no identity are not quarantined.
+    """
+    if self.disk:
+      for (gamefile, identity, e) in items:
+        if identity:
+          self.disk.set_failure(gamefile,self.profile,self.decoder,identity,failure_reason(e))
+
+  def failures(self):
+    """(path, identity, reason, since) of each file in quarantine, see DiskCache"""
+    return self.disk.failures(self.profile,self.decoder) if self.disk else []
+
+  def share(self,values):
+    """Copy values into the memory and memcached tiers"""
+    if self.memory:
+      self.memory.set_multi(values)
+    if self.mc_tier:
+      # memcached would refuse an oversized value silently. The disk cache
+      # still has it.
+      fits = dict((k, v) for (k, v) in values.items() if len(v) < MEMCACHE_MAX_VALUE)
+      if fits:
+        self.mc_tier.set_multi(fits)
+
+  def commit(self):
+    """Write out the disk tier, and drop derived memcache values once for the
+    batch if anything was stored"""
+    if self.disk:
+      self.disk.commit()
+    if self.invalidated and self.mc:
+      self.mc.delete_multi(DERIVED_KEYS)
+    self.invalidated = False
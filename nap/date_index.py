@@ -0,0 +1,153 @@
+"""Qualifying appearances in date order, for date-range questions
+
+Which players qualified in flight B between two dates? How many had
+qualified in flight A by the end of July? Each flight's qualifying
+appearances are kept in two parallel lists, dates and player keys, sorted
+by date, so a date range is found by bisection.
+
+Classes:
+    DateIndex: The qualifying appearances of a list of games, by date
+
+Functions:
+    iso_date: Parse a YYYY-MM-DD date
+    periods: Week or month periods covering a range of dates
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import bisect
+from datetime import date, datetime, timedelta
+
+PERIODS = ('week', 'month')
+
+
+def iso_date(text):
+  """The date of a YYYY-MM-DD string.
+
+  Exceptions:
+    ValueError if the string is not such a date
+  """
+  return datetime.strptime(text,"%Y-%m-%d").date()
+
+
+def periods(first,last,period='month'):
+  """Calendar periods covering the dates from first to last.
+
+  Weeks start on Monday.
+
+  Args:
+    first, last: dates (or datetimes)
+    period: 'week' or 'month'
+  Returns:
+    list of (start, end) dates of each period, end inclusive
+  """
+  if period not in PERIODS:
+    raise ValueError("Unknown period '%s', not one of %s" % (period, ", ".join(PERIODS)))
+  first = date.fromordinal(first.toordinal())
+  last = date.fromordinal(last.toordinal())
+  if period == 'week':
+    start = first - timedelta(days=first.weekday())
+  else:
+    start = first.replace(day=1)
+  result = []
+  while start <= last:
+    if period == 'week':
+      following = start + timedelta(days=7)
+    elif start.month == 12:
+      following = start.replace(year=start.year + 1,month=1)
+    else:
+      following = start.replace(month=start.month + 1)
+    result.append((start, following - timedelta(days=1)))
+    start = following
+  return result
+
+
+class DateIndex(object):
+  """The qualifying appearances of a list of games, in date order
+
+  Built from the games' own qualifications (Gamefile.qualifiers()), so a
+  player qualifies in a flight on the date of each game whose ranks
+  qualified them in it. Dates are ordinals, as date.toordinal().
+
+  Attributes:
+    dates: Dictionary of flight letter to a sorted list of the dates of
+        qualifying appearances
+    keys: Dictionary of flight letter to the player key of each entry in
+        dates
+    first: Dictionary of flight letter to a dictionary of player key to
+        the date the player first qualified in that flight
+    first_dates: Dictionary of flight letter to the sorted values of first
+  """
+
+  def __init__(self,games=()):
+    """Args:
+      games: Gamefiles, in date order (see Nap.get_game_list())
+    """
+    self.dates = {}
+    self.keys = {}
+    self.first = {}
+    for flight in ('a','b','c'):
+      self.dates[flight] = []
+      self.keys[flight] = []
+      self.first[flight] = {}
+    for game in games:
+      ordinal = game.get_qualdate().ptime.toordinal()
+      for (p, flights) in game.qualifiers():
+        self.add(ordinal,p.get_key(),flights)
+    self.finish()
+
+  @classmethod
+  def from_rows(cls,rows):
+    """A DateIndex of (date ordinal, player key, flights) rows, in any order.
+
+    For qualifications already tallied without their games, such as those
+    of a snapshot (see snapshot.py).
+    """
+    index = cls()
+    for (ordinal, key, flights) in sorted(rows,key=lambda row: row[0]):
+      index.add(ordinal,key,flights)
+    index.finish()
+    return index
+
+  def add(self,ordinal,key,flights):
+    """Add one player's qualifications on a date, no earlier than any added"""
+    for flight in flights:
+      self.dates[flight].append(ordinal)
+      self.keys[flight].append(key)
+      self.first[flight].setdefault(key,ordinal)
+
+  def finish(self):
+    """Sort the first qualifying dates, once every row is added"""
+    self.first_dates = {}
+    for flight in ('a','b','c'):
+      self.first_dates[flight] = sorted(self.first[flight].values())
+
+  def span(self):
+    """(first, last) date ordinals of all qualifying appearances, or None"""
+    dates = [self.dates[f] for f in ('a','b','c') if self.dates[f]]
+    if not dates:
+      return None
+    return (min(d[0] for d in dates), max(d[-1] for d in dates))
+
+  def qualified_between(self,flight,start,end,first_only=False):
+    """Keys of players who qualified in a flight from start to end, inclusive.
+
+    Args:
+      flight: One of {'a','b','c'}
+      start, end: Date ordinals
+      first_only: If True, only players who first qualified in the flight
+          in that range
+    Returns: set of player keys
+    """
+    lo = bisect.bisect_left(self.dates[flight],start)
+    hi = bisect.bisect_right(self.dates[flight],end)
+    keys = set(self.keys[flight][lo:hi])
+    if first_only:
+      first = self.first[flight]
+      keys = set(k for k in keys if first[k] >= start)
+    return keys
+
+  def qualified_by(self,flight,end):
+    """Number of players who had qualified in a flight on or before a date ordinal"""
+    return bisect.bisect_right(self.first_dates[flight],end)
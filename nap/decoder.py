@@ -0,0 +1,578 @@
+"""Decoder backends for ACBLscore game files
+
+A decoder turns a raw ACBLscore game file into the list-of-events dictionary
+structure that Gamefile.init_from_dict() expects.
+
+By default decoders use the "qualifier" profile: only event details, strats,
+sections, entries, players and ranks are decoded, since that is all the
+reports use. Boards and hand records are decoded only when a decoder is
+created with boards=True (the "full" profile).
+
+Classes:
+    DecoderFailure: A failure of the decoder rather than of the game file
+    Decoder: Base class, defines the batch interface decode_many()
+    PythonDecoder: The native decoder in gamefile.acbl_decode (default)
+    PerlDecoder: Runs ACBLgamedump.pl by Matthew J. Kidd, one process per file
+    PerlPoolDecoder: Keeps a pool of long-lived ACBLgameworker.pl processes
+    ParallelDecoder: Runs another decoder across a pool of Python processes
+    ConcurrentDecoder: Runs another decoder on a bounded number of threads
+
+Functions:
+    get_decoder: Return a decoder instance by name
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import os
+import json
+import time
+import Queue
+import select
+import threading
+import multiprocessing
+from subprocess import CalledProcessError, Popen, PIPE, STDOUT
+from os.path import join
+from gamefile import GamefileException
+from gamefile.acbl_decode import decode_file
+
+# This file's directory, necessary for finding ACBLdump utils
+__cwd__ = os.path.dirname(os.path.realpath(__file__))
+
+# Decode profiles
+QUALIFIER = 'qualifier'
+FULL = 'full'
+
+# Files a ConcurrentDecoder decodes at once, unless told otherwise
+DEFAULT_CONCURRENCY = 4
+
+
+class DecoderFailure(GamefileException):
+  """The decoder failed, not the game file: it ran out of time, or its
+  process died. The file may well decode next time, so unlike other
+  failures it is not quarantined (see cache.py)."""
+  pass
+
+
+def _timed_out(gamefile,timeout):
+  return DecoderFailure("Timed out after %s seconds decoding %s" % (timeout, gamefile))
+
+
+class Decoder(object):
+  """Base class for decoder backends
+
+  Subclasses implement decode() for a single file. Backends that can do
+  better than one file at a time also override decode_many().
+
+  Attributes:
+    boards: If True, decode boards and everything else (the full profile)
+    profile: QUALIFIER or FULL
+    timeout: Seconds allowed for decoding each file, or None for no limit.
+        The perl backends kill a decoder process that runs over. The
+        Python decoder cannot be interrupted, so its limit holds only when
+        it runs on the threads of a ConcurrentDecoder.
+  """
+
+  name = None
+
+  def __init__(self,boards=False,timeout=None):
+    self.boards = boards
+    self.profile = FULL if boards else QUALIFIER
+    self.timeout = timeout
+
+  def decode(self,gamefile):
+    raise NotImplementedError
+
+  def decode_many(self,gamefiles):
+    """Decode a batch of game files.
+
+    A file that fails to decode does not stop the batch. Its result is the
+    GamefileException describing the failure, naming the file.
+
+    Args:
+      gamefiles: List of path strings to ACBLscore game files
+
+    Yields:
+      (gamefile, result) tuples in the order given, where result is the
+      list of event dictionaries or a GamefileException
+    """
+    for gamefile in gamefiles:
+      try:
+        yield (gamefile, self.decode(gamefile))
+      except GamefileException, e:
+        yield (gamefile, e)
+
+  def close(self):
+    """Release any resources held by the decoder"""
+    pass
+
+
+class PythonDecoder(Decoder):
+  """Decode game files in-process with the pure Python port of ACBLgamedecode"""
+
+  name = 'python'
+
+  def decode(self,gamefile):
+    """Decode one game file.
+
+    Args:
+      gamefile: Path string to an ACBLscore game file on local storage
+
+    Returns:
+      list of event dictionaries
+
+    Exceptions:
+      GamefileException if the file is not an ACBLscore game file.
+    """
+    return decode_file(gamefile,qualifier=not self.boards)
+
+
+class PerlDecoder(Decoder):
+  """Decode game files by running ACBLgamedump.pl in a subprocess
+
+  ACBLgamedump is described at this link:
+    https://lajollabridge.com/Software/ACBLgamedump/ACBLgamedump-About.htm
+  """
+
+  name = 'perl'
+
+  def decode(self,gamefile):
+    """Decode one game file.
+
+    Args:
+      gamefile: Path string to an ACBLscore game file on local storage
+
+    Returns:
+      list of event dictionaries
+
+    Exceptions:
+      GamefileException if there is a parse error, or the decoder runs
+      longer than the timeout.
+    """
+    args = [join(__cwd__,"ACBLgamedump.pl")]
+    if not self.boards:
+      args.append("-nb")
+    args.append(gamefile)
+
+    # The JSON output is read from a pipe. The child's stdin is /dev/null
+    # and its stderr shares the pipe, so it needs none of this process's
+    # own stdio handles. (When this module is embedded in a web framework,
+    # those are frequently unavailable.)
+    with open(os.devnull,'r') as devnull:
+      proc = Popen(args,stdin=devnull,stdout=PIPE,stderr=STDOUT,close_fds=True)
+    expired = threading.Event()
+    timer = None
+    if self.timeout:
+      def expire():
+        expired.set()
+        _kill(proc)
+      timer = threading.Timer(self.timeout,expire)
+      timer.daemon = True
+      timer.start()
+    try:
+      output = proc.communicate()[0]
+    finally:
+      if timer:
+        timer.cancel()
+    if expired.is_set():
+      raise _timed_out(gamefile,self.timeout)
+    if proc.returncode != 0:
+      raise GamefileException(CalledProcessError(proc.returncode," ".join(args)))
+
+    if output.startswith('Not an ACBLscore game file'):
+      raise GamefileException(output)
+    try:
+      return json.loads(output)
+    except ValueError, e:
+      raise GamefileException(e)
+
+
+def _kill(proc):
+  """Kill a subprocess, unless it has exited already"""
+  try:
+    proc.kill()
+  except OSError:
+    pass
+
+
+class PerlWorker(object):
+  """One long-lived ACBLgameworker.pl process
+
+  The worker reads a file name per line and answers with one line of JSON,
+  so there is never more than one request outstanding on its pipes.
+  """
+
+  def __init__(self,switches=()):
+    worker = join(__cwd__,"ACBLgameworker.pl")
+    with open(os.devnull,'w') as devnull:
+      self.proc = Popen([worker] + list(switches), stdin=PIPE, stdout=PIPE,
+                        stderr=devnull, close_fds=True)
+    self.gamefile = None
+
+  def fileno(self):
+    return self.proc.stdout.fileno()
+
+  def send(self,gamefile):
+    """Ask the worker to decode a file. Returns False if the worker is gone."""
+    self.gamefile = gamefile
+    try:
+      self.proc.stdin.write(gamefile + "\n")
+      self.proc.stdin.flush()
+    except IOError:
+      return False
+    return True
+
+  def receive(self):
+    """Read the answer to the outstanding request.
+
+    Returns:
+      list of event dictionaries
+
+    Exceptions:
+      GamefileException if the file could not be decoded, or if the
+      worker died while decoding it.
+    """
+    gamefile = self.gamefile
+    self.gamefile = None
+    line = self.proc.stdout.readline()
+    if not line:
+      raise DecoderFailure("Decoder worker exited while decoding %s" % gamefile)
+    try:
+      answer = json.loads(line)
+    except ValueError, e:
+      raise GamefileException("Bad decoder output for %s: %s" % (gamefile, e))
+    if 'error' in answer:
+      raise GamefileException(answer['error'])
+    return answer['game']
+
+  def is_alive(self):
+    return self.proc.poll() is None
+
+  def close(self):
+    try:
+      self.proc.stdin.close()
+    except IOError:
+      pass
+    self.proc.wait()
+
+  def kill(self):
+    """Stop the worker in the middle of a file"""
+    _kill(self.proc)
+    self.close()
+    self.proc.stdout.close()
+
+
+class PerlPoolDecoder(Decoder):
+  """Decode game files with a pool of long-lived perl worker processes
+
+  Interpreter start-up and loading ACBLgamedecode.pm are paid once per
+  worker rather than once per file. Workers are started on first use and
+  replaced if one dies, or is killed for running over the timeout.
+
+  Attributes:
+    workers: Number of worker processes to keep
+  """
+
+  name = 'perl-pool'
+
+  def __init__(self,boards=False,workers=None,timeout=None):
+    Decoder.__init__(self,boards,timeout)
+    if workers is None:
+      workers = min(4,multiprocessing.cpu_count())
+    self.workers = max(1,workers)
+    self.switches = () if boards else ('-nb',)
+    self.pool = []
+
+  def start(self):
+    """Bring the pool up to strength, replacing dead workers"""
+    self.pool = [w for w in self.pool if w.is_alive()]
+    while len(self.pool) < self.workers:
+      self.pool.append(PerlWorker(self.switches))
+    return self.pool
+
+  def decode(self,gamefile):
+    for (gamefile, result) in self.decode_many([gamefile]):
+      if isinstance(result,GamefileException):
+        raise result
+      return result
+
+  def decode_many(self,gamefiles):
+    """Decode a batch of game files across the worker pool.
+
+    Each worker is handed the next file as soon as it answers. Results are
+    yielded in the order the files were given.
+    """
+    gamefiles = list(gamefiles)
+    queue = list(enumerate(gamefiles))
+    queue.reverse()
+    results = {}
+    next_result = 0
+    busy = {}
+    idle = list(self.start())
+
+    while queue or busy:
+      # Hand out work to every idle worker
+      while queue and idle:
+        worker = idle.pop()
+        (idx, gamefile) = queue.pop()
+        if worker.send(gamefile):
+          busy[worker] = (idx, time.time() + self.timeout if self.timeout else None)
+        else:
+          results[idx] = DecoderFailure(
+              "Decoder worker exited before decoding %s" % gamefile)
+
+      if busy:
+        wait = None
+        if self.timeout:
+          wait = max(0,min(deadline for (idx, deadline) in busy.values()) - time.time())
+        (ready, _, _) = select.select(busy.keys(),[],[],wait)
+        for worker in ready:
+          (idx, deadline) = busy.pop(worker)
+          try:
+            results[idx] = worker.receive()
+          except GamefileException, e:
+            results[idx] = e
+          if not worker.is_alive():
+            worker = self.replace(worker)
+          idle.append(worker)
+        if self.timeout:
+          now = time.time()
+          for worker in [w for (w, (i, d)) in busy.items() if d <= now]:
+            (idx, deadline) = busy.pop(worker)
+            results[idx] = _timed_out(worker.gamefile,self.timeout)
+            worker.kill()
+            idle.append(self.replace(worker))
+
+      # Release finished results in order
+      while next_result in results:
+        yield (gamefiles[next_result], results.pop(next_result))
+        next_result += 1
+
+  def replace(self,worker):
+    """Swap a dead or killed worker for a new one"""
+    self.pool.remove(worker)
+    worker = PerlWorker(self.switches)
+    self.pool.append(worker)
+    return worker
+
+  def close(self):
+    for worker in self.pool:
+      worker.close()
+    self.pool = []
+
+
+# The decoder of a ParallelDecoder worker process
+_worker_decoder = None
+
+
+def _init_worker(name,boards,timeout):
+  global _worker_decoder
+  _worker_decoder = DECODERS[name](boards=boards,timeout=timeout)
+
+
+def _decode_in_worker(gamefile):
+  """Decode one file in a pool process.
+
+  GamefileException does not survive pickling, so errors come back as
+  strings, with the class to rebuild them as: (gamefile, game_dict, None)
+  or (gamefile, None, (exception class, message)).
+  """
+  try:
+    return (gamefile, _worker_decoder.decode(gamefile), None)
+  except GamefileException, e:
+    return (gamefile, None, (e.__class__, e.value))
+  except Exception, e:
+    return (gamefile, None, (DecoderFailure, "Decoder failed on %s: %r" % (gamefile, e)))
+
+
+class ParallelDecoder(Decoder):
+  """Spread decode_many() across a pool of worker processes
+
+  Each worker process runs its own instance of another decoder backend and
+  sends back only the decoded dict, which is compact and picklable. Single
+  files are decoded in-process.
+
+  Attributes:
+    inner: Name of the decoder backend the workers run
+    jobs: Number of worker processes
+  """
+
+  name = 'parallel'
+
+  def __init__(self,inner=PythonDecoder.name,boards=False,jobs=None,timeout=None):
+    Decoder.__init__(self,boards,timeout)
+    if jobs is None:
+      jobs = multiprocessing.cpu_count()
+    self.inner = inner
+    self.jobs = max(1,jobs)
+    self.local = DECODERS[inner](boards=boards,timeout=timeout)
+
+  def decode(self,gamefile):
+    return self.local.decode(gamefile)
+
+  def decode_many(self,gamefiles):
+    """Decode a batch of game files across the process pool.
+
+    Results are yielded in the order the files were given, no matter which
+    worker finishes first.
+    """
+    gamefiles = list(gamefiles)
+    if self.jobs == 1 or len(gamefiles) < 2:
+      for result in self.local.decode_many(gamefiles):
+        yield result
+      return
+
+    chunksize = max(1,len(gamefiles) // (self.jobs * 4))
+    pool = multiprocessing.Pool(self.jobs,_init_worker,(self.inner,self.boards,self.timeout))
+    try:
+      for (gamefile, game_dict, error) in pool.imap(_decode_in_worker,gamefiles,chunksize):
+        if error is not None:
+          yield (gamefile, error[0](error[1]))
+        else:
+          yield (gamefile, game_dict)
+      pool.close()
+    finally:
+      pool.terminate()
+      pool.join()
+
+  def close(self):
+    self.local.close()
+
+
+class ConcurrentDecoder(Decoder):
+  """Spread decode_many() across a bounded number of threads
+
+  Each thread runs its own instance of another decoder backend, so at most
+  concurrency files are decoded at once. The perl backends spend their
+  time waiting on a subprocess, and their threads decode side by side; the
+  Python decoder's threads take turns, but the calling thread still waits
+  no longer than the timeout for any one file.
+
+  A file that runs over the timeout is given up on, and its result is a
+  GamefileException. A perl process is killed. An in-process decode is
+  left to finish on its thread, whose result is dropped, and a new thread
+  takes its place. The old thread is retired: once the decode returns it
+  exits rather than take another file, so no more than concurrency files
+  are ever decoded at once, besides those given up on.
+
+  Attributes:
+    inner: Name of the decoder backend the threads run
+    concurrency: Number of threads
+  """
+
+  name = 'concurrent'
+
+  def __init__(self,inner=PythonDecoder.name,boards=False,concurrency=DEFAULT_CONCURRENCY,
+               timeout=None):
+    Decoder.__init__(self,boards,timeout)
+    self.inner = inner
+    self.concurrency = max(1,concurrency)
+
+  def new_decoder(self):
+    """The decoder of one thread. The threads are the pool, so a perl pool
+    has one worker each."""
+    if self.inner == PerlPoolDecoder.name:
+      return PerlPoolDecoder(self.boards,workers=1,timeout=self.timeout)
+    return DECODERS[self.inner](boards=self.boards,timeout=self.timeout)
+
+  def decode(self,gamefile):
+    for (gamefile, result) in self.decode_many([gamefile]):
+      if isinstance(result,GamefileException):
+        raise result
+      return result
+
+  def decode_many(self,gamefiles):
+    """Decode a batch of game files across the threads.
+
+    Results are yielded in the order the files were given, each as soon as
+    it and the files before it are done.
+    """
+    gamefiles = list(gamefiles)
+    tasks = Queue.Queue()
+    for task in enumerate(gamefiles):
+      tasks.put(task)
+    answers = Queue.Queue()
+    started = {}
+    # The retired event of the thread decoding each file
+    workers = {}
+
+    def work(retired):
+      decoder = self.new_decoder()
+      try:
+        while not retired.is_set():
+          try:
+            (idx, gamefile) = tasks.get_nowait()
+          except Queue.Empty:
+            return
+          workers[idx] = retired
+          started[idx] = time.time()
+          try:
+            result = decoder.decode(gamefile)
+          except GamefileException, e:
+            result = e
+          except Exception, e:
+            result = DecoderFailure("Decoder failed on %s: %r" % (gamefile, e))
+          answers.put((idx, result))
+      finally:
+        decoder.close()
+
+    def start_thread():
+      thread = threading.Thread(target=work,args=(threading.Event(),),name='nap-decode')
+      thread.daemon = True
+      thread.start()
+
+    for i in range(min(self.concurrency,len(gamefiles))):
+      start_thread()
+
+    results = {}
+    next_result = 0
+    try:
+      while next_result < len(gamefiles):
+        if next_result in results:
+          yield (gamefiles[next_result], results.pop(next_result))
+          next_result += 1
+          continue
+        wait = self.timeout
+        if self.timeout and next_result in started:
+          wait = started[next_result] + self.timeout - time.time()
+          if wait <= 0:
+            results[next_result] = _timed_out(gamefiles[next_result],self.timeout)
+            workers[next_result].set()
+            start_thread()
+            continue
+        try:
+          (idx, result) = answers.get(True,wait)
+        except Queue.Empty:
+          continue
+        if idx >= next_result:
+          results.setdefault(idx,result)
+    finally:
+      # If the caller stops early, the threads stop after their current file
+      while not tasks.empty():
+        try:
+          tasks.get_nowait()
+        except Queue.Empty:
+          break
+
+
+DECODERS = {
+  PythonDecoder.name: PythonDecoder,
+  PerlDecoder.name: PerlDecoder,
+  PerlPoolDecoder.name: PerlPoolDecoder,
+}
+
+
+def get_decoder(name=None,boards=False,timeout=None):
+  """Return a decoder instance by name.
+
+  Args:
+    name: One of the keys of DECODERS. If None, the NAP_DECODER environment
+        variable is consulted, falling back to the Python decoder.
+    boards: If True, use the full profile and decode boards as well
+    timeout: Seconds allowed for each file, see Decoder
+  """
+  if name is None:
+    name = os.environ.get('NAP_DECODER',PythonDecoder.name)
+  if name not in DECODERS:
+    raise ValueError("Unknown decoder: %s" % name)
+  return DECODERS[name](boards=boards,timeout=timeout)
@@ -0,0 +1,107 @@
+"""What a file in a game file tree is, from its first bytes
+
+Clubs keep more than game files in their directories: READMEs, PDFs,
+BWS files, backups. Rather than hand each one to a decoder (for the perl
+decoders, a process per file) to find out it is not a game, a file is
+sniffed first. One read of its header says whether it is an ACBLscore
+game file, an ACBLscore CSV export, or something to skip.
+
+The files a tree walk takes at all can be narrowed with include and
+exclude patterns.
+
+Functions:
+    sniff: Classify a file as ACBL, CSV or SKIP
+    selected: Whether a file passes include and exclude patterns
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import os
+import struct
+from fnmatch import fnmatchcase
+from gamefile.acbl_decode import MAGIC, MAX_EVENTS
+
+# How a file is to be parsed
+ACBL = 'acbl'
+CSV = 'csv'
+SKIP = 'skip'
+
+# The fixed header of an ACBLscore game file ends with the last field the
+# decoders read from it, the note pointer at 0x9e3
+HEADER_SIZE = 0x9e7
+
+# The table of event pointers in the header
+_EVENTS = struct.Struct('<%dI' % MAX_EVENTS)
+EVENTS_OFFSET = 0x12
+
+# Bytes of a CSV file looked at for a line of text with a comma in it
+CSV_SNIFF = 512
+
+
+def sniff(path):
+  """How to parse a file, judged from its first bytes.
+
+  An ACBLscore game file starts with the magic bytes, is long enough for
+  the whole header, and has at least one event, every event within the
+  file. A CSV file is one named *.csv whose first line is text with a
+  comma in it. Anything else is skipped.
+
+  Args:
+    path: Path string to a file on local storage
+  Returns:
+    (kind, reason): kind is ACBL, CSV or SKIP, and reason is why a file
+    is skipped, or None
+  """
+  try:
+    with open(path,'rb') as f:
+      size = os.fstat(f.fileno()).st_size
+      head = f.read(HEADER_SIZE)
+  except (IOError, OSError), e:
+    return (SKIP, str(e))
+
+  if head.startswith(MAGIC):
+    if len(head) < HEADER_SIZE:
+      return (SKIP, "Truncated ACBLscore game file: %s" % path)
+    pointers = [p for p in _EVENTS.unpack_from(head,EVENTS_OFFSET) if p]
+    if not pointers:
+      return (SKIP, "ACBLscore game file with no events: %s" % path)
+    if max(pointers) >= size:
+      return (SKIP, "Truncated ACBLscore game file: %s" % path)
+    return (ACBL, None)
+
+  if path.lower().endswith('.csv'):
+    line = head[0:CSV_SNIFF].split('\n',1)[0]
+    if '\0' in line or ',' not in line:
+      return (SKIP, "Not a CSV file: %s" % path)
+    return (CSV, None)
+
+  return (SKIP, "Not an ACBLscore game file: %s (skipped)" % path)
+
+
+def selected(relpath,include=(),exclude=()):
+  """Whether a file of a tree is to be walked.
+
+  Patterns are shell wildcards, with case ignored. One with a slash in it
+  is matched against the path relative to the top of the tree, starting
+  at any directory, and its * also matches slashes; any other pattern
+  against the file name alone. So "*.pdf" excludes every PDF, and "old/*"
+  everything under any directory named old.
+
+  Args:
+    relpath: Path of the file relative to the top of the tree
+    include: If any patterns are given, only files matching one of them
+    exclude: Files matching any of these patterns are not walked
+  """
+  relpath = relpath.replace(os.sep,'/').lower()
+  name = relpath.rsplit('/',1)[-1]
+
+  def matches(pattern):
+    pattern = pattern.lower()
+    if '/' in pattern:
+      return fnmatchcase(relpath,pattern) or fnmatchcase(relpath,'*/' + pattern)
+    return fnmatchcase(name,pattern)
+
+  if include and not any(matches(p) for p in include):
+    return False
+  return not any(matches(p) for p in exclude)
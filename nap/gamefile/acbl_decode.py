@@ -0,0 +1,814 @@
+"""Pure Python decoder for ACBLscore binary game files
+
+This is a port of ACBLgamedecode.pm by Matthew J. Kidd, which is included
+in this package as package_data. It produces the same dictionary structure
+as ACBLgamedump.pl does in JSON, so the result can be handed directly to
+Gamefile.init_from_dict().
+
+The game file layout is described at this link:
+  http://lajollabridge.com/Articles/ACBLscoreGameFilesDecoded.htm
+
+Bridgemate / BridgePad / BridgeScorer (BWS) integration is not supported.
+
+Functions:
+    decode_file: Decode a game file on local storage
+    decode: Decode a game file already held in memory
+"""
+
+import os
+import mmap
+import struct
+from gamefile_exception import GamefileException
+
+# Version of decoded data, identical to ACBLgamedecode.pm
+DECODE_FORMAT_VERSION = 4
+
+# Bump whenever this decoder's output changes, to invalidate caches
+DECODER_REVISION = 1
+
+# Magic bytes that appear at the start of all ACBLscore game files
+MAGIC = "\x12\x0a\x03AC3"
+
+# ACBLscore constants
+MAX_EVENTS = 50
+MAX_SECTIONS = 100
+
+# ACBLscore event types and scoring methods
+EVENT_TYPE = ['Pairs', 'Teams', 'Individual', 'Home Style Pairs', 'BAM', 'Series Winner']
+EVENT_SCORING = ['Matchpoints', 'IMPs with computed datum', 'Average IMPs', 'Total IMPs',
+  'Instant Matchpoints', 'BAM Teams', 'Win/Loss', 'Victory Points', 'Knockout', None,
+  'Series Winner', None, None, None, None, None, 'BAM Matchpoints', None, 'Compact KO']
+EVENT_RATING = ['No Masterpoints', 'Club Masterpoint', 'Club Championship',
+  'Charity Club Championship', 'Unit Championship', 'Sectional', 'Regional',
+  'Club International Fund', 'Club Membership', None, None, None, 'Upgraded Club Championship',
+  None, 'STAC', 'National', 'Bridge Plus', 'Progressive Sectional', 'Unit Charity Game',
+  'Unit Extended Team Game', 'NAP Club Level', 'NAP Unit Level', 'GNT Club Level', 'GNT Unit Level',
+  'ACBL Wide Charity', 'ACBL Wide International Fund', None, 'Canada Wide Olympiad',
+  'World Wide Instant Matchpoints', 'ACBL Wide Instant Matchpoints', 'Junior Fund', None,
+  'ACBL Wide Senior', 'COPC Club Level', 'CNTC Master/Non Master', 'CNTC Club Level',
+  'CNTC Unit Level', 'CWTC', 'Canada Rookie/Master', 'Inter-Club Championship',
+  'Unit Wide Championship', None, None, 'Club Appreciation', None, None, None, None, None,
+  'Club Appreciation Team', 'NABC Fund Raiser', 'GNT Fund Raiser', 'CNTC Fund Raiser', None, None,
+  'Club Education Foundation', 'Unit International Fund', 'Club Membership', 'Unit Education Fund',
+  None, None, None, None, 'Grass Roots Fund']
+MOVEMENT_TYPE = ['Mitchell', 'Howell', 'Web', 'External', 'External BAM', 'Barometer',
+  'Manual Mitchell', 'Manual Howell']
+
+CLUB_GAME_TYPE = ['Open', 'Invitational', 'Novice', 'BridgePlus', 'Pupil', 'Introductory']
+ACBL_PLAYER_RANKS = {' ': 'Rookie', 'A': 'Junior Master', 'B': 'Club Master',
+  'C': 'Sectional Master', 'D': 'Regional Master', 'E': 'NABC Master',
+  'F': 'Advanced NABC Master', 'G': 'Life Master', 'H': 'Bronze Life Master',
+  'I': 'Silver Life Master', 'J': 'Gold Life Master', 'K': 'Diamond Life Master',
+  'L': 'Emerald Life Master', 'M': 'Platinum Life Master', 'N': 'Grand Life Master',
+}
+AWARD_SETS = ['previous', 'current', 'total']
+PIGMENTATION_TYPES = ' BSRGP'
+RIBBON_COLORS = ['', 'Blue', 'Red', 'Silver', None, None, None, None, None, 'Blue/Red']
+HANDICAP_TYPES = ['Not Handicapped', 'Percentage', 'Matchpoints', 'Boards']
+
+SPECIAL_SCORES = {900: 'Late Play', 950: 'Not Played',
+  2040: 'Ave-', 2050: 'Ave', 2060: 'Ave+'}
+
+FOUL_GROUP_OFFSET = 2000
+
+# Structure parameters
+STRAT_STRUCTURE_SIZE = 95
+SECTION_SUMMARY_BASE = 0x13e
+SECTION_SUMMARY_SIZE = 22
+PLAYER_STRUCTURE_SIZE = 120
+TEAM_MATCH_ENTRY_SIZE = 32
+
+# Precompiled little-endian field formats
+_U8 = struct.Struct('<B')
+_S8 = struct.Struct('<b')
+_U16 = struct.Struct('<H')
+_S16 = struct.Struct('<h')
+_U32 = struct.Struct('<I')
+_U16X2 = struct.Struct('<HH')
+_U16X3 = struct.Struct('<3H')
+_U16X6 = struct.Struct('<6H')
+_U8X3 = struct.Struct('<3B')
+_U32X4 = struct.Struct('<4I')
+_S32X6 = struct.Struct('<6i')
+_U16BE = struct.Struct('>H')
+_AWARD = struct.Struct('<HBBHBBHBB')
+_BOARD_IDX = struct.Struct('<BxHI')
+_RESULTS = {
+  2: struct.Struct('<BB' + 'HhI' * 2),
+  4: struct.Struct('<BB' + 'HhI' * 4),
+}
+
+
+def _pick(table, index):
+  """Array lookup that yields None past the end, like a perl array"""
+  if 0 <= index < len(table):
+    return table[index]
+  return None
+
+
+class GameDecoder(object):
+  """Decodes the binary image of one ACBLscore game file
+
+  The methods follow the subroutines of ACBLgamedecode.pm closely, so the
+  two can be compared side by side when the file format needs attention.
+
+  Attributes:
+    data: Any object supporting the buffer interface, usually an mmap
+    noboards: If True, board results are not decoded
+    noentries: If True, entries (and so players) are not decoded
+    sectionsonly: If True, decoding stops at the section summary
+    qualifier: If True, decode only what qualifier reports use: event
+        details, strats, sections, entries, players and ranks. Boards,
+        team matches, masterpoint awards, pigmentation, section combining
+        and memos are left out.
+  """
+
+  def __init__(self,data,noboards=False,noentries=False,sectionsonly=False,
+               qualifier=False):
+    self.data = data
+    self.qualifier = qualifier
+    self.noboards = noboards or qualifier
+    self.noentries = noentries
+    self.sectionsonly = sectionsonly
+
+  def u8(self,p):
+    return _U8.unpack_from(self.data,p)[0]
+
+  def s8(self,p):
+    return _S8.unpack_from(self.data,p)[0]
+
+  def u16(self,p):
+    return _U16.unpack_from(self.data,p)[0]
+
+  def s16(self,p):
+    return _S16.unpack_from(self.data,p)[0]
+
+  def u32(self,p):
+    return _U32.unpack_from(self.data,p)[0]
+
+  def char(self,p):
+    return self.data[p:p+1].decode('latin-1')
+
+  def zstring(self,p):
+    """String where the first byte gives the length of the string"""
+    length = _U8.unpack_from(self.data,p)[0]
+    return self.data[p+1:p+1+length].decode('latin-1')
+
+  def zstrings(self,d,p,fields):
+    """Decode a sequence of (field name, offset) zstrings into dict d"""
+    for name, offset in fields:
+      d[name] = self.zstring(p + offset)
+
+  def datetime(self,p):
+    """ACBLscore (Pascal?) 32-bit encoded date and time"""
+    (tm, dt) = _U16X2.unpack_from(self.data,p)
+    return '%d-%02d-%02dT%02d:%02d:%02d' % ((dt >> 9) + 1980, (dt >> 5) & 0x0F,
+        dt & 0x1F, tm >> 11, (tm >> 5) & 0x3F, (tm << 1) & 0x3F)
+
+  def real48(self,p):
+    """48-bit Pascal real number"""
+    if self.data[p:p+6] == "\x00\x00\x00\x00\x00\x00":
+      return 0
+    # The perl module unpacks the mantissa with 'n', which reads only two
+    # bytes, big-endian. Do the same so both decoders agree.
+    exp = _U8.unpack_from(self.data,p)[0]
+    mid = _U16BE.unpack_from(self.data,p+1)[0]
+    byte6 = _U8.unpack_from(self.data,p+5)[0]
+    mantissa = mid / 4294967296.0
+    mantissa += byte6 & 0x7F
+    mantissa *= 0.0078125
+    mantissa += 1
+    if byte6 & 0x80:
+      mantissa = -mantissa
+    return mantissa * 2.0 ** (exp - 129)
+
+  def memonote(self,p,kind):
+    """Decode an ACBLscore Memo or Note structure"""
+    linelen = 64 if kind == 'memo' else 76
+    linecount = self.u16(p + 4)
+    text = []
+    for i in range(linecount):
+      text.append(self.zstring(p + 6 + i * linelen) + "\n")
+    return ''.join(text)
+
+  def decode(self,fname):
+    """Decode the whole game file
+
+    Args:
+      fname: File name to record in the result
+
+    Returns:
+      dict in the same form as one element of the ACBLgamedump.pl output
+
+    Exceptions:
+      GamefileException if the magic bytes are missing.
+    """
+    if self.data[0:6] != MAGIC:
+      raise GamefileException("Not an ACBLscore game file: %s (skipped)" % fname)
+
+    gm = {'filename': fname, 'decode_format_version': DECODE_FORMAT_VERSION}
+    gm['ACBLscore_version'] = '%.2f' % (self.u16(0x9db) / 100.0)
+    gm['ACBLscore_min_compatible_version'] = '%.2f' % (self.u16(0x9e1) / 100.0)
+    gm['creation_timestamp'] = self.datetime(0x9dd)
+    if not self.qualifier:
+      pmemonote = self.u32(0x9d6)
+      if pmemonote:
+        gm['memo'] = self.memonote(pmemonote,'memo')
+      pmemonote = self.u32(0x9e3)
+      if pmemonote:
+        gm['note'] = self.memonote(pmemonote,'note')
+
+    events = []
+    for i in range(MAX_EVENTS):
+      p = self.u32(0x12 + 4*i)
+      if not p:
+        continue
+      event_type_id = self.u8(0xda + i)
+      event_scoring_id = self.u8(0x10c + i)
+      ev = {
+        'event_id': i+1,
+        'event_type_id': event_type_id,
+        'event_type': _pick(EVENT_TYPE,event_type_id),
+        'event_scoring_id': event_scoring_id,
+        'event_scoring': _pick(EVENT_SCORING,event_scoring_id),
+      }
+      rankstr = self.event_details(ev,p)
+      if not self.qualifier:
+        self.add_section_combining(ev)
+      self.add_sections(ev,rankstr)
+      events.append(ev)
+    if events:
+      gm['event'] = events
+    return gm
+
+  def event_details(self,ev,p):
+    """Parse event details, returning the string of strat letters"""
+    is_teams = ev['event_type_id'] == 1
+
+    ev['mp_rating'] = {
+      'p-factor': self.u16(p + 0x7d) / 1000.0,
+      't-factor': self.u16(p + 0x83) / 1000.0,
+      's-factor': self.u16(p + 0x24f) / 100.0,
+    }
+
+    # A club session number of zero marks results from a tournament
+    club_session_num = self.u8(p + 0x95)
+    is_tourney = 1 if club_session_num == 0 else 0
+
+    ev['tournament_flag'] = is_tourney
+    if not is_tourney:
+      ev['club_num'] = self.zstring(p + 0xb0)
+      ev['club_session_num'] = club_session_num
+      ev['club_game_type'] = _pick(CLUB_GAME_TYPE,self.u8(p + 0xa1))
+    ev['rating_id'] = self.u8(p + 0x88)
+    ev['rating'] = _pick(EVENT_RATING,ev['rating_id'])
+    ev['session_num'] = self.u8(p + 0x8c)
+    ev['handicap_type_id'] = self.s8(p + 0x8d)
+    if ev['handicap_type_id']:
+      ev['handicap_type'] = _pick(HANDICAP_TYPES,abs(ev['handicap_type_id']))
+      ev['handicap_scoring'] = 'single-ranking' if ev['handicap_type_id'] < 0 \
+          else 'double-ranking'
+    ev['nstrats'] = self.u8(p + 0x9e)
+    ev['nsessions'] = self.u8(p + 0x9f)
+    ev['consolation_flag'] = self.u8(p + 0xa0)
+    ev['modification_timestamp'] = self.datetime(p + 0xb7)
+    if is_teams:
+      ev['nbrackets'] = self.u8(p + 0xc2)
+      ev['bracket_num'] = self.u8(p + 0xc3)
+    else:
+      ev['continuous_pairs_flag'] = self.u8(p + 0xce)
+    ev['senior_event_flag'] = self.u8(p + 0x251)
+    ev['mp_award_revision_num'] = self.u8(p + 0x254)
+    ev['stratify_by_avg_flag'] = self.u8(p + 0x2c8)
+    ev['non_ACBL_flag'] = self.u8(p + 0x2ca)
+    ev['final_session_flag'] = int(ev['session_num'] == ev['nsessions'])
+    ev['game_sanction_fee'] = self.real48(p + 0x275)
+    ev['table_sanction_fee'] = self.real48(p + 0x27b)
+    ev['charity_table_sanction_fee'] = self.real48(p + 0x281)
+
+    self.zstrings(ev, p, (
+      ('event_name', 0x4),
+      ('session_name', 0x1e),
+      ('city' if is_tourney else 'director', 0x2c),
+      ('sanction', 0x3d),
+      ('date', 0x48),
+      ('tournament' if is_tourney else 'club', 0x5c),
+      ('event_code', 0x76),
+      ('qual_event_code', 0xc5),
+      ('hand_set', 0x244),
+      ('local_charity', 0x295),
+    ))
+
+    pmemo = self.u32(p + 0xbd)
+    if pmemo and not self.qualifier:
+      ev['memo'] = self.memonote(pmemo,'memo')
+
+    rankstr = ''
+    if ev['nstrats']:
+      ev['strat'] = []
+    for i in range(ev['nstrats']):
+      st = self.strat(p + 0xd4 + i * STRAT_STRUCTURE_SIZE)
+      lm_elig = self.u8(p + 0x1f7 + i)
+      if lm_elig == -1:
+        st['LM_eligibility'] = 'LM Only'
+      elif lm_elig == 1:
+        st['LM_eligibility'] = 'NLM Only'
+      else:
+        st['LM_eligibility'] = 'No Restriction'
+      ev['strat'].append(st)
+      rankstr += st['letter']
+    return rankstr
+
+  def strat(self,p):
+    """Parse a strat structure"""
+    st = {
+      'first_overall_award': self.u16(p + 0x10) / 100.0,
+      'ribbon_color': _pick(RIBBON_COLORS,self.u8(p + 0x12)),
+      'ribbon_depth': self.u8(p + 0x13),
+      'mpt_factor': self.u32(p + 0x14) / 10000.0,
+      'overall_award_depth': self.u16(p + 0x18),
+      'table_basis': self.u8(p + 0x1a),
+      'min_mp': self.u16(p + 0x1e),
+      'max_mp': self.u16(p + 0x20),
+      'letter': self.char(p + 0x22),
+      'club_pct_open_rating': self.u8(p + 0x23),
+      'event_m_factor': self.real48(p + 0x24),
+      'session_m_factor': self.real48(p + 0x2a),
+    }
+    if not self.qualifier:
+      st['pigmentation_breakdown'] = {
+        'overall': self.pigmentation(p + 0x32),
+        'session': self.pigmentation(p + 0x41),
+        'section': self.pigmentation(p + 0x50),
+      }
+    return st
+
+  def pigmentation(self,p):
+    """Parse a masterpoint pigmentation structure"""
+    pct = _U16X3.unpack_from(self.data,p)
+    mp = _U16X3.unpack_from(self.data,p+6)
+    tp = _U8X3.unpack_from(self.data,p+12)
+    pgset = []
+    for i in range(3):
+      if not pct[i]:
+        break
+      pgset.append({'pct': pct[i] / 100.0, 'mp': mp[i] / 100.0,
+                    'type': PIGMENTATION_TYPES[tp[i]:tp[i]+1]})
+    return pgset
+
+  def add_section_combining(self,ev):
+    """Work out how sections are combined and ranked together"""
+    combining_and_ranking = []
+    for i in range(MAX_SECTIONS):
+      p = SECTION_SUMMARY_BASE + SECTION_SUMMARY_SIZE * i
+      if self.u8(p) != ev['event_id']:
+        continue
+      if self.u8(p + 0xf) != 0:
+        continue
+      # Found first section in a group of combined sections
+      combined = []
+      pc = p
+      while True:
+        if self.u8(pc + 0x11) == 0:
+          # First section in a group of sections ranked together
+          ranked_together = []
+          pr = pc
+          while True:
+            ranked_together.append(self.zstring(pr + 0x1))
+            next_rank = self.u8(pr + 0x12)
+            if next_rank == 0:
+              combined.append(ranked_together)
+              break
+            pr = SECTION_SUMMARY_BASE + SECTION_SUMMARY_SIZE * (next_rank-1)
+        next_score = self.u8(pc + 0x10)
+        if next_score == 0:
+          break
+        pc = SECTION_SUMMARY_BASE + SECTION_SUMMARY_SIZE * (next_score-1)
+      combining_and_ranking.append(combined)
+    ev['combining_and_ranking'] = combining_and_ranking
+
+  def add_sections(self,ev,rankstr):
+    """Search the Master Table for all sections belonging to the event"""
+    for i in range(MAX_SECTIONS):
+      p = SECTION_SUMMARY_BASE + i * SECTION_SUMMARY_SIZE
+      if self.u8(p) != ev['event_id']:
+        continue
+      sc = self.section(p,ev['event_type_id'],rankstr)
+      ev.setdefault('section',{})[sc['letter']] = sc
+
+  def section(self,p,event_type_id,rankstr):
+    """Parse one section within an event"""
+    sc = {'letter': self.zstring(p+1), 'rounds': self.u8(p + 0x14)}
+    sc['is_scored'] = self.u8(p + 0xe) & 1
+
+    # Board Results pointer
+    pboardidx = self.u32(p + 8)
+
+    # Move on to Section Details Structure
+    p = self.u32(p + 4)
+
+    pindex = _U32X4.unpack_from(self.data,p + 4)
+    is_teams = event_type_id == 1
+    is_indy = event_type_id == 2
+    is_home_style_pairs = event_type_id == 3
+    is_bam = int(event_type_id == 4)
+
+    highest_pairnum = self.u16(p + 0x1b)
+
+    if not is_teams:
+      sc['movement_type'] = _pick(MOVEMENT_TYPE,self.u8(p + 0x18))
+      sc['is_barometer'] = self.u8(p + 0x47)
+      sc['is_web'] = self.u8(p + 0x60)
+    sc['is_bam'] = is_bam
+
+    if not is_teams:
+      sc['nboards'] = self.u16(p + 0x19)
+      sc['highest_teamnum' if is_bam else 'highest_pairnum'] = highest_pairnum
+    sc['boards_per_round'] = self.u8(p + 0x1d)
+    if not is_teams:
+      sc['max_results_per_board'] = self.u8(p + 0x61)
+      sc['board_top'] = self.u16(p + 0x1e)
+    sc['ntables'] = self.u16(p + 0x48)
+
+    if is_teams:
+      sc['match_award'] = self.u16(p + 0xb5) / 100.0
+    sc['maximum_score'] = self.u16(p + 0x4e)
+    sc['modification_timestamp'] = self.datetime(p + 0xbd)
+
+    pmemo = self.u32(p + 0xd1)
+    if pmemo and not self.qualifier:
+      sc['memo'] = self.memonote(pmemo,'memo')
+
+    if self.sectionsonly:
+      return sc
+
+    is_howell = 1 if self.u8(p + 0x18) == 1 else 0
+    phantom = self.s8(p + 0x43)
+
+    has_overall_rankings = 0
+    has_quals = 0
+    entries = {}
+
+    if is_home_style_pairs:
+      # A rare format used when there are only two tables
+      if not self.noentries:
+        sc['entry'] = entries
+        for i in range(1,highest_pairnum+1):
+          pentry = self.u32(pindex[0] + 0x10 + 8 * i)
+          (entries[str(i)], has_rank, has_qual) = self.entry(pentry,rankstr)
+          has_overall_rankings = has_overall_rankings or has_rank
+          has_quals = has_quals or has_qual
+      pteammatch = self.u32(p + 0x23d)
+      if pteammatch and not self.qualifier:
+        sc['matches'] = self.team_matches(pteammatch,pindex[0])
+
+    elif is_howell:
+      # Howell can be a pairs or an individual event
+      sc['is_howell'] = is_howell
+      if not self.noentries:
+        sc['entry'] = entries
+        ppnm = p + 0xdd
+        reassign = struct.unpack_from('<80B',self.data,ppnm)
+        for i in range(1,highest_pairnum+1):
+          pairnum = i
+          if pairnum == phantom:
+            continue
+          table = self.u8(ppnm + 0x50 + 2*(pairnum-1))
+          direction = self.u8(ppnm + 0x51 + 2*(pairnum-1))
+          pentry = self.u32(pindex[direction-1] + 0x10 + 8 * table)
+
+          # Rare pair number reassignments with ACBLscore EDMOV command
+          if reassign[i-1]:
+            pairnum = reassign[i-1]
+
+          # Filter out phantom pairs
+          if self.u16(pentry + 0x1c) != 0:
+            (entries[str(pairnum)], has_rank, has_qual) = self.entry(pentry,rankstr)
+            has_overall_rankings = has_overall_rankings or has_rank
+            has_quals = has_quals or has_qual
+
+      if not self.noboards and pboardidx:
+        sc['board'] = self.boards(pboardidx,p,is_indy)
+
+    elif not is_teams and not is_bam:
+      # Mitchell movement
+      sc['is_howell'] = is_howell
+      if not self.noentries:
+        sc['entry'] = entries
+        ppnm = p + 0xdd
+        ndir = 4 if is_indy else 2
+        dirletter = ('N', 'E', 'S', 'W')
+        reassign = struct.unpack_from('<160B',self.data,ppnm)
+        # Only N-S and E-W have an entry count, as in the perl module
+        max_entry = (self.u8(pindex[0] + 6), self.u8(pindex[1] + 6), 0, 0)
+
+        for i in range(1,highest_pairnum+1):
+          for j in range(ndir):
+            pairnum = i
+            if (pairnum == phantom and j == 0) or (pairnum == -phantom and j == 1):
+              continue
+            table = self.u8(ppnm + 0xa0 + 4*(pairnum-1) + j)
+            pentry = self.u32(pindex[j] + 0x10 + 8 * table)
+
+            # Rare pair number reassignments with ACBLscore EDMOV command
+            if reassign[4*(i-1)+j]:
+              pairnum = reassign[4*(i-1)+j]
+
+            # Filter out phantom pairs and Mitchell bump pairs
+            if pairnum <= max_entry[j] and self.u16(pentry + 0x1c) != 0:
+              (entries['%d%s' % (pairnum,dirletter[j])], has_rank, has_qual) = \
+                  self.entry(pentry,rankstr)
+              has_overall_rankings = has_overall_rankings or has_rank
+              has_quals = has_quals or has_qual
+
+      if not self.noboards and pboardidx:
+        sc['board'] = self.boards(pboardidx,p,is_indy)
+
+    else:
+      # Teams or BAM
+      if not self.noentries:
+        sc['entry'] = entries
+        nteams = self.u8(pindex[0] + 6)
+        sc['nteams'] = nteams
+        pteam = pindex[0] + 0x14
+        for i in range(nteams):
+          teamnum = self.u16(pteam)
+          nplayers = self.u16(pteam + 2)
+          pentry = self.u32(pteam + 4)
+          (entries[str(teamnum)], has_rank, has_qual) = \
+              self.entry(pentry,rankstr,nplayers)
+          has_overall_rankings = has_overall_rankings or has_rank
+          has_quals = has_quals or has_qual
+          pteam += 8
+
+      if is_teams:
+        pteammatch = self.u32(p + 0x23d)
+        if pteammatch and not self.qualifier:
+          sc['matches'] = self.team_matches(pteammatch,pindex[0])
+
+      if is_bam and not self.noboards and pboardidx:
+        sc['board'] = self.boards(pboardidx,p,is_indy)
+
+    if not entries:
+      sc.pop('entry',None)
+    sc['has_overall_rankings'] = int(has_overall_rankings)
+    sc['has_quals'] = int(has_quals)
+    return sc
+
+  def entry(self,p,rankstr,nplayers=None):
+    """Parse an entry: an individual, pair, or team depending on the event
+
+    Returns:
+      (entry dict, has overall rank, has qualification)
+    """
+    intfloats = _S32X6.unpack_from(self.data,p + 0x4)
+    en = {
+      'score_adjustment': intfloats[0] / 100.0,
+      'score_unscaled': intfloats[1] / 100.0,
+      'score_session': intfloats[2] / 100.0 if intfloats[2] != -1 else None,
+      'score_carrover': intfloats[3] / 100.0,
+      'score_final': intfloats[4] / 100.0 if intfloats[4] != -1 else None,
+      'score_handicap': intfloats[5] / 100.0,
+      'pct': self.u16(p + 0x1c) / 100.0,
+      'strat_num': self.u8(p + 0x1e),
+      'mp_average': self.u16(p + 0x20),
+      'nboards': self.u8(p + 0x2f),
+      'eligibility': self.u8(p + 0x33),
+    }
+
+    if not self.qualifier:
+      award = self.award(p + 0x34,rankstr)
+      if award is not None:
+        en['award'] = award
+    (en['rank'], has_overall_rank, has_qual) = self.rank(p + 0x5e)
+
+    next_section = self.zstring(p + 0x28)
+    if next_section == '98':
+      en['next_section'] = 'Resigned'
+    elif next_section != '':
+      en['next_section'] = next_section
+      en['next_dir'] = self.char(p + 0x2b)
+      en['next_table'] = self.u16(p + 0x2c)
+
+    # Without a count from the entry index table, infer the number of
+    # players from the size of the entry structure.
+    if nplayers is None:
+      nplayers = (self.u16(p) - 0xa2) / float(PLAYER_STRUCTURE_SIZE)
+
+    players = []
+    i = 0
+    while i < nplayers:
+      pl = self.player(p + 0xa4 + i * PLAYER_STRUCTURE_SIZE,rankstr)
+      # Only return the player structures for actual players on teams
+      if nplayers <= 2 or pl['lname'] or pl['fname'] or pl['pnum']:
+        players.append(pl)
+      i += 1
+    if players:
+      en['player'] = players
+
+    return (en, has_overall_rank, has_qual)
+
+  def player(self,p,rankstr):
+    """Parse a player structure"""
+    pl = {
+      'team_wins': self.u16(p + 0x44) / 100.0,
+      'mp_total': self.u16(p + 0x71),
+      'acbl_rank_letter': self.char(p + 0x73),
+    }
+    pl['acbl_rank'] = ACBL_PLAYER_RANKS.get(pl['acbl_rank_letter'])
+    self.zstrings(pl, p, (
+      ('lname', 0),
+      ('fname', 0x11),
+      ('city', 0x22),
+      ('state', 0x33),
+      ('pnum', 0x36),
+      ('country', 0x75),
+    ))
+    if not self.qualifier:
+      award = self.award(p + 0x48,rankstr)
+      if award is not None:
+        pl['award'] = award
+    return pl
+
+  def award(self,p,rankstr):
+    """Parse a masterpoint award structure, None if there is no award"""
+    awset = {}
+    any_award = False
+    # Loop over "previous", "current", and "total" awards
+    for i in range(3):
+      v = _AWARD.unpack_from(self.data,p + i * 12)
+      aw = []
+      for j in (0, 3, 6):
+        # Handicapped games can have an award in the second entry even
+        # though the first entry is empty.
+        if not v[j] and (j != 0 or not v[j+3]):
+          break
+        any_award = True
+        reason = ''
+        if v[j+2]:
+          idx = v[j+2] % 10 - 1
+          if idx < 0:
+            idx += len(rankstr)
+          reason = ('O' if v[j+2] >= 10 else 'S') + rankstr[idx:idx+1]
+        aw.append([v[j] / 100.0, PIGMENTATION_TYPES[v[j+1]:v[j+1]+1], reason, v[j+2]])
+      awset[AWARD_SETS[i]] = aw
+    return awset if any_award else None
+
+  def rank(self,p):
+    """Parse the ranking structure for an entry
+
+    Returns:
+      (list of rank dicts, has overall rank, has qualification)
+    """
+    rkset = []
+    has_overall_rank = 0
+    has_qual = 0
+    for i in range(3):
+      v = _U16X6.unpack_from(self.data,p + i * 20)
+      # Skip strats that the entry is not eligible to be ranked in
+      if not v[5] and not v[4]:
+        break
+      rkset.append({
+        'section_rank_low': v[0],
+        'section_rank_high': v[1],
+        'overall_rank_low': v[2],
+        'overall_rank_high': v[3],
+        'qual_flag': v[4],
+        'rank': v[5],
+      })
+      if v[2]:
+        has_overall_rank = 1
+      if v[4]:
+        has_qual = 1
+    return (rkset, has_overall_rank, has_qual)
+
+  def boards(self,pboardidx,psection,is_indy):
+    """Parse the board results for a pair or individual event"""
+    ncompetitors = 4 if is_indy else 2
+    result = _RESULTS[ncompetitors]
+    kupper = 3 * ncompetitors + 2
+    nboards = self.u16(pboardidx + 4)
+
+    # Deal with possible EDMOV pair reassignment. Individual events are
+    # rare and reassignments rarer, so they are ignored there.
+    is_howell = self.u8(psection + 0x18)
+    if is_howell:
+      reassign = struct.unpack_from('<80B',self.data,psection + 0xdd)
+    else:
+      reassign = struct.unpack_from('<160B',self.data,psection + 0xdd)
+    any_reassigned = not is_indy and any(reassign)
+
+    bdset = {}
+    for i in range(nboards):
+      (bnum, nresults, p) = _BOARD_IDX.unpack_from(self.data,pboardidx + 0x26 + i * 8)
+      p += 6
+      bd = []
+      while nresults:
+        v = list(result.unpack_from(self.data,p))
+        p += result.size
+        # Skip if board is not in play on this round
+        if v[3] == 999:
+          continue
+        # Late Play and Not Played results do not count towards the total
+        if v[3] != 900 and v[3] != 950:
+          nresults -= 1
+        for k in range(2,kupper,3):
+          if any_reassigned:
+            if is_howell:
+              if reassign[v[k]-1]:
+                v[k] = reassign[v[k]-1]
+            else:
+              # 0 for N-S, 1 for E-W
+              dr = 1 if k == 5 else 0
+              if reassign[4*(v[k]-1)+dr]:
+                v[k] = reassign[4*(v[k]-1)+dr]
+          if v[k+1] < 900:
+            v[k+1] *= 10
+          elif v[k+1] < 3000:
+            v[k+1] = SPECIAL_SCORES.get(v[k+1],'Unknown')
+          else:
+            # A fouled board, scored in one of up to seven foul groups
+            foul_group = (v[k+1] - 1000) // FOUL_GROUP_OFFSET
+            v[k+1] -= FOUL_GROUP_OFFSET * (foul_group + 1)
+            v[k+1] = '%dF%d' % (v[k+1] * 10, foul_group)
+          v[k+2] /= 100.0
+        bd.append(v)
+      bdset[str(bnum)] = bd
+    return bdset
+
+  def team_matches(self,p,pindex):
+    """Parse the team matchups"""
+    (nteams, nrounds) = _U16X2.unpack_from(self.data,p + 4)
+    tmset = {}
+    for i in range(nteams):
+      teamnum = self.u16(pindex + 0x14 + 8 * i)
+      ptmt = self.u32(p + 0x56 + 4 * i)
+
+      # A team might not play all rounds, e.g. when knocked out
+      nmatches = self.u8(ptmt + 7)
+      if nmatches == 0:
+        nmatches = self.u8(ptmt + 4)
+
+      tm = []
+      for j in range(nmatches):
+        ptme = ptmt + 0x22 + j * TEAM_MATCH_ENTRY_SIZE
+        tm.append({
+          'round': self.u8(ptme + 1),
+          'vs_team': self.u16(ptme + 2),
+          'IMPs': self.s16(ptme + 8),
+          'VPs': self.u16(ptme + 0x0a) / 100.0,
+          'nboards': self.u8(ptme + 0x0d),
+          'wins': self.u16(ptme + 0x16) / 100.0,
+        })
+      tmset[str(teamnum)] = tm
+    return tmset
+
+
+def decode(data,fname,**opt):
+  """Decode a game file image already held in memory
+
+  Args:
+    data: The raw bytes (or an mmap) of an ACBLscore game file
+    fname: File name to record in the result
+    opt: Keyword options passed to GameDecoder
+
+  Returns:
+    A single-element list, the same shape ACBLgamedump.pl emits for one file
+
+  Exceptions:
+    GamefileException if the data is not a game file or is truncated.
+  """
+  decoder = GameDecoder(data,**opt)
+  try:
+    return [decoder.decode(fname)]
+  except (struct.error, IndexError), e:
+    raise GamefileException("Corrupt ACBLscore game file %s: %s" % (fname, e))
+
+
+def decode_file(fname,**opt):
+  """Decode an ACBLscore game file on local storage
+
+  The file is memory mapped, so only the pages actually visited by the
+  decoder are read.
+
+  Args:
+    fname: Path string to an ACBLscore game file
+    opt: Keyword options passed to GameDecoder
+
+  Returns:
+    A single-element list, the same shape ACBLgamedump.pl emits for one file
+
+  Exceptions:
+    GamefileException if the file cannot be read or decoded.
+  """
+  try:
+    with open(fname,'rb') as f:
+      if os.fstat(f.fileno()).st_size < len(MAGIC):
+        raise GamefileException("Not an ACBLscore game file: %s (skipped)" % fname)
+      data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+  except (IOError, OSError, mmap.error), e:
+    raise GamefileException(e)
+  try:
+    return decode(data,fname,**opt)
+  finally:
+    data.close()
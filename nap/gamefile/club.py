@@ -1,3 +1,5 @@
+from gfutils import intern_string
+
 class Club(object):
   """Contains a bridge club description
 
@@ -9,9 +11,11 @@ class Club(object):
   objects with the same number are the same club.
   """
 
+  __slots__ = ('name', 'number')
+
   def __init__(self,name,number):
-    self.name = name
-    self.number = number
+    self.name = intern_string(name)
+    self.number = intern_string(number)
 
   def __key(self):
     return (self.name,self.number)
@@ -26,3 +26,9 @@ class Event(object):
     self.details = []
     for e in event_dict['event']:
       self.details.append(EventDetails(e))
+
+  def release(self):
+    """Build the object tree below, then drop event_dict"""
+    for details in self.details:
+      details.release()
+    self.event_dict = None
@@ -1,6 +1,7 @@
 from club import Club
 from section import Section
 from strat import Strat
+from gfutils import intern_string
 
 class EventDetails(object):
   """All of the useful objects for an event
@@ -13,11 +14,12 @@ class EventDetails(object):
       date: Event date
       club_session_num: The session number is an integer from 1 to 22 that
           maps to a day-of-the-week and time-of-day
+      sections: Array of Section objects, built when first used
   """
 
   def __init__(self,details_dict):
     self.details_dict = details_dict
-    self.rating = details_dict['rating']
+    self.rating = intern_string(details_dict['rating'])
     if self.rating == "NAP Unit Level":
       if 'tournament' in details_dict.keys():
         club_name = details_dict['tournament']
@@ -29,22 +31,39 @@ class EventDetails(object):
     else:
       self.club = Club(details_dict['club'],details_dict['club_num'])
       self.club_session_num = details_dict['club_session_num']
-    self.date = details_dict['date']
+    self.date = intern_string(details_dict['date'])
 
     # Load the strats array
     self.strats = []
     for s in details_dict['strat']:
       self.strats.append(Strat(s))
 
-    # Create a map of strats to rank indexes for the players
-    rank_idx_to_strat = {}
-    for idx in range(0,len(self.strats)):
-      rank_idx_to_strat[idx] = self.map_rank_index_to_strat(idx)
+    # The sections array is loaded on first use, see sections
+    self._sections = None
 
-    # Load the sections array with the rank map
-    self.sections = []
-    for k in details_dict['section'].keys():
-      self.sections.append(Section(k,details_dict['section'][k],rank_idx_to_strat))
+  @property
+  def sections(self):
+    """Array of Section objects, built from the details dict on first use"""
+    if self._sections is None:
+      # Create a map of strats to rank indexes for the players
+      rank_idx_to_strat = {}
+      for idx in range(0,len(self.strats)):
+        rank_idx_to_strat[idx] = self.map_rank_index_to_strat(idx)
+
+      # Load the sections array with the rank map
+      sections = []
+      for k in self.details_dict['section'].keys():
+        sections.append(Section(k,self.details_dict['section'][k],rank_idx_to_strat))
+      self._sections = sections
+    return self._sections
+
+  def release(self):
+    """Build the sections and their players, then drop details_dict"""
+    for section in self.sections:
+      section.release()
+    for strat in self.strats:
+      strat.release()
+    self.details_dict = None
 
   def map_rank_index_to_strat(self,rank_index):
     strat = self.strats[rank_index]
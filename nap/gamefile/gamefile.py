@@ -3,11 +3,58 @@ import string
 import os
 import re
 import csv
+import codecs
 from event import Event
 from qualdate import QualDate
 from gamefile_exception import GamefileException
 from gfutils import GFUtils
 
+# A qualifier column in an ACBLscore NAP export, e.g. "7NA"
+QUAL_CODE = re.compile('^\\dN[ABC]$')
+
+
+def parse_csv_row(row):
+  """Player dictionary from one row of an ACBLscore NAP CSV export.
+
+  Rows are player number, first name, last name, then the A, B and C
+  qualifier columns, each empty or a code like "7NA".
+
+  Returns:
+    dict of pnum, fname, lname, the three flight flags and their qual_map
+    bit mask, or None for a row that is not a player (a blank line, or a
+    header row)
+  """
+  if len(row) < 6:
+    return None
+  for code in row[3:6]:
+    if code and not QUAL_CODE.match(code):
+      return None
+  pnum = row[0]
+  if pnum.startswith(codecs.BOM_UTF8):
+    pnum = pnum[len(codecs.BOM_UTF8):]
+  # Each column is now empty or a valid code, so only its flight letter
+  # needs checking
+  a_flight = row[3].endswith('NA')
+  b_flight = row[4].endswith('NB')
+  c_flight = row[5].endswith('NC')
+  qual_map = 0
+  if a_flight:
+    qual_map += 4
+  if b_flight:
+    qual_map += 2
+  if c_flight:
+    qual_map += 1
+  return {
+    'pnum': pnum,
+    'fname': row[1],
+    'lname': row[2],
+    'a_flight': a_flight,
+    'b_flight': b_flight,
+    'c_flight': c_flight,
+    'qual_map': qual_map,
+  }
+
+
 class Gamefile(object):
   """Top of an object tree that represents and ACBLscore game file
 
@@ -15,11 +62,20 @@ class Gamefile(object):
     gamefiledict: The raw JSON dictionary provided by ACBLgamedump
     events: Array of Event objects. In practice our game files only include
         a single Event, so it has to be referenced as events[0].
+    lazy: If True, sections and players are only built from gamefiledict
+        when first used. Club, date, session and table count never need
+        them. Otherwise the whole object tree is built up front, so a
+        malformed dict fails right away.
 
+  Once the object tree is built, release() lets go of gamefiledict and the
+  raw dicts below it, for callers that keep many games in memory.
   """
 
-  def __init__(self):
+  def __init__(self,lazy=False):
     self.events = []
+    self.lazy = lazy
+    self.qualdate = None
+    self.sortkey = None
     return
 
   def init_from_dict(self,gamefiledict):
@@ -27,6 +83,8 @@ class Gamefile(object):
     for e in self.gamefiledict:
       event = Event(e)
       self.events.append(event)
+    if not self.lazy:
+      self.materialize()
     return
 
   def init_from_json(self, jsonstring):
@@ -37,8 +95,25 @@ class Gamefile(object):
     for e in self.gamefiledict:
       event = Event(e)
       self.events.append(event)
+    if not self.lazy:
+      self.materialize()
     return
 
+  def materialize(self):
+    """Build every section and player now, rather than on first use"""
+    for section in self.get_sections():
+      section.players
+
+  def release(self):
+    """Build every section and player, then drop the raw dicts.
+
+    Afterwards gamefiledict is None, and the game can no longer be cached
+    or pretty printed. Reports are unaffected.
+    """
+    for event in self.events:
+      event.release()
+    self.gamefiledict = None
+
   def init_from_csv_file(self,csvfile):
     try:
       self.parse_csv(csvfile)
@@ -60,15 +135,18 @@ class Gamefile(object):
     """
     filename = string.split(pathname, os.sep)[-1]
     clubname = string.split(pathname, os.sep)[-2]
-    pattern = re.compile("NAP.(\d+)-(\d+)")
+    pattern = re.compile("NAO?P\W*(\d+)-(\d+)")
     match = pattern.match(filename)
+    if not match:
+      raise GamefileException("Not a NAP CSV file name: %s" % pathname)
     club_num = match.group(1)
     game_year = match.group(2)
 
     club_name_split = re.split('-',clubname)
     new_club_name = []
     for w in club_name_split:
-      new_club_name.append(w[0].upper() + w[1:])
+      if w:
+        new_club_name.append(w[0].upper() + w[1:])
     club_name = " ".join(new_club_name)
 
     game_dict = []
@@ -101,68 +179,43 @@ class Gamefile(object):
     }
     event_dict['event'].append(event_details_dict)
 
-    # Read in the CSV file and build a list of raw_player data
-    # the qual_map value will be used to match up players with
-    # pseudo-partners to generate section entry pairs
-    raw_players = []
-    with open(pathname, 'r') as csvfile:
-      rsr = csv.reader(csvfile)
-      for row in rsr:
-        a_flight = bool(re.match('^\dNA$',row[3]))
-        b_flight = bool(re.match('^\dNB$',row[4]))
-        c_flight = bool(re.match('^\dNC$',row[5]))
-        qual_map = 0
-        if a_flight:
-          qual_map += 4
-        if b_flight:
-          qual_map += 2
-        if c_flight:
-          qual_map += 1
-        player = {
-          'pnum': row[0],
-          'fname': row[1],
-          'lname': row[2],
-          'a_flight': a_flight,
-          'b_flight': b_flight,
-          'c_flight': c_flight,
-          'qual_map': qual_map,
-        }
-        raw_players.append(player)
-
-    # Build a pseudo-section with pseudo-partnerships
-    section = {}
+    # Stream the CSV rows into a pseudo-section of pseudo-partnerships.
+    # Each player is paired with the next player that has the same
+    # qual_map. The entry gets its seat when its first player is read, and
+    # waits in unpaired (one per qual_map) for the second. A player left
+    # without a partner at the end keeps an entry of their own.
     entry = {}
-    section['entry'] = entry
-    for seat in GFUtils.SEATS:
-      entry[seat] = {}
-      entry[seat]['player'] = []
-      entry[seat]['rank'] = []
-      entry[seat]['strat_num'] = 3
-      player_a = raw_players.pop(0)
-      rank_a = {
-        'qual_flag': 1 if player_a['a_flight'] else 0,
-      }
-      rank_b = {
-        'qual_flag': 1 if player_a['b_flight'] else 0,
-      }
-      rank_c = {
-        'qual_flag': 1 if player_a['c_flight'] else 0,
-      }
-      entry[seat]['rank'].extend([rank_a, rank_b, rank_c])
-      for idx, p in enumerate(raw_players):
-        if p['qual_map'] == player_a['qual_map']:
-          player_b = p
-          del raw_players[idx]
-          break
-      entry[seat]['player'].append(player_a)
-      entry[seat]['player'].append(player_b)
-      if not raw_players:
-        break
-
-    event_details_dict['section']['A'] = section
+    unpaired = {}
+    try:
+      with open(pathname, 'rb') as csvfile:
+        for row in csv.reader(csvfile):
+          player = parse_csv_row(row)
+          if player is None:
+            continue
+          qual_map = player['qual_map']
+          if qual_map in unpaired:
+            unpaired.pop(qual_map)['player'].append(player)
+            continue
+          seat = GFUtils.seat_name(len(entry))
+          entry[seat] = {
+            'player': [player],
+            'rank': [
+              {'qual_flag': 1 if player['a_flight'] else 0},
+              {'qual_flag': 1 if player['b_flight'] else 0},
+              {'qual_flag': 1 if player['c_flight'] else 0},
+            ],
+            'strat_num': 3,
+          }
+          unpaired[qual_map] = entry[seat]
+    except csv.Error, e:
+      raise GamefileException("Bad CSV file %s: %s" % (pathname, e))
+
+    event_details_dict['section']['A'] = {'entry': entry}
 
     self.events.append(Event(event_dict))
     self.gamefiledict = game_dict
+    if not self.lazy:
+      self.materialize()
 
     return
 
@@ -184,25 +237,25 @@ class Gamefile(object):
     return fmt.format(self.get_club().number, self.get_club().name, self.get_game_date(),
         GFUtils.SESSION_STRING[self.get_club_session_num()], self.table_count())
 
-  def __cmp__(self,other):
-    """Natural ordering for game files
+  def sort_key(self):
+    """Natural ordering for game files, for sorted(games, key=Gamefile.sort_key)
     
     Sort by game date first, then by club session number. The session number will
-    distinguish between games played on the same date.
+    distinguish between games played on the same date. Games of different clubs
+    in the same session go by club number, so game indexes do not depend on the
+    order the games were loaded in. (A club's game on a date and session is
+    unique, see get_key(), so there are no ties left.) Before 0.8.0 such games
+    kept the order of the games dictionary, so their indexes can differ from
+    those of earlier releases. The key is computed once.
     """
-    me = self.get_qualdate().ptime
-    him = other.get_qualdate().ptime
-    if me > him:
-      return 1
-    if me < him:
-      return -1
-    else:
-      if self.get_club_session_num() > other.get_club_session_num():
-        return 1
-      if self.get_club_session_num() < other.get_club_session_num():
-        return -1
-      else:
-        return 0
+    if self.sortkey is None:
+      self.sortkey = (self.get_qualdate().ptime, self.get_club_session_num(),
+                      self.get_club().number)
+    return self.sortkey
+
+  def __cmp__(self,other):
+    """Natural ordering for game files, see sort_key()"""
+    return cmp(self.sort_key(),other.sort_key())
 
   def pretty(self):
     """A debugging tool, pretty-prints the defining game file dict as JSON"""
@@ -233,10 +286,15 @@ class Gamefile(object):
     return self.get_club().number
 
   def get_qualdate(self):
-    """The club and date of this game, for reporting player qualifiers."""
-    return QualDate(self.get_club(),
-                    self.get_game_date(),
-                    session=self.get_club_session_num())
+    """The club and date of this game, for reporting player qualifiers.
+
+    The QualDate is built on first use and shared by every caller.
+    """
+    if self.qualdate is None:
+      self.qualdate = QualDate(self.get_club(),
+                               self.get_game_date(),
+                               session=self.get_club_session_num())
+    return self.qualdate
 
   def get_rating(self):
     """The game rating string from EventDetails"""
@@ -274,6 +332,24 @@ class Gamefile(object):
             qp.append(player)
     return qp
 
+  def qualifiers(self):
+    """The qualified players of this game, with the flights of each.
+
+    Unlike qualified_players(), this reads the qualifications as the
+    game's ranks made them, even if a Player's flags have since been set
+    for other games (see Section.player_quals).
+
+    Returns:
+      list of (Player, flights) tuples, where flights is a string of the
+      flight letters in order, such as "ab". Dummy players are left out.
+    """
+    qualifiers = []
+    for section in self.get_sections():
+      for (player, qual_map) in zip(section.players,section.player_quals):
+        if qual_map and player.pnum != 'dummy':
+          qualifiers.append((player, GFUtils.QUAL_MAP_FLIGHTS[qual_map]))
+    return qualifiers
+
   def all_players(self):
     """Get all individual Player objects, qualifiers and not"""
     plrs = []
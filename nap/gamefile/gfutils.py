@@ -28,6 +28,8 @@ class GFUtils(object):
     22: '(Other)',
   }
 
+  # Seat names of a pseudo-section, as seat_name() gives them up to 60E.
+  # Kept for callers of the table; the CSV reader uses seat_name().
   SEATS = [
     '1N', '1E', '2N', '2E', '3N', '3E', '4N', '4E', '5N', '5E',
     '6N', '6E', '7N', '7E', '8N', '8E', '9N', '9E', '10N','10E',
@@ -45,4 +47,50 @@ class GFUtils(object):
     '46N', '46E', '47N', '47E', '48N', '48E', '49N', '49E', '70N', '70E',
     '41N', '41E', '42N', '42E', '43N', '43E', '44N', '44E', '45N', '45E',
     '46N', '46E', '47N', '47E', '48N', '48E', '49N', '49E', '80N', '80E',
-  ]
\ No newline at end of file
+  ]
+
+  # Flight letters of each qual_map bit mask (A=4, B=2, C=1)
+  QUAL_MAP_FLIGHTS = {
+    0: '',
+    1: 'c',
+    2: 'b',
+    3: 'bc',
+    4: 'a',
+    5: 'ac',
+    6: 'ab',
+    7: 'abc',
+  }
+
+  @staticmethod
+  def seat_name(index):
+    """Name of a seat in a pseudo-section, counting from 0: 1N, 1E, 2N, ..."""
+    return "%d%s" % (index // 2 + 1, 'NE'[index % 2])
+
+
+# One copy of each name, club and date string, see intern_string()
+_strings = {}
+
+# Strings kept before the table starts over
+MAX_STRINGS = 200000
+
+
+def intern_string(s):
+  """Return a shared copy of a string equal to s.
+
+  Names, club names and dates repeat across every game of a season. The
+  builtin intern() only accepts str, while decoded names are unicode, so
+  strings are kept in a dictionary of our own. They are keyed by type as
+  well, so an ASCII str is never swapped for an equal unicode string.
+
+  The table is meant to last one load (see clear_strings()), and starts
+  over if it grows past MAX_STRINGS, so a long-running process does not
+  keep every string it has ever seen.
+  """
+  if len(_strings) >= MAX_STRINGS:
+    _strings.clear()
+  return _strings.setdefault((type(s), s), s)
+
+
+def clear_strings():
+  """Empty the intern_string() table. Strings already shared stay shared."""
+  _strings.clear()
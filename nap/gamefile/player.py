@@ -1,3 +1,5 @@
+from gfutils import intern_string
+
 pnum_map = {
   'J': '1',
   'j': '1',
@@ -30,8 +32,8 @@ def canonical_pnum(p):
     return p
   c = p[0]
   if c.isalpha():
-    c = pnum_map[c]
-  return c + p[1:]
+    return pnum_map[c] + p[1:]
+  return p
 
 class Player(object):
   """Object representing an ACBL member
@@ -49,13 +51,19 @@ class Player(object):
     get_key(): Returns the private unique key for a pleyer. The key is the
         canonical player number for ACBL members, or (lname,fname) for 
         non-members.
+
+  Players are the most numerous objects by far, so they have no instance
+  dictionary (see __slots__), and share their name strings.
   """
 
+  __slots__ = ('lname', 'fname', 'pnum', 'canon_pnum',
+               'a_flight', 'b_flight', 'c_flight')
+
   def __init__(self, lname, fname, pnum=''):
-    self.lname = lname
-    self.fname = fname
-    self.pnum = pnum
-    self.canon_pnum = canonical_pnum(pnum)
+    self.lname = intern_string(lname)
+    self.fname = intern_string(fname)
+    self.pnum = intern_string(pnum)
+    self.canon_pnum = canonical_pnum(self.pnum)
     self.a_flight = False
     self.b_flight = False
     self.c_flight = False
@@ -75,27 +83,16 @@ class Player(object):
   def __eq__(self,other):
     return self.__key() == other.__key()
 
-  def __cmp__(self,other):
-    """Natural ordering of Player objects
+  def sort_key(self):
+    """Natural ordering of Player objects, for sorted(players, key=Player.sort_key)
 
     Order by last name, then first name, then player number
     """
-    if self.lname != other.lname:
-      if self.lname > other.lname:
-        return 1
-      else:
-        return -1
-    if self.fname != other.fname:
-      if self.fname > other.fname:
-        return 1
-      else:
-        return -1
-    if self.pnum != other.pnum:
-      if self.pnum > other.pnum:
-        return 1
-      else:
-        return -1
-    return 0
+    return (self.lname, self.fname, self.pnum)
+
+  def __cmp__(self,other):
+    """Natural ordering of Player objects, see sort_key()"""
+    return cmp(self.sort_key(),other.sort_key())
 
   def cmp(self,other):
     """Public method for the __cmp__ function, does not invoke __eq__ or __hash__"""
@@ -1,6 +1,13 @@
 from datetime import datetime
 from gfutils import GFUtils
 
+# Parsed (ptime, sdate) of each date string seen, see QualDate.parse_date()
+_dates = {}
+
+# Dates kept before the table starts over
+MAX_DATES = 10000
+
+
 class QualDate(object):
   """Descriptor for a player's qualifying event.
 
@@ -9,15 +16,39 @@ class QualDate(object):
     date: A date string, in long form, en_us formatted
     sdate: Short date in local format
     ptime: A python datetime object, more useful for sorting
+    session: Day of week and time of day string
   """
 
+  __slots__ = ('club', 'date', 'ptime', 'sdate', 'session')
+
   def __init__(self,club,date,session=22):
     self.club = club
     self.date = date
-    self.ptime = datetime.strptime(date,"%B %d, %Y")
-    self.sdate = self.ptime.strftime("%x")
+    (self.ptime, self.sdate) = QualDate.parse_date(date)
     self.session = GFUtils.SESSION_STRING[session]
 
+  @staticmethod
+  def parse_date(date):
+    """(datetime, short date string) for a long form date string.
+
+    strptime() is slow, and a season has only a few hundred game dates,
+    so each date string is parsed once a load (see clear_dates()). The
+    table starts over if it grows past MAX_DATES.
+    """
+    parsed = _dates.get(date)
+    if parsed is None:
+      ptime = datetime.strptime(date,"%B %d, %Y")
+      parsed = (ptime, ptime.strftime("%x"))
+      if len(_dates) >= MAX_DATES:
+        _dates.clear()
+      _dates[date] = parsed
+    return parsed
+
+  @staticmethod
+  def clear_dates():
+    """Empty the table of parsed dates, see parse_date()"""
+    _dates.clear()
+
   def __key(self):
     return (self.club,self.date)
 
@@ -27,13 +58,12 @@ class QualDate(object):
   def _eq__(self,other):
     return self.__key() == other.__key()
 
+  def sort_key(self):
+    """QualDates sort by date, for sorted(qualdates, key=QualDate.sort_key)"""
+    return self.ptime
+
   def __cmp__(self,other):
-    if self.ptime > other.ptime:
-      return 1
-    elif self.ptime < other.ptime:
-      return -1
-    else:
-      return 0
+    return cmp(self.ptime,other.ptime)
 
   def __str__(self):
     return "{0} {1} {2}".format(self.sdate,self.session,self.club)
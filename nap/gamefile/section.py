@@ -11,13 +11,16 @@ class Section(object):
         a repeated letter if there could be more than 26 sections at
         an event.
     players: Array of all individual players in the section
+    player_strats: Strat letter of the entry of each player in players
+    player_quals: qual_map bit mask of each player in players
     entries: An "entry" in a section is a pair of players. A pair qualifies
         together in the game, but the qualification applies to the
         individual members of the partnership.
 
-  During the construction of this object, the Players are separated
+  The first time the players array is used, the Players are separated
   out from the Entries, and tested to have a qual_flag value greater
-  than zero.
+  than zero. Until then a Section costs next to nothing, which is all
+  that listing games and counting tables needs.
 
   The value of qual_flag is 0 if not qualified, or an integer that is
   the rank of the qualifier, i.e., a qual_flag value of '1' is the top
@@ -31,21 +34,74 @@ class Section(object):
   def __init__(self,letter,section_dict,rank_idx_to_strat):
     self.letter = letter
     self.section_dict = section_dict
-    self.players = []
+    self.rank_idx_to_strat = rank_idx_to_strat
     self.entries = self.section_dict['entry']
+    self._players = None
+    self._player_strats = None
+    self._player_quals = None
+
+  @property
+  def players(self):
+    """Array of Player objects, built from the entries on first use"""
+    if self._players is None:
+      self._players = self.load_players()
+    return self._players
+
+  @property
+  def player_strats(self):
+    """Strat letter of each player's entry, in the order of players"""
+    self.players
+    return self._player_strats
+
+  @property
+  def player_quals(self):
+    """qual_map of each player in this section, in the order of players.
+
+    The Player flags can change later (Nap.load_players() sets them on a
+    player's first Player object for every game), but these stay as the
+    ranks of this section made them: A=4, B=2, C=1.
+    """
+    self.players
+    return self._player_quals
+
+  def load_players(self):
+    """Build the Player objects of every entry, with their qualifier flags"""
+    rank_idx_to_strat = self.rank_idx_to_strat
+    players_list = []
+    self._player_strats = []
+    self._player_quals = []
     for seat in self.entries.keys():
       entry = self.entries[seat]
       strat_num = entry['strat_num']
       players = entry['player']
       ranks = entry['rank']
+      strat = rank_idx_to_strat.get(strat_num - 1)
       for p in players:
+        self._player_strats.append(strat)
         player = Player(p['lname'],p['fname'],p['pnum'])
         player.set_qual(rank_idx_to_strat[0],ranks[0]['qual_flag'] > 0 and ranks[0]['qual_flag'] < 10000)
         if 1 < strat_num:
           player.set_qual(rank_idx_to_strat[1],ranks[1]['qual_flag'] > 0 and ranks[1]['qual_flag'] < 10000)
         if 2 < strat_num:
           player.set_qual(rank_idx_to_strat[2],ranks[2]['qual_flag'] > 0 and ranks[2]['qual_flag'] < 10000)
-        self.players.append(player)
+        players_list.append(player)
+        self._player_quals.append((4 if player.a_flight else 0) +
+                                  (2 if player.b_flight else 0) +
+                                  (1 if player.c_flight else 0))
+    return players_list
+
+  def release(self):
+    """Build the players, then drop the raw section dict.
+
+    Only the strat_num of each entry is kept, for counting tables and
+    pairs. The entries' player and rank dicts are gone.
+    """
+    self.players
+    entries = {}
+    for seat in self.entries.keys():
+      entries[seat] = {'strat_num': self.entries[seat]['strat_num']}
+    self.entries = entries
+    self.section_dict = None
 
   def table_count(self):
     """Returns the count of tables in the section, as entries / 2"""
@@ -11,3 +11,6 @@ class Strat(object):
     self.max_mp = self.strat_dict['max_mp']
     self.letter = self.strat_dict['letter']
 
+  def release(self):
+    """Drop strat_dict"""
+    self.strat_dict = None
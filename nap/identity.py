@@ -0,0 +1,242 @@
+"""Player identity resolution: one player under different names or numbers
+
+Game files spell a player's name however the director typed it, and player
+numbers come with or without the Life Master letter, mistyped, or not at
+all. This module groups the spellings seen across a set of games into
+clusters that are likely to be one player.
+
+Candidate pairs are found by blocking, so that few pairs are compared:
+
+  * Spellings with the same Player.get_key(), the canonical player number
+    of a member or the name of a non-member, are the same player.
+  * Spellings whose last names sound alike (Soundex of the folded last
+    name) and that share a first initial are scored by the edit distance
+    of their folded "lname, fname" and of their player numbers.
+
+Linked spellings are merged with a union-find, so each cluster comes out
+once however many pairs link it.
+
+Classes:
+    Identity: One spelling of a player, and the games it was seen in
+    IdentityResolver: Clusters of identities in a set of games
+
+Functions:
+    soundex: American Soundex code of a name
+    edit_distance: Optimal string alignment distance, with a cutoff
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+from player_index import normalize
+
+# Soundex digit of each consonant. Vowels, h, w and y have none.
+SOUNDEX_CODES = {}
+for (letters, digit) in (('bfpv','1'), ('cgjkqsxz','2'), ('dt','3'),
+                         ('l','4'), ('mn','5'), ('r','6')):
+  for c in letters:
+    SOUNDEX_CODES[c] = digit
+
+# Why the identities of a cluster were linked
+SAME_NUMBER = 'same player number'
+SAME_NAME = 'same name'
+SIMILAR_NAME = 'similar name'
+
+
+def soundex(name):
+  """American Soundex code of a name, such as 'R163' for Robert or Rupert.
+
+  Letters other than a-z are ignored, so fold accents first (see
+  player_index.normalize()). A name without letters codes as ''.
+  """
+  letters = [c for c in name.lower() if 'a' <= c <= 'z']
+  if not letters:
+    return ''
+  code = letters[0].upper()
+  last = SOUNDEX_CODES.get(letters[0],'')
+  for c in letters[1:]:
+    digit = SOUNDEX_CODES.get(c,'')
+    if digit and digit != last:
+      code += digit
+      if len(code) == 4:
+        break
+    if c not in 'hw':
+      last = digit
+  return (code + '000')[:4]
+
+
+def edit_distance(a,b,limit=None):
+  """Edits to turn one string into the other.
+
+  An edit inserts, deletes or changes one character, or swaps two adjacent
+  ones (optimal string alignment distance).
+
+  Args:
+    a, b: Strings
+    limit: If given, stop once the distance is sure to be over limit, and
+        return limit + 1
+  Returns: int
+  """
+  if limit is not None and abs(len(a) - len(b)) > limit:
+    return limit + 1
+  prev2 = None
+  prev = range(len(b) + 1)
+  for i in range(1,len(a) + 1):
+    row = [i] + [0] * len(b)
+    for j in range(1,len(b) + 1):
+      cost = 0 if a[i-1] == b[j-1] else 1
+      row[j] = min(prev[j] + 1, row[j-1] + 1, prev[j-1] + cost)
+      if i > 1 and j > 1 and a[i-1] == b[j-2] and a[i-2] == b[j-1]:
+        row[j] = min(row[j], prev2[j-2] + 1)
+    if limit is not None and min(row) > limit:
+      return limit + 1
+    (prev2, prev) = (prev, row)
+  distance = prev[len(b)]
+  if limit is not None and distance > limit:
+    return limit + 1
+  return distance
+
+
+class Identity(object):
+  """One spelling of a player: last name, first name and player number
+
+  Attributes:
+    player: The first Player seen with this spelling
+    name: Folded "lname, fname", see player_index.normalize()
+    games: Number of games the spelling was seen in
+    qualified: True if the spelling qualified in any flight of any game
+  """
+
+  __slots__ = ('player', 'name', 'games', 'qualified')
+
+  def __init__(self,player):
+    self.player = player
+    self.name = normalize(player.lname + ", " + player.fname)
+    self.games = 0
+    self.qualified = False
+
+  def spelling(self):
+    return (self.player.lname, self.player.fname, self.player.pnum)
+
+  def block(self):
+    """Blocking key for similar names: Soundex of the last name, first initial"""
+    (lname, fname) = self.name.split(u', ',1) if u', ' in self.name else (self.name, u'')
+    return (soundex(lname), fname[:1])
+
+
+class IdentityResolver(object):
+  """Clusters of the player spellings in a set of games
+
+  Similar names are linked if their edit distance is at most
+  max_name_distance, and no more than one edit in five characters of the
+  shorter name, so short names need to be closer. Their player numbers
+  must also be close: at most max_pnum_distance edits apart (canonical
+  form), unless one of them is not a member number at all.
+
+  Attributes:
+    identities: Dictionary of (lname, fname, pnum) to Identity
+    max_name_distance: Most edits between similar names
+    max_pnum_distance: Most edits between the numbers of similar names
+  """
+
+  def __init__(self,games=(),max_name_distance=2,max_pnum_distance=1):
+    self.identities = {}
+    self.max_name_distance = max_name_distance
+    self.max_pnum_distance = max_pnum_distance
+    for game in games:
+      self.add_game(game)
+
+  def add_game(self,game):
+    """Add the spellings of every player in a Gamefile. Dummies are left out."""
+    seen = set()
+    for section in game.get_sections():
+      for (p, bits) in zip(section.players,section.player_quals):
+        if p.pnum == 'dummy':
+          continue
+        spelling = (p.lname, p.fname, p.pnum)
+        identity = self.identities.get(spelling)
+        if identity is None:
+          identity = self.identities[spelling] = Identity(p)
+        if spelling not in seen:
+          seen.add(spelling)
+          identity.games += 1
+        if bits:
+          identity.qualified = True
+
+  def similar(self,a,b):
+    """True if two identities' names and numbers are close enough to link"""
+    limit = min(self.max_name_distance,min(len(a.name),len(b.name)) // 5)
+    if edit_distance(a.name,b.name,limit) > limit:
+      return False
+    (pa, pb) = (a.player.canon_pnum, b.player.canon_pnum)
+    if len(pa) < 7 or len(pb) < 7:
+      return True
+    return edit_distance(pa,pb,self.max_pnum_distance) <= self.max_pnum_distance
+
+  def links(self):
+    """Generate (Identity, Identity, reason) for each pair of linked identities.
+
+    Identities with the same key are linked in a chain, so n of them make
+    n - 1 links. Within a block of similar names, each pair is compared.
+    """
+    by_key = {}
+    by_block = {}
+    for identity in self.identities.values():
+      by_key.setdefault(identity.player.get_key(),[]).append(identity)
+      by_block.setdefault(identity.block(),[]).append(identity)
+
+    for (key, group) in by_key.items():
+      reason = SAME_NAME if isinstance(key,tuple) else SAME_NUMBER
+      for (a, b) in zip(group,group[1:]):
+        yield (a, b, reason)
+
+    for group in by_block.values():
+      for i in range(len(group)):
+        for j in range(i + 1,len(group)):
+          (a, b) = (group[i], group[j])
+          if a.player.get_key() == b.player.get_key():
+            continue
+          if self.similar(a,b):
+            yield (a, b, SIMILAR_NAME)
+
+  def clusters(self,qualified_only=False):
+    """Clusters of two or more identities that are likely one player.
+
+    Args:
+      qualified_only: If True, only clusters with a spelling that qualified
+    Returns:
+      list of (identities, reasons), identities sorted by name and number
+      and reasons a sorted list of why they were linked. Clusters are
+      sorted by their first identity.
+    """
+    parent = {}
+    reasons = {}
+
+    def find(x):
+      root = x
+      while parent.get(root,root) != root:
+        root = parent[root]
+      while x != root:
+        (parent[x], x) = (root, parent[x])
+      return root
+
+    for (a, b, reason) in self.links():
+      (ra, rb) = (find(a.spelling()), find(b.spelling()))
+      if ra != rb:
+        parent[rb] = ra
+        reasons.setdefault(ra,set()).update(reasons.pop(rb,()))
+      reasons.setdefault(ra,set()).add(reason)
+
+    members = {}
+    for spelling in parent:
+      members.setdefault(find(spelling),set([find(spelling)])).add(spelling)
+
+    clusters = []
+    for (root, spellings) in members.items():
+      identities = sorted((self.identities[s] for s in spellings),
+                          key=lambda i: i.player.sort_key())
+      if qualified_only and not any(i.qualified for i in identities):
+        continue
+      clusters.append((identities, sorted(reasons[root])))
+    clusters.sort(key=lambda c: c[0][0].player.sort_key())
+    return clusters
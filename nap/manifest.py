@@ -0,0 +1,116 @@
+"""A record of the game files last seen in a game file tree
+
+The manifest lives beside the tree, as <tree>.manifest, and is rewritten
+after every scan. For each file it keeps the size, mtime and content hash,
+the key of the game loaded from it, and what became of it. A later scan
+trusts the recorded hash of any file whose size and mtime are unchanged,
+so unchanged files need not even be read to find them in the parse cache.
+
+Classes:
+    Manifest: The files of one game file tree
+
+Functions:
+    default_manifest_path: Where the manifest of a tree is kept
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import os
+import sys
+import json
+
+# Bump when the layout of the manifest changes
+MANIFEST_VERSION = 1
+
+# File name suffix of a manifest
+MANIFEST_SUFFIX = '.manifest'
+
+# What became of a file in the last scan
+GAME = 'game'
+DUPLICATE = 'duplicate'
+REPLACED = 'replaced'
+SKIPPED = 'skipped'
+
+
+def default_manifest_path(gamefile_tree):
+  """<tree>.manifest, next to the top directory of the tree"""
+  return os.path.normpath(gamefile_tree) + MANIFEST_SUFFIX
+
+
+class Manifest(object):
+  """The files of one game file tree, as of the last scan
+
+  Files are recorded by their path relative to the top of the tree, so the
+  manifest stays valid however the tree is named on the command line.
+
+  Attributes:
+    gamefile_tree: Top directory of the tree
+    path: Path string of the manifest file
+    files: Dictionary of relative path to a dictionary of size, mtime,
+        hash, key and status
+  """
+
+  def __init__(self,gamefile_tree,path=None):
+    self.gamefile_tree = gamefile_tree
+    self.path = path or default_manifest_path(gamefile_tree)
+    self.files = {}
+    self.load()
+
+  def relpath(self,gamefile):
+    return os.path.relpath(gamefile,self.gamefile_tree)
+
+  def load(self):
+    """Read the manifest file. A missing or unreadable one is an empty manifest."""
+    try:
+      with open(self.path,'r') as f:
+        manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+      return
+    if manifest.get('version') == MANIFEST_VERSION:
+      self.files = manifest.get('files',{})
+
+  def identity(self,gamefile):
+    """The recorded (size, mtime, hash) of a file, or None.
+
+    None is returned unless the file's size and mtime on disk are the ones
+    recorded, in which case its contents have to be hashed again.
+    """
+    entry = self.files.get(self.relpath(gamefile))
+    if not entry:
+      return None
+    try:
+      st = os.stat(gamefile)
+    except OSError:
+      return None
+    if st.st_size != entry['size'] or st.st_mtime != entry['mtime']:
+      return None
+    return (entry['size'], entry['mtime'], entry['hash'])
+
+  def record(self,gamefile,identity,status,key=None):
+    """Note a file's identity, what became of it, and its game key"""
+    if identity is None:
+      self.files.pop(self.relpath(gamefile),None)
+      return
+    (size, mtime, digest) = identity
+    self.files[self.relpath(gamefile)] = {
+      'size': size,
+      'mtime': mtime,
+      'hash': digest,
+      'key': list(key) if key else None,
+      'status': status,
+    }
+
+  def save(self):
+    """Write the manifest file, warning on stderr if that fails.
+
+    The file is replaced in one step, so a reader never sees half of it.
+    """
+    tmp = self.path + '.tmp'
+    try:
+      with open(tmp,'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': self.files},f,
+                  indent=1,sort_keys=True)
+      os.rename(tmp,self.path)
+    except (IOError, OSError), e:
+      print >>sys.stderr, "Manifest not saved:", e
@@ -2,10 +2,16 @@
 
 Package methods:
     main: Called from a command-line script, passed the working directory of
-        the script and an array of arguments. Returns reports as strings.
+        the script and an array of arguments. Streams the reports, in the
+        chosen --format, line by line to a file-like out as they are
+        generated; with no out, returns them as one string.
+    arg_parser: The argument parser of the command line
+    write_reports: Write the reports a command line asks for
+    server_reports: Run a command line's reports for a query server
 
 Classes:
     Nap: Methods to generate reports, and contains games, players, and qualdates
+    TreeScan: A gamefile tree walked and parsed, before the Nap is changed
 
 Grateful acknowledgement to Matthew J. Kidd of lajollabridge.com for his
 perl gamefile parsing tools, which are included here..
@@ -18,35 +24,128 @@ Morris "Mojo" Jones, mojo@bridgemojo.com
 """
 
 import sys
-import re
 import os
+import argparse
 import memcache
-import urllib
 import traceback
-from gamefile import Gamefile, GamefileException, GFUtils, Player
+from gamefile import Gamefile, GamefileException, GFUtils, Player, QualDate
+from gamefile.gfutils import clear_strings
 from prereg import PreReg
-from gamefile.player import canonical_pnum
-from subprocess import check_call, CalledProcessError
-from tempfile import mkstemp
+from decoder import get_decoder, DECODERS, ParallelDecoder, ConcurrentDecoder, DEFAULT_CONCURRENCY
+from decoder import DecoderFailure
+from cache import file_identity, open_disk_cache, memory_cache, GameCache
+from manifest import Manifest, GAME, DUPLICATE, REPLACED, SKIPPED, MANIFEST_SUFFIX
+from filetype import sniff, selected, CSV, SKIP
+from player_index import PlayerIndex
+from identity import IdentityResolver
+from date_index import DateIndex, PERIODS, periods, iso_date
+from partitions import PartitionedTree
+from snapshot import Snapshot, SnapshotGames, SnapshotGameList, write_snapshot
+from report import record, get_writer, report_text, ByteBuffer, WRITERS
+from server import NapServer, NapClient, DEFAULT_PORT, DEFAULT_INTERVAL
+from background import BackgroundTask
+from StringIO import StringIO
 from os.path import join
+from datetime import date
 from __init__ import __version__
 
 # This file's directory, necessary for finding ACBLdump utils
 __cwd__ = os.path.dirname(os.path.realpath(__file__))
 
+
+def qualdate_fields(qd):
+  """Report record fields for a QualDate, see report.record()"""
+  return (('date', qd.ptime.strftime('%Y-%m-%d')),
+          ('session', qd.session),
+          ('club_number', qd.club.number),
+          ('club_name', qd.club.name))
+
+
+class TreeScan(object):
+  """A gamefile tree as Nap.scan_tree() found it, to apply to the Nap
+
+  Attributes:
+    tree: The root directory of the tree
+    manifest: Manifest of the tree, or None
+    gamefiles: Every file of the walk, in order
+    unique: The game files, with duplicates left out
+    identities: Dictionary of each file to its identity
+    duplicates: List of (duplicate, original) files
+    results: Dictionary of each file parsed to a Gamefile or GamefileException
+    decoder: Decoder for the files left to parse, or None for the Nap's own
+  """
+
+  def __init__(self,tree,manifest,gamefiles,unique,identities,duplicates,results,decoder=None):
+    self.tree = tree
+    self.manifest = manifest
+    self.gamefiles = gamefiles
+    self.unique = unique
+    self.identities = identities
+    self.duplicates = duplicates
+    self.results = results
+    self.decoder = decoder
+
+
 class Nap(object):
   """Encapsulates games, players, and qualdates for use in reports
   """
 
-  def __init__(self):
+  def __init__(self,decoder=None,boards=False,cache=True,manifest=True,compact=False,
+               timeout=None,include=(),exclude=()):
+    """Args:
+      decoder: Name of the game file decoder backend (see decoder.py)
+      boards: If True, decode boards and hand records too
+      cache: True for the disk cache in its default directory, a path
+          string for a disk cache in that directory, False for none
+      manifest: If True, keep a manifest beside each game file tree
+          loaded (see manifest.py)
+      compact: If True, each game lets go of its raw dicts once it is
+          loaded (see Gamefile.release()). Its players are then built
+          right away, even for games from the parse cache. For long-running
+          processes that keep many seasons in memory.
+      timeout: Seconds allowed for decoding each game file, or None. A file
+          that takes longer is skipped. (See decoder.Decoder.)
+      include, exclude: Patterns of the files a tree walk takes, see
+          filetype.selected()
+    """
     self.games = {}
+    self.game_list = None
+    self.game_positions = {}
+    self.club_index = {}
+    self.game_qualifiers = {}
+    self.decoder = get_decoder(decoder,boards=boards,timeout=timeout)
+    self.skipped = []
+    self.identities = {}
+    self.parsed = {}
+    self.duplicates = []
+    self.sources = {}
+    self.replaced = []
+    self.use_manifest = manifest
+    self.include = list(include or ())
+    self.exclude = list(exclude or ())
+    self.compact = compact
     self.players = set()
+    self.player_list = None
+    self.players_loaded = False
+    self.registry = {}
+    self.player_index = PlayerIndex()
+    self.qualifications = {}
     self.qualdates = {}
+    self.appearances = None
+    self.by_date = None
+    self.snapshot = None
     self.prereg = {}
     if 'MEMCACHED' in os.environ:
       self.mc = memcache.Client([os.environ['MEMCACHED']],debug=1)
     else:
       self.mc = None
+    if cache:
+      self.disk_cache = open_disk_cache(None if cache is True else cache)
+      memory = memory_cache()
+    else:
+      self.disk_cache = None
+      memory = None
+    self.cache = GameCache(self.decoder.profile,memory,self.mc,self.disk_cache,self.decoder.name)
     for event in ('UF1','UF2'):
       self.prereg[event] = {}
       for flight in ('a','b','c'):
@@ -55,11 +154,15 @@ class Nap(object):
   def parse_game(self,gamefile):
     """Convert a raw ACBLscore gamefile into Gamefile object.
 
-    This function relies on a perl script and accompanying perl module
-    that are included in the package as package_data.
+    The game file is decoded by the Nap object's decoder, by default the
+    pure Python port of ACBLgamedecode. (See the decoder module.) Unless the
+    Nap object was created with boards=True, only the qualifier data is
+    decoded, and the Gamefile's gamefiledict holds no board results.
 
-    ACBLgamedump is described at this link:
-      https://lajollabridge.com/Software/ACBLgamedump/ACBLgamedump-About.htm
+    The file is sniffed first (see filetype.py), so one that is neither an
+    ACBLscore game file nor a CSV export is skipped without decoding. A
+    file that fails to parse is quarantined in the parse cache, and fails
+    again without being decoded until it changes.
 
     Args:
       gamefile: Path string to an ACBLscore game file on local storage
@@ -71,68 +174,334 @@ class Nap(object):
       GamefileException if there is a parse error.
     """
 
-    game = Gamefile()
+    # If the game is in the parse cache, load that
+    identity = self.identify(gamefile)
+    game = self.cached_game(gamefile,identity)
+    if game:
+      return game
+    reason = self.cache.get_failures([(gamefile, identity)]).get(gamefile)
+    if reason is not None:
+      raise GamefileException(reason)
+
+    try:
+      (kind, reason) = sniff(gamefile)
+      if kind == SKIP:
+        raise GamefileException(reason)
+      # See if this is a CSV file generated by ACBLscore
+      if kind == CSV:
+        game = Gamefile()
+        game.init_from_csv_file(gamefile)
+      else:
+        game = self.build_game(gamefile,self.decoder.decode(gamefile))
+    except DecoderFailure:
+      raise
+    except GamefileException, e:
+      self.cache.set_failures([(gamefile, identity, e)])
+      self.commit_cache()
+      raise
+
+    self.cache_game(gamefile,game,identity)
+    self.commit_cache()
+    return game
 
-    # If memcached is installed, and the JSON string is found, load that
-    if self.mc:
-      game_dict = self.mc.get(urllib.quote(gamefile))
-      if game_dict:
-        game.init_from_dict(game_dict)
-        return game
-
-    # See if this is a CSV file generated by ACBLscore
-    if re.match("^.*\\.csv$",gamefile,re.IGNORECASE):
-      game.init_from_csv_file(gamefile)
-    else:
-      dump = join(__cwd__,"ACBLgamedump.pl")
+  def parse_games(self,gamefiles,decoder=None):
+    """Convert a batch of raw ACBLscore gamefiles into Gamefile objects.
 
-      # Write JSON output to a temp file.
-      # (subprocess stdio capture cannot be used here. When this module is
-      # embedded in a web framework, the stdio handles are frequently
-      # unavailable.)
-      (handle,fname) = mkstemp()
-      try:
-        check_call("%s %s >%s 2>&1" % (dump, gamefile, fname),shell=True)
-      except CalledProcessError, e:
-        raise GamefileException(e)
-
-      with open(fname,"r") as f:
-        json = f.read()
-      if json.startswith('Not an ACBLscore game file'):
-        os.remove(fname)
-        raise GamefileException(json)
-      else:
-        os.remove(fname)
+    The identity of each file is saved in the identities dictionary, and
+    the batch parsed with decode_games().
+
+    Args:
+      gamefiles: List of path strings to game files on local storage
+      decoder: Decoder to use instead of the Nap object's own
+
+    Yields:
+      (gamefile, result) tuples in the order given, where result is a
+      Gamefile, or the GamefileException raised while parsing that file.
+    """
+    identities = {}
+    for gamefile in gamefiles:
+      identities[gamefile] = self.identities.get(gamefile) or self.identify(gamefile)
+      self.identities[gamefile] = identities[gamefile]
+    results = self.decode_games(gamefiles,identities,decoder)
+    for gamefile in gamefiles:
+      yield (gamefile, results[gamefile])
+
+  def decode_games(self,gamefiles,identities,decoder=None):
+    """Parse a batch of game files, without changing the Nap object.
+
+    The batch is looked up in the parse cache, and its new games stored
+    there, in one go each. Games found in the cache are used as they are,
+    and files quarantined there fail again without being decoded (see
+    parse_game()). The rest are sniffed, and only ACBLscore game files are
+    handed to the decoder, together, so backends that keep worker
+    processes can spread them out.
 
+    Args:
+      gamefiles: List of path strings to game files on local storage
+      identities: Dictionary of each game file to its identity, see identify()
+      decoder: Decoder to use instead of the Nap object's own
+
+    Returns:
+      Dictionary of each game file to a Gamefile, or the GamefileException
+      raised while parsing that file.
+    """
+    results = {}
+    to_decode = []
+    to_cache = []
+    to_quarantine = []
+    cached = self.cache.get_many([(f, identities[f]) for f in gamefiles])
+    failed = self.cache.get_failures([(f, identities[f]) for f in gamefiles if f not in cached])
+    for gamefile in gamefiles:
+      if gamefile in cached:
+        results[gamefile] = self.game_from_cache(cached[gamefile])
+        continue
+      if gamefile in failed:
+        results[gamefile] = GamefileException(failed[gamefile])
+        continue
+      (kind, reason) = sniff(gamefile)
+      if kind == SKIP:
+        results[gamefile] = GamefileException(reason)
+        to_quarantine.append((gamefile, identities[gamefile], results[gamefile]))
+      elif kind == CSV:
+        try:
+          game = Gamefile()
+          game.init_from_csv_file(gamefile)
+          to_cache.append((gamefile, identities[gamefile], game.gamefiledict))
+          results[gamefile] = game
+        except GamefileException, e:
+          results[gamefile] = e
+          to_quarantine.append((gamefile, identities[gamefile], e))
+      else:
+        to_decode.append(gamefile)
+
+    if decoder is None:
+      decoder = self.decoder
+    for (gamefile, game_dict) in decoder.decode_many(to_decode):
+      if isinstance(game_dict,GamefileException):
+        results[gamefile] = game_dict
+        if not isinstance(game_dict,DecoderFailure):
+          to_quarantine.append((gamefile, identities[gamefile], game_dict))
+        continue
       try:
-        game.init_from_json(json)
-      except GamefileException:
-        raise
-      except Exception, e:
-        traceback.print_exc()
-        raise GamefileException(e)
-
-      rating = game.get_rating()
-      if rating:
-        if not rating.startswith('NAP'):
-          raise GamefileException("Not NAP game: " + rating)
+        game = self.build_game(gamefile,game_dict)
+      except GamefileException, e:
+        results[gamefile] = e
+        if not isinstance(e,DecoderFailure):
+          to_quarantine.append((gamefile, identities[gamefile], e))
+        continue
+      to_cache.append((gamefile, identities[gamefile], game.gamefiledict))
+      results[gamefile] = game
+    self.cache.set_many(to_cache)
+    self.cache.set_failures(to_quarantine)
+    self.commit_cache()
+    return results
+
+  def build_game(self,gamefile,game_dict):
+    """Build a Gamefile from a decoded game file dict, accepting NAP games only.
+
+    Args:
+      gamefile: Path string the dict was decoded from, for error messages
+      game_dict: The list of event dictionaries returned by a decoder
+
+    Returns:
+      Gamefile
+
+    Exceptions:
+      GamefileException if the dict is malformed or not from a NAP game.
+      DecoderFailure if building it fails otherwise. That is a bug here
+      rather than a bad file, so the file is not quarantined.
+    """
+    game = Gamefile()
+    try:
+      game.init_from_dict(game_dict)
+    except GamefileException:
+      raise
+    except Exception, e:
+      traceback.print_exc()
+      raise DecoderFailure("Failed to build the game of %s: %r" % (gamefile, e))
+
+    rating = game.get_rating()
+    if rating:
+      if not rating.startswith('NAP'):
+        raise GamefileException("Not NAP game: " + rating)
+    else:
+      raise GamefileException("No rating for file %s" % gamefile)
+    return game
+
+  def identify(self,gamefile,manifest=None):
+    """(size, mtime, hash) of a game file, or None.
+
+    None is returned if the file cannot be read, in which case decoding it
+    will report the problem.
+
+    Args:
+      gamefile: Path string to a game file
+      manifest: Manifest of the tree the file is in. If the file's size and
+          mtime are as recorded there, the recorded hash is trusted and the
+          file is not read.
+    """
+    if manifest:
+      identity = manifest.identity(gamefile)
+      if identity:
+        return identity
+    try:
+      return file_identity(gamefile)
+    except (IOError, OSError):
+      return None
+
+  def collapse_duplicates(self,gamefiles,manifest=None):
+    """Drop game files whose contents are identical to an earlier file.
+
+    Clubs send the same game twice, under a differently cased name or in
+    another directory. Only the first copy (in the order given) needs
+    decoding. The Nap object is not changed; see apply_scan().
+
+    Args:
+      gamefiles: List of path strings to game files
+      manifest: Manifest of the tree, passed on to identify()
+    Returns:
+      (unique, identities, duplicates): the list of game files with
+      duplicates removed, a dictionary of each file to its identity, and
+      a list of (duplicate, original) tuples
+    """
+    unique = []
+    identities = {}
+    duplicates = []
+    seen = {}
+    for gamefile in gamefiles:
+      identity = self.identify(gamefile,manifest)
+      identities[gamefile] = identity
+      if identity is None:
+        unique.append(gamefile)
+        continue
+      digest = identity[2]
+      if digest in seen:
+        duplicates.append((gamefile, seen[digest]))
       else:
-        raise GamefileException("No rating for file %s" % gamefile)
+        seen[digest] = gamefile
+        unique.append(gamefile)
+    return (unique, identities, duplicates)
 
-    # Save the game file dict to memcache
-    if self.mc:
-      self.mc.set(urllib.quote(gamefile), game.gamefiledict)
-      self.mc.delete('CLUBS')
+  def cached_game(self,gamefile,identity=None):
+    """Return a Gamefile from the parse cache (see cache.GameCache), or None.
+
+    Args:
+      gamefile: Path string to a game file
+      identity: The file's identity from identify(). The cache is only
+          consulted when this is given.
+    """
+    game_dict = self.cache.get_many([(gamefile, identity)]).get(gamefile)
+    if game_dict:
+      return self.game_from_cache(game_dict)
+    return None
+
+  def game_from_cache(self,game_dict):
+    """A Gamefile of a game file dict from the parse cache"""
+    # The dict was built without error when it was cached, so its
+    # players can wait until they are needed
+    game = Gamefile(lazy=True)
+    game.init_from_dict(game_dict)
     return game
 
+  def cache_game(self,gamefile,game,identity=None):
+    """Save the game file dict to the parse cache"""
+    self.cache.set_many([(gamefile, identity, game.gamefiledict)])
+
+  def commit_cache(self):
+    """Write out changes to the parse cache. Derived memcache values, such as
+    the clubs of get_clubs(), are dropped once for the whole batch."""
+    self.cache.commit()
+
   def load_game(self,gamefile):
     """Save one gamefile in the games dictionary by its natural key"""
     game = self.parse_game(gamefile)
-    self.games[game.get_key()] = game
+    self.add_game(gamefile,game)
     return game
 
-  def load_games(self,gamefile_tree):
-    """Walk the gamefile tree and pass all files to load_game()
+  def add_game(self,gamefile,game):
+    """Save a parsed game by its natural key, noting which file it came from.
+
+    A different file with a game of the same key (the same club, date and
+    session) replaces the earlier one. That is reported on stderr and
+    appended to the replaced list as (gamefile, replaced gamefile).
+
+    Once load_players() has been called, the players set and qualdates
+    dictionary are kept up to date as well.
+    """
+    if self.compact:
+      game.release()
+    self.appearances = None
+    self.by_date = None
+    self.snapshot = None
+    self.game_list = None
+    key = game.get_key()
+    previous = self.sources.get(key)
+    if previous is not None and previous != gamefile:
+      self.replaced.append((gamefile, previous))
+      print >>sys.stderr, "Game in %s replaces %s" % (gamefile, previous)
+    if self.players_loaded and key in self.games:
+      self.remove_game_players(self.games[key])
+    self.games[key] = game
+    self.club_index.setdefault(game.get_club().number,set()).add(key)
+    self.sources[key] = gamefile
+    if self.players_loaded:
+      self.add_game_players(game)
+
+  def drop_game(self,key):
+    """Forget the game with the given key, and its players' qualifications"""
+    game = self.games.pop(key,None)
+    self.sources.pop(key,None)
+    self.appearances = None
+    self.by_date = None
+    self.snapshot = None
+    self.game_list = None
+    if game is not None:
+      number = game.get_club().number
+      club_games = self.club_index.get(number,set())
+      club_games.discard(key)
+      if not club_games:
+        self.club_index.pop(number,None)
+    if game is not None and self.players_loaded:
+      self.remove_game_players(game)
+
+  def drop_file(self,gamefile):
+    """Forget a game file, and the game that was loaded from it.
+
+    Games the file had replaced are forgotten as having been parsed, so
+    the next rescan() loads them again.
+    """
+    self.parsed.pop(gamefile,None)
+    self.skipped = [s for s in self.skipped if s[0] != gamefile]
+    for (key, source) in self.sources.items():
+      if source == gamefile:
+        self.drop_game(key)
+    for (newer, older) in self.replaced:
+      if newer == gamefile:
+        self.parsed.pop(older,None)
+    self.replaced = [r for r in self.replaced if gamefile not in r]
+
+  def walk_tree(self,gamefile_tree):
+    """List every file in the tree, in a stable sorted order
+
+    Manifests are left out. A partition's manifest (see partitions.py)
+    lives inside the tree it is a part of. So are files left out by the
+    include and exclude patterns.
+    """
+    gamefiles = []
+    for root, dirs, files in os.walk(gamefile_tree):
+      dirs.sort()
+      for f in sorted(files):
+        if f.endswith(MANIFEST_SUFFIX) or f.endswith(MANIFEST_SUFFIX + '.tmp'):
+          continue
+        path = join(root,f)
+        if (self.include or self.exclude) and not selected(
+            os.path.relpath(path,gamefile_tree),self.include,self.exclude):
+          continue
+        gamefiles.append(path)
+    return gamefiles
+
+  def load_games(self,gamefile_tree,jobs=None,concurrency=None):
+    """Walk the gamefile tree and load every game file found
 
     Since game file names are not globally unique, the practice here is
     to keep game files in subdirectories with a relevant name for the
@@ -142,30 +511,293 @@ class Nap(object):
     ACBL-assigned club number could be used as a parent directory instead,
     following practices of TheCommonGame.com)
 
+    Files with the same contents as one found earlier in the walk are
+    dropped first (see collapse_duplicates()). The rest are parsed as one
+    batch with decode_games(). Decoding can be
+    spread across several processes or threads; either way the games are
+    saved in the games dictionary in the sorted order of the tree walk, so
+    the outcome does not depend on which decoder finishes first.
+
+    Loading the same tree again only parses what changed; see rescan().
+
     This method does not throw the GamefileException. If a particular file
-    throws that exception, it is skipped with a message written to stderr.
+    throws that exception, it is skipped with a message written to stderr,
+    and (gamefile, exception) is appended to the skipped list.
 
     Args:
       gamefile_tree: The root directory of a tree of game files.
+      jobs: Number of decoding processes. None or 1 decodes in this
+          process, 0 starts one process per CPU.
+      concurrency: If given, decode this many files at once on threads of
+          this process instead (see decoder.ConcurrentDecoder)
     Returns:
       A list of Gamefile objects in their natural order, as returned by
       get_game_list(). (Not the games dictionary.)
     """
-    for root, dirs, files in os.walk(gamefile_tree):
-      for f in files:
-        try:
-          gamefile = join(root,f)
-          self.load_game(gamefile)
-        except GamefileException, e:
-          print >>sys.stderr, "Skipped %s" % gamefile, e
+    self.rescan(gamefile_tree,jobs,concurrency)
     return self.get_game_list()
 
+  def load_games_background(self,gamefile_tree,concurrency=DEFAULT_CONCURRENCY,lock=None,
+                            callback=None):
+    """Start loading a gamefile tree on a thread of its own, and return at once.
+
+    For callers that must not block while game files are decoded, such as
+    the event loop of a web front end. The files are decoded concurrently,
+    and the games merged into the games dictionary, just as by rescan().
+
+    The Nap changes while the load runs. Readers on other threads should
+    hold the lock passed here, which the load holds while it changes the
+    Nap, once the files are decoded (see rescan()).
+
+    Args:
+      gamefile_tree: The root directory of a tree of game files.
+      concurrency: Number of files decoded at once, as for load_games()
+      lock: Lock to hold while loading, or None
+      callback: Called with the task when the load is done, on its thread
+    Returns:
+      BackgroundTask (see background.py), whose result() is that of rescan()
+    """
+    return BackgroundTask(self.rescan,(gamefile_tree,),{'concurrency': concurrency,'lock': lock},
+                          callback=callback,name='nap-load')
+
+  def rescan(self,gamefile_tree,jobs=None,concurrency=None,lock=None):
+    """Bring the games from a gamefile tree up to date with the files in it.
+
+    Only files that were added or changed since the tree was last scanned
+    by this Nap object are parsed. Games from files that were removed, or
+    that now duplicate another file, are dropped. If load_players() has
+    been called, players and qualdates are updated game by game rather
+    than rebuilt.
+
+    Unless the Nap object was created with manifest=False, the manifest
+    beside the tree is read first and rewritten afterwards, so files whose
+    size and mtime are unchanged are found in the parse cache without
+    being read.
+
+    As in load_games(), when two files hold a game with the same key, the
+    one later in the walk wins, and files that cannot be parsed are
+    skipped with a message on stderr. A duplicate is reported on stderr
+    the first time it is found, not on every rescan.
+
+    The tree is walked and its files decoded first, by scan_tree(), which
+    leaves the Nap object as it is. Only then are the games changed, by
+    apply_scan(), holding the lock if one is given. Other threads reading
+    the Nap under the same lock wait only for that.
+
+    Args:
+      gamefile_tree: The root directory of a tree of game files.
+      jobs: Number of decoding processes, as for load_games()
+      concurrency: Number of decoding threads, as for load_games()
+      lock: Lock to hold while the games are changed, or None
+    Returns:
+      (added, changed, removed) lists of game file paths
+    """
+    scan = self.scan_tree(gamefile_tree,jobs,concurrency)
+    try:
+      if lock is None:
+        return self.apply_scan(scan)
+      with lock:
+        return self.apply_scan(scan)
+    finally:
+      # The games share their strings now; the tables need not outlive
+      # the load, nor grow with every reload of a long-running server
+      clear_strings()
+      QualDate.clear_dates()
+
+  def scan_tree(self,gamefile_tree,jobs=None,concurrency=None):
+    """Walk a gamefile tree and parse its new and changed files, for apply_scan().
+
+    The Nap object is not changed, only the parse cache, so other threads
+    may go on reading it meanwhile. Only one scan of a Nap should be
+    applied at a time.
+
+    Args:
+      gamefile_tree, jobs, concurrency: As for rescan()
+    Returns:
+      TreeScan
+    """
+    manifest = Manifest(gamefile_tree) if self.use_manifest else None
+    gamefiles = self.walk_tree(gamefile_tree)
+    (unique, identities, duplicates) = self.collapse_duplicates(gamefiles,manifest)
+
+    decoder = None
+    if concurrency:
+      decoder = ConcurrentDecoder(self.decoder.name,self.decoder.boards,concurrency,
+                                  self.decoder.timeout)
+    elif jobs is not None and jobs != 1:
+      decoder = ParallelDecoder(self.decoder.name,self.decoder.boards,jobs or None,
+                                self.decoder.timeout)
+
+    to_parse = [f for f in unique if f not in self.parsed or self.parsed[f] != identities[f]]
+    results = self.decode_games(to_parse,identities,decoder)
+    return TreeScan(gamefile_tree,manifest,gamefiles,unique,identities,duplicates,results,
+                    decoder)
+
+  def apply_scan(self,scan):
+    """Bring the games up to date with a TreeScan from scan_tree(). See rescan().
+
+    Returns:
+      (added, changed, removed) lists of game file paths
+    """
+    prefix = join(scan.tree,'')
+    previous = dict((f, i) for (f, i) in self.parsed.items() if f.startswith(prefix))
+
+    order = dict((f, i) for (i, f) in enumerate(scan.gamefiles))
+    # Only duplicates new since the last scan are reported again
+    known = set(d for d in self.duplicates if d[0].startswith(prefix))
+    self.duplicates = [d for d in self.duplicates if not d[0].startswith(prefix)]
+    for (duplicate, original) in scan.duplicates:
+      self.duplicates.append((duplicate, original))
+      if (duplicate, original) not in known:
+        print >>sys.stderr, "Duplicate %s of %s" % (duplicate, original)
+    self.identities.update(scan.identities)
+    for f in previous:
+      if f not in order:
+        self.identities.pop(f,None)
+
+    unique_set = set(scan.unique)
+    removed = [f for f in sorted(previous) if f not in unique_set]
+    changed = [f for f in scan.unique if f in previous and previous[f] != self.identities[f]]
+    added = [f for f in scan.unique if f not in previous]
+    for f in removed + changed:
+      self.drop_file(f)
+
+    to_parse = [f for f in scan.unique if f not in self.parsed]
+    # Files the scan did not parse, such as those a dropped file had
+    # replaced, are parsed now
+    missing = [f for f in to_parse if f not in scan.results]
+    results = dict(scan.results)
+    if missing:
+      results.update(self.parse_games(missing,scan.decoder))
+    for gamefile in to_parse:
+      game = results[gamefile]
+      self.parsed[gamefile] = self.identities[gamefile]
+      if isinstance(game,GamefileException):
+        self.skipped.append((gamefile, game))
+        print >>sys.stderr, "Skipped %s" % gamefile, game
+        continue
+      current = self.sources.get(game.get_key())
+      if current in order and order[current] > order[gamefile]:
+        # A file later in the walk already holds this game
+        self.replaced.append((current, gamefile))
+        print >>sys.stderr, "Game in %s replaces %s" % (current, gamefile)
+      else:
+        self.add_game(gamefile,game)
+
+    if scan.manifest:
+      self.update_manifest(scan.manifest,scan.gamefiles)
+    return (added, changed, removed)
+
+  def update_manifest(self,manifest,gamefiles):
+    """Record what became of each file of a scan, and save the manifest"""
+    keys = dict((source, key) for (key, source) in self.sources.items())
+    skipped = set(f for (f, e) in self.skipped)
+    duplicates = set(f for (f, original) in self.duplicates)
+    manifest.files = {}
+    for gamefile in gamefiles:
+      if gamefile in keys:
+        status = GAME
+      elif gamefile in duplicates:
+        status = DUPLICATE
+      elif gamefile in skipped:
+        status = SKIPPED
+      else:
+        status = REPLACED
+      manifest.record(gamefile,self.identities.get(gamefile),status,keys.get(gamefile))
+    manifest.save()
+
+  def load_snapshot(self,path):
+    """Load the games and players of a snapshot, instead of a tree.
+
+    The qualified players and their qualdates are rebuilt from the
+    snapshot right away. Games are built from it only as they are used,
+    and the appearance table reads its columns from the mapped file. See
+    snapshot.py. Meant for a Nap with nothing loaded yet.
+
+    Args:
+      path: Path string of a snapshot written by compile_snapshot()
+    Exceptions:
+      IOError, OSError if the file cannot be read
+      ValueError if it is not a snapshot, or of another format version
+    """
+    snapshot = Snapshot(path)
+    keys = snapshot.game_keys
+    players = snapshot.players()
+    homes = {}
+    for (p, home, quals) in players:
+      homes.setdefault(home,[]).append(p)
+    self.games = SnapshotGames(snapshot,homes,self.compact)
+    self.game_list = SnapshotGameList(self.games,keys)
+    self.game_positions = dict((k, idx) for (idx, k) in enumerate(keys))
+    self.club_index = {}
+    for (idx, key) in enumerate(keys):
+      self.sources[key] = snapshot.source(idx)
+      self.club_index.setdefault(key[0],set()).add(key)
+    (self.duplicates, self.replaced, self.skipped) = snapshot.files()
+
+    # As load_players() adds them, flight by flight and game by game
+    for (p, home, quals) in players:
+      key = p.get_key()
+      self.registry[key] = p
+      self.players.add(p)
+      self.qualifications[key] = dict((keys[g], set(flights)) for (g, flights) in quals)
+      qualdates = self.qualdates[p] = set()
+      for f in ('a','b','c'):
+        for (g, flights) in quals:
+          if f in flights:
+            qualdates.add(snapshot.qualdate(g))
+    self.player_list = [p for (p, home, quals) in players]
+    self.player_index.extend(self.player_list)
+    self.players_loaded = True
+    self.appearances = None
+    self.by_date = None
+    self.snapshot = snapshot
+
+  def compile_snapshot(self,path):
+    """Write the loaded games and players to a snapshot, for load_snapshot().
+
+    Exceptions:
+      ValueError if players are not loaded, or the Nap is compact
+    """
+    write_snapshot(self,path)
+
   def get_game_list(self):
-    """Returns a list of games sorted by their occurence date/time"""
-    gamelist = []
-    for g in self.games.keys():
-      gamelist.append(self.games[g])
-    return sorted(gamelist)
+    """Returns a list of games sorted by their occurence date/time
+
+    The games are sorted once, then again only after games are added or
+    dropped. The list returned is a copy, free to be changed.
+    """
+    return list(self.sorted_games())
+
+  def sorted_games(self):
+    """The cached sorted game list itself, see get_game_list(). Do not change it.
+
+    The game_positions dictionary, of game key to index in the list, is
+    rebuilt along with it.
+    """
+    if self.game_list is None:
+      self.game_list = sorted(self.games.values(),key=Gamefile.sort_key)
+      self.game_positions = dict((g.get_key(), idx) for (idx, g) in enumerate(self.game_list))
+    return self.game_list
+
+  def get_game(self,game_index):
+    """The game at a zero-based index into get_game_list()"""
+    return self.sorted_games()[game_index]
+
+  def get_club_games(self,club_number):
+    """The games of one club, sorted as in get_game_list()"""
+    self.sorted_games()
+    keys = self.club_index.get(club_number,())
+    return [self.games[k] for k in sorted(keys,key=self.game_positions.get)]
+
+  def get_player_list(self):
+    """Returns a list of the players set, sorted by name and player number
+
+    Sorted once, as for get_game_list(), until players come or go.
+    """
+    if self.player_list is None:
+      self.player_list = sorted(self.players,key=Player.sort_key)
+    return list(self.player_list)
 
   def load_players(self):
     """Populate the class players set with qualified players.
@@ -177,23 +809,233 @@ class Nap(object):
     Players who did not qualify in any flight are not added by this
     method, but the player set is not cleared at the start. This method
     will only add players, deleting none.
+
+    Each game is visited once, for all three flights. Players are kept in
+    the registry dictionary by key (see Player.get_key()), so finding a
+    player already seen takes no search. The Player object kept for each
+    key is the first one found qualifying in the highest flight, taking
+    the games in order. It collects the qualifier flags from every game.
+
+    From then on, games added or dropped (see add_game() and rescan())
+    update the players set and qualdates as they go.
+    """
+    # key -> (flight index, game index, Player) of the best Player so far
+    found = {}
+    # key -> [(flights, QualDate)] of each qualifying game, in game order
+    seen = {}
+    for (idx, game) in enumerate(self.sorted_games()):
+      gkey = game.get_key()
+      qd = game.get_qualdate()
+      qualifiers = game.qualifiers()
+      self.game_qualifiers[gkey] = [p for (p, flights) in qualifiers]
+      for (p, flights) in qualifiers:
+        key = p.get_key()
+        self.qualifications.setdefault(key,{}).setdefault(gkey,set()).update(flights)
+        seen.setdefault(key,[]).append((flights, qd))
+        if key in self.registry:
+          continue
+        rank = ('abc'.index(flights[0]), idx)
+        if key not in found or rank < found[key][0:2]:
+          found[key] = (rank[0], rank[1], p)
+
+    for key in found:
+      player = found[key][2]
+      self.registry[key] = player
+      self.player_index.add(player)
+      self.players.add(player)
+    self.player_list = None
+
+    # Qualdates of the same club and date are equal whatever the session,
+    # so the order they are added in decides which one is kept. See
+    # player_qualdates().
+    for key in seen:
+      player = self.registry[key]
+      qualdates = self.qualdates.setdefault(player,set())
+      for f in ('a','b','c'):
+        for (flights, qd) in seen[key]:
+          if f in flights:
+            player.set_qual(f,True)
+            qualdates.add(qd)
+    self.players_loaded = True
+    return self.get_player_list()
+
+  def update_player(self,key):
+    """Bring one player up to date with the games they qualified in.
+
+    The Player object kept for the key is elected again, by the rule of
+    load_players(): the first one found qualifying in the highest flight,
+    taking the games in order. It gets the qualifier flags and qualdates
+    of all the games. A Player the key is no longer kept as goes back to
+    the flags its own game gave it.
+    """
+    games = self.qualifications[key]
+
+    def rank(gkey):
+      return (min('abc'.index(f) for f in games[gkey]), self.games[gkey].sort_key())
+
+    old = self.registry.get(key)
+    player = self.game_player(min(games,key=rank),key) or old
+    if player is not old:
+      if old is not None:
+        self.player_index.remove(old)
+        self.players.discard(old)
+        self.qualdates.pop(old,None)
+        for gkey in games:
+          if self.game_player(gkey,key) is old:
+            for f in ('a','b','c'):
+              old.set_qual(f,f in games[gkey])
+      self.registry[key] = player
+      self.player_index.add(player)
+      self.players.add(player)
+      self.player_list = None
+
+    flights = set()
+    for g in games.values():
+      flights.update(g)
+    for f in ('a','b','c'):
+      player.set_qual(f,f in flights)
+    self.qualdates[player] = self.player_qualdates(key)
+
+  def game_player(self,gkey,key):
+    """The qualified Player of one game with a player key, or None"""
+    players = self.game_qualifiers.get(gkey)
+    if players is None:
+      players = self.game_qualifiers[gkey] = [p for (p, f) in self.games[gkey].qualifiers()]
+    for p in players:
+      if p.get_key() == key:
+        return p
+    return None
+
+  def add_game_players(self,game):
+    """Add the qualified players of one game to the players set.
+
+    Which game qualified each player in which flights is kept in the
+    qualifications dictionary, so that the game can be taken out again.
+    Each player's Player object is elected again (see update_player()),
+    so a player first seen in this game is kept as its Player object.
+
+    Args:
+      game: Gamefile
     """
-    for flight in ['a','b','c']:
-      for game in self.get_game_list():
-        qd = game.get_qualdate()
-        qp = game.qualified_players(flight)
-        for p in qp:
-          if p in self.players:
-            for p2 in self.players:
-              if p2 == p:
-                p2.set_qual(flight,True)
-          else:
-            self.players.add(p)
-          if p not in self.qualdates:
-            self.qualdates[p] = set([qd])
-          else:
-            self.qualdates[p].add(qd)
-    return sorted(self.players)
+    gkey = game.get_key()
+    qualifiers = game.qualifiers()
+    self.game_qualifiers[gkey] = [p for (p, flights) in qualifiers]
+    for (p, flights) in qualifiers:
+      key = p.get_key()
+      self.qualifications.setdefault(key,{}).setdefault(gkey,set()).update(flights)
+      self.update_player(key)
+
+  def remove_game_players(self,game):
+    """Take the qualifications earned in one game out of the players set.
+
+    Players who qualified in no other game are removed. The others have
+    their Player object elected again, and their qualifier flags and
+    qualdates recomputed, from their remaining games.
+
+    Args:
+      game: Gamefile, which must still have its players
+    """
+    gkey = game.get_key()
+    self.game_qualifiers.pop(gkey,None)
+    for (p, flights) in game.qualifiers():
+      key = p.get_key()
+      games = self.qualifications.get(key)
+      if not games or gkey not in games:
+        continue
+      del games[gkey]
+      if games:
+        self.update_player(key)
+        continue
+      player = self.registry.pop(key)
+      self.player_index.remove(player)
+      del self.qualifications[key]
+      self.players.discard(player)
+      self.player_list = None
+      self.qualdates.pop(player,None)
+
+  def player_qualdates(self,key):
+    """Rebuild the qualdates of one player from the qualifications dictionary.
+
+    QualDates of the same club and date are equal whatever the session, so
+    the set keeps only the first one added. They are added in the order
+    load_players() adds them, flight by flight and game by game, so the
+    outcome is the same as loading the players from scratch.
+    """
+    games = self.qualifications[key]
+    qualdates = set()
+    for flight in ('a','b','c'):
+      for game in sorted((self.games[g] for g in games if flight in games[g]),
+                         key=Gamefile.sort_key):
+        qualdates.add(game.get_qualdate())
+    return qualdates
+
+  def check_players(self):
+    """Compare the players with what load_players() would make of the games now.
+
+    Games added and dropped (see rescan()) update the players as they go,
+    and are meant to leave them just as loading them from scratch would.
+    This rebuilds that from the games, without changing anything, and
+    lists where the two differ.
+
+    Returns: list of (player key, description) tuples, empty if they agree
+    """
+    # key -> ((flight index, game index), Player, flights, [(flights, QualDate)])
+    fresh = {}
+    for (idx, game) in enumerate(self.sorted_games()):
+      qd = game.get_qualdate()
+      for (p, flights) in game.qualifiers():
+        key = p.get_key()
+        rank = ('abc'.index(flights[0]), idx)
+        entry = fresh.get(key)
+        if entry is None:
+          entry = fresh[key] = [rank, p, set(), []]
+        elif rank < entry[0]:
+          entry[0:2] = [rank, p]
+        entry[2].update(flights)
+        entry[3].append((flights, qd))
+
+    problems = []
+    for key in sorted(set(fresh) | set(self.registry)):
+      player = self.registry.get(key)
+      if player is None:
+        problems.append((key, "qualified, but not among the players"))
+        continue
+      if key not in fresh:
+        problems.append((key, "among the players, but qualified in no game"))
+        continue
+      (rank, p, flights, quals) = fresh[key]
+      if (player.lname, player.fname, player.pnum) != (p.lname, p.fname, p.pnum):
+        problems.append((key, "kept as %s, not %s" % (player, p)))
+      got = ''.join(f for f in ('a','b','c') if player.is_qual(f))
+      want = ''.join(f for f in ('a','b','c') if f in flights)
+      if got != want:
+        problems.append((key, "flights %s, not %s" % (got or '-', want)))
+      qualdates = set()
+      for f in ('a','b','c'):
+        for (fl, qd) in quals:
+          if f in fl:
+            qualdates.add(qd)
+      if sorted(map(str,self.qualdates.get(player,()))) != sorted(map(str,qualdates)):
+        problems.append((key, "qualdates differ"))
+    return problems
+
+  def check_players_report(self):
+    """Report where the players differ from a fresh load_players(), see check_players().
+
+    Returns: report string
+    """
+    return report_text(self.check_players_lines())
+
+  def check_players_lines(self):
+    """Generate the (text, record) lines of check_players_report(). See report.py."""
+    problems = self.check_players()
+    yield (os.linesep + "Player check" + os.linesep, None)
+    for (key, description) in problems:
+      yield ("  %s: %s" % (" ".join(map(str,key)), description) + os.linesep,
+             record('check',
+                    ('player_key', " ".join(map(str,key))),
+                    ('problem', description)))
+    yield (os.linesep + "Problems: %s" % len(problems) + os.linesep, None)
 
   def single_flight(self,flight):
     """Return players from the class players set for a single flight.
@@ -201,11 +1043,7 @@ class Nap(object):
     Note that this method does not check or modify the class players
     set, which must be populated before calling. (See load_players().)
     """
-    flight_players = []
-    for p in self.players:
-      if p.is_qual(flight):
-        flight_players.append(p)
-    return sorted(flight_players)
+    return [p for p in self.get_player_list() if p.is_qual(flight)]
 
   def club_games(self,club_number=None,game_index=None):
     """ Return structured data for a sorted list of club games
@@ -216,9 +1054,17 @@ class Nap(object):
       club_number: if specified will select games at a particular club
       game_index: if specified will select an individual game by its index
     """
-    all_games = self.get_game_list()
+    all_games = self.sorted_games()
+    if game_index is not None:
+      selected = []
+      if 0 <= game_index < len(all_games):
+        selected.append((game_index, all_games[game_index]))
+    elif club_number:
+      selected = [(self.game_positions[g.get_key()], g) for g in self.get_club_games(club_number)]
+    else:
+      selected = enumerate(all_games)
     resultlist = []
-    for idx, game in enumerate(all_games):
+    for idx, game in selected:
       result = {
         'game_index': idx,
         'club_number': game.get_club().number,
@@ -229,14 +1075,7 @@ class Nap(object):
         'tables': game.table_count(),
         'game': game,
       }
-      if game_index is not None:
-        if game_index == idx:
-          resultlist.append(result)
-      elif club_number:
-        if club_number == result['club_number']:
-          resultlist.append(result)
-      else:
-        resultlist.append(result)
+      resultlist.append(result)
     return resultlist
 
   def club_games_report(self,game_index=None,club_number=None):
@@ -250,28 +1089,34 @@ class Nap(object):
 
     Returns: report string
     """
-    report = ""
+    return report_text(self.club_games_lines(game_index,club_number))
+
+  def club_games_lines(self,game_index=None,club_number=None):
+    """Generate the (text, record) lines of club_games_report(). See report.py."""
     fmt = "{:>5} {:8} {:30} {:17} {:<8} {:>5}"
-    report += fmt.format("Index","Club No.","Club Name","Game Date","Session","Tables")
-    report += os.linesep
+    yield (fmt.format("Index","Club No.","Club Name","Game Date","Session","Tables")
+           + os.linesep, None)
     club_game_list = self.club_games(game_index=game_index,club_number=club_number)
     table_count = 0.0
-    for idx, game in enumerate(club_game_list):
-      report += fmt.format(game['game_index'] + 1,
+    for game in club_game_list:
+      yield (fmt.format(game['game_index'] + 1,
           game['club_number'],
           game['club_name'],
           game['game_date'],
           game['session_name'],
           game['tables'],
-          )
-      report += os.linesep
+          ) + os.linesep,
+          record('club_games',
+                 ('game_index', game['game_index'] + 1),
+                 ('club_number', game['club_number']),
+                 ('club_name', game['club_name']),
+                 ('game_date', game['game_date']),
+                 ('session', game['session_name']),
+                 ('tables', game['tables'])))
       table_count += game['tables']
-    report += os.linesep
-    report += "Total games: %s" % len(club_game_list)
-    report += os.linesep
-    report += "Total tables: %s" % table_count
-    report += os.linesep
-    return report
+    yield (os.linesep, None)
+    yield ("Total games: %s" % len(club_game_list) + os.linesep, None)
+    yield ("Total tables: %s" % table_count + os.linesep, None)
 
   def flight_report(self,flight,verbose=False):
     """Report players for a single flight
@@ -283,18 +1128,25 @@ class Nap(object):
       verbose: If True, the report will include game dates and locations
     Returns: report string
     """
-    report = ""
+    return report_text(self.flight_lines(flight,verbose))
+
+  def flight_lines(self,flight,verbose=False):
+    """Generate the (text, record) lines of flight_report(). See report.py."""
     if verbose:
-      report += "\nQualifiers in Flight %s\n" % flight.upper()
-      report += os.linesep
+      yield ("\nQualifiers in Flight %s\n" % flight.upper() + os.linesep, None)
     for p in self.single_flight(flight):
-      report += "%s" % p
-      report += os.linesep
+      yield ("%s" % p + os.linesep,
+             record('flight',
+                    ('flight', flight.upper()),
+                    ('player_number', p.pnum),
+                    ('name', p.terse())))
       if verbose:
-        for qd in sorted(self.qualdates[p]):
-          report += "            %s" % qd
-          report += os.linesep
-    return report
+        for qd in sorted(self.qualdates[p],key=QualDate.sort_key):
+          yield ("            %s" % qd + os.linesep,
+                 record('flight_qualdate',
+                        ('flight', flight.upper()),
+                        ('player_number', p.pnum),
+                        *qualdate_fields(qd)))
 
   def flight_players(self,flight):
     """Return a nice sorted array of Players with Qualdates
@@ -309,7 +1161,7 @@ class Nap(object):
       flight_players.append({
         'player_name': p.terse(),
         'player_number': p.pnum,
-        'qualdates': sorted(self.qualdates[p]),
+        'qualdates': sorted(self.qualdates[p],key=QualDate.sort_key),
       })
     return flight_players
 
@@ -321,50 +1173,175 @@ class Nap(object):
           whole list from the nap object
     Returns: report string
     """
-    if not players_list:
-      players_list = self.players
-    report = ""
-    report += os.linesep + "Summary of NAP Qualifiers" + os.linesep
-    report += os.linesep
+    return report_text(self.summary_lines(players_list))
+
+  def summary_lines(self,players_list=None):
+    """Generate the (text, record) lines of summary_report(). See report.py."""
+    if not players_list or players_list is self.players:
+      players_list = self.get_player_list()
+    else:
+      players_list = sorted(players_list,key=Player.sort_key)
+    yield (os.linesep + "Summary of NAP Qualifiers" + os.linesep, None)
+    yield (os.linesep, None)
     fmt = "{:8} {:30} {:^4} {:^4} {:^4}"
-    report += fmt.format("Player#","Name","FltA","FltB","FltC")
-    report += os.linesep
-    for p in sorted(players_list):
-      flta = 'Q' if p.is_qual('a') else ' '
-      fltb = 'Q' if p.is_qual('b') else ' '
-      fltc = 'Q' if p.is_qual('c') else ' '
-      report += fmt.format(p.pnum,p.terse(),flta,fltb,fltc)
-      report += os.linesep
-    return report
+    yield (fmt.format("Player#","Name","FltA","FltB","FltC") + os.linesep, None)
+    for p in players_list:
+      (qa, qb, qc) = (p.is_qual('a'), p.is_qual('b'), p.is_qual('c'))
+      flta = 'Q' if qa else ' '
+      fltb = 'Q' if qb else ' '
+      fltc = 'Q' if qc else ' '
+      yield (fmt.format(p.pnum,p.terse(),flta,fltb,fltc) + os.linesep,
+             record('summary',
+                    ('player_number', p.pnum),
+                    ('name', p.terse()),
+                    ('a', qa),
+                    ('b', qb),
+                    ('c', qc)))
 
   def players_from_game(self,game):
-    my_player_set = set()
-    for flight in ['a','b','c']:
-      my_player_set.update(game.qualified_players(flight))
-    return my_player_set
+    """The set of qualified Players of one game, as the game has them.
+
+    Once players are loaded, they come from the game_qualifiers index.
+    """
+    qualifiers = self.game_qualifiers.get(game.get_key()) if self.players_loaded else None
+    if qualifiers is None:
+      qualifiers = [p for (p, flights) in game.qualifiers()]
+    return set(qualifiers)
+
+  def player_games(self,player_number):
+    """The games a qualified player qualified in, sorted as get_game_list().
+
+    Assumes players have been loaded. An unknown player has no games.
+    """
+    player = self.find_player(player_number)
+    if player is None:
+      return []
+    self.sorted_games()
+    games = self.qualifications.get(player.get_key(),{})
+    return [self.games[k] for k in sorted(games,key=self.game_positions.get)]
 
   def club_report(self,club_num):
     """Select for a particular club, report games and players
     """
-    report = "Club report for club %s" % club_num
-    report += os.linesep
+    return report_text(self.club_lines(club_num))
 
-    report += self.club_games_report(club_number=club_num)
-    report += os.linesep
+  def club_lines(self,club_num):
+    """Generate the (text, record) lines of club_report(). See report.py."""
+    yield ("Club report for club %s" % club_num + os.linesep, None)
+
+    for line in self.club_games_lines(club_number=club_num):
+      yield line
+    yield (os.linesep, None)
 
     my_games = self.club_games(club_number=club_num)
-    report += "Games from club: %s" % len(my_games)
-    report += os.linesep
+    yield ("Games from club: %s" % len(my_games) + os.linesep,
+           record('club',
+                  ('club_number', club_num),
+                  ('games', len(my_games))))
 
     my_player_set = set()
     for g in my_games:
       my_player_set.update(self.players_from_game(g['game']))
 
-    report += self.player_summary_report(my_player_set)
+    for line in self.player_summary_lines(my_player_set):
+      yield line
+
+  def appearance_table(self):
+    """The AppearanceTable of the loaded games, built on first use.
 
-    return report
+    The table is rebuilt after games are added or dropped.
+
+    Exceptions:
+      ImportError if NumPy, an optional dependency, is not installed
+    """
+    if self.appearances is None:
+      from appearances import AppearanceTable
+      if self.snapshot is not None and self.snapshot.has_appearances():
+        self.appearances = self.snapshot.appearance_table(self.sorted_games())
+      else:
+        self.appearances = AppearanceTable(self.get_game_list())
+    return self.appearances
+
+  def date_index(self):
+    """The DateIndex of the loaded games, built on first use.
+
+    The index is rebuilt after games are added or dropped. A Nap loaded
+    from a snapshot builds it from the players' qualifications instead of
+    the games.
+    """
+    if self.by_date is None:
+      if self.snapshot is not None:
+        positions = self.game_positions
+        self.by_date = DateIndex.from_rows(
+            (self.snapshot.qualdate(positions[g]).ptime.toordinal(), key, flights)
+            for (key, games) in self.qualifications.items()
+            for (g, flights) in games.items())
+      else:
+        self.by_date = DateIndex(self.sorted_games())
+    return self.by_date
+
+  def qualified_between(self,flight,start,end,first_only=False):
+    """Players who qualified in a flight in a game from start to end.
+
+    Assumes players have been loaded.
+
+    Args:
+      flight: One of {'a','b','c'}
+      start, end: dates, inclusive
+      first_only: If True, only players who first qualified in the flight
+          in that range
+    Returns: list of Players, sorted by name and player number
+    """
+    keys = self.date_index().qualified_between(flight,start.toordinal(),
+                                               end.toordinal(),first_only)
+    return sorted((self.registry[k] for k in keys),key=Player.sort_key)
+
+  def qualified_by(self,flight,when):
+    """Number of players who had qualified in a flight on or before a date"""
+    return self.date_index().qualified_by(flight,when.toordinal())
+
+  def qualifier_curve(self,period='month'):
+    """Cumulative count of qualified players in each flight, period by period.
+
+    The periods are the calendar weeks or months from the first qualifying
+    game to the last. Counted in one vectorized pass over the appearance
+    table, for charts in the webapp.
+
+    Args:
+      period: 'week' or 'month'
+    Returns:
+      list of dictionaries of start and end (dates) of each period, and
+      the number of players qualified by its end by flight letter
+    Exceptions:
+      ImportError if NumPy, an optional dependency, is not installed
+    """
+    span = self.date_index().span()
+    if span is None:
+      return []
+    spans = periods(date.fromordinal(span[0]),date.fromordinal(span[1]),period)
+    counts = self.appearance_table().cumulative_qualifiers(
+        [end.toordinal() for (start, end) in spans])
+    curve = []
+    for (idx, (start, end)) in enumerate(spans):
+      point = {'start': start, 'end': end}
+      for flight in ('a','b','c'):
+        point[flight] = int(counts[flight][idx])
+      curve.append(point)
+    return curve
 
   def flight_totals(self,players=None):
+    """Count qualified players in each flight
+
+    Once an appearance table has been built (see appearance_table()), the
+    totals for the whole players set come from it.
+
+    Args:
+      players: Players to count by their own flags, instead of the whole
+          players set
+    Returns: dictionary of counts by flight letter. { 'a': 5, 'b': 4, 'c': 7 }
+    """
+    if not players and self.appearances is not None and self.players_loaded:
+      return self.appearances.flight_totals()
     if not players:
       players = self.players
     flight_totals = {
@@ -382,23 +1359,133 @@ class Nap(object):
     return flight_totals
 
   def player_summary_report(self,players=None):
+    return report_text(self.player_summary_lines(players))
+
+  def player_summary_lines(self,players=None):
+    """Generate the (text, record) lines of player_summary_report(). See report.py."""
     if not players:
       players = self.players
-    report = self.summary_report(players_list=players)
-    report += os.linesep
+    for line in self.summary_lines(players_list=players):
+      yield line
+    yield (os.linesep, None)
 
     flight_totals = self.flight_totals()
 
-    report += "Qualified players" + os.linesep
-    report += "Total: %s" % len(players)
-    report += os.linesep
-    report += "  Flight A: %s" % flight_totals['a']
-    report += os.linesep
-    report += "  Flight B: %s" % flight_totals['b']
-    report += os.linesep
-    report += "  Flight C: %s" % flight_totals['c']
-    report += os.linesep
-    return report
+    yield ("Qualified players" + os.linesep, None)
+    yield ("Total: %s" % len(players) + os.linesep,
+           record('qualified',
+                  ('players', len(players)),
+                  ('a', flight_totals['a']),
+                  ('b', flight_totals['b']),
+                  ('c', flight_totals['c'])))
+    yield ("  Flight A: %s" % flight_totals['a'] + os.linesep, None)
+    yield ("  Flight B: %s" % flight_totals['b'] + os.linesep, None)
+    yield ("  Flight C: %s" % flight_totals['c'] + os.linesep, None)
+
+  def stats_report(self):
+    """Report games, player appearances and qualifiers for each club.
+
+    Counted with the appearance table, so NumPy must be installed.
+
+    Returns: report string
+    """
+    return report_text(self.stats_lines())
+
+  def stats_lines(self):
+    """Generate the (text, record) lines of stats_report(). See report.py.
+
+    Exceptions:
+      ImportError from the first line if NumPy is not installed
+    """
+    table = self.appearance_table()
+    yield (os.linesep + "Club statistics" + os.linesep, None)
+    yield (os.linesep, None)
+    fmt = "{:8} {:30} {:>5} {:>6} {:>7} {:>4} {:>4} {:>4}"
+    yield (fmt.format("Club No.","Club Name","Games","Appear","Players","QA","QB","QC")
+           + os.linesep, None)
+    for t in sorted(table.club_totals(),key=lambda t: t['club'].number):
+      yield (fmt.format(t['club'].number,t['club'].name,t['games'],
+          t['appearances'],t['players'],t['a'],t['b'],t['c']) + os.linesep,
+          record('club_stats',
+                 ('club_number', t['club'].number),
+                 ('club_name', t['club'].name),
+                 ('games', t['games']),
+                 ('appearances', t['appearances']),
+                 ('players', t['players']),
+                 ('a', t['a']),
+                 ('b', t['b']),
+                 ('c', t['c'])))
+    yield (os.linesep, None)
+    totals = table.flight_totals()
+    yield ("Games: %s" % len(table.games) + os.linesep, None)
+    yield ("Appearances: %s" % len(table) + os.linesep, None)
+    yield ("Players: %s" % len(table.players) + os.linesep, None)
+    yield ("Qualified: A %s, B %s, C %s" % (totals['a'],totals['b'],totals['c'])
+           + os.linesep,
+           record('stats',
+                  ('games', len(table.games)),
+                  ('appearances', len(table)),
+                  ('players', len(table.players)),
+                  ('a', totals['a']),
+                  ('b', totals['b']),
+                  ('c', totals['c'])))
+
+  def curve_report(self,period='month'):
+    """Report the number of players qualified in each flight, period by period.
+
+    Returns: report string
+    """
+    return report_text(self.curve_lines(period))
+
+  def curve_lines(self,period='month'):
+    """Generate the (text, record) lines of curve_report(). See report.py.
+
+    Exceptions:
+      ImportError from the first line if NumPy is not installed
+    """
+    curve = self.qualifier_curve(period)
+    yield (os.linesep + "Qualified players by %s" % period + os.linesep, None)
+    yield (os.linesep, None)
+    fmt = "{:10} {:10} {:>5} {:>5} {:>5}"
+    yield (fmt.format("From","To","FltA","FltB","FltC") + os.linesep, None)
+    for point in curve:
+      (start, end) = (point['start'].isoformat(), point['end'].isoformat())
+      yield (fmt.format(start,end,point['a'],point['b'],point['c']) + os.linesep,
+             record('curve',
+                    ('period', period),
+                    ('start', start),
+                    ('end', end),
+                    ('a', point['a']),
+                    ('b', point['b']),
+                    ('c', point['c'])))
+
+  def between_report(self,start,end):
+    """Report the players who qualified in each flight from start to end.
+
+    Args:
+      start, end: dates, inclusive
+    Returns: report string
+    """
+    return report_text(self.between_lines(start,end))
+
+  def between_lines(self,start,end):
+    """Generate the (text, record) lines of between_report(). See report.py."""
+    index = self.date_index()
+    yield (os.linesep + "Qualified from %s to %s" % (start.isoformat(),end.isoformat())
+           + os.linesep, None)
+    for flight in ('a','b','c'):
+      yield (os.linesep + "Flight %s" % flight.upper() + os.linesep, None)
+      for p in self.qualified_between(flight,start,end):
+        first = date.fromordinal(index.first[flight][p.get_key()])
+        yield ("%s first qualified %s" % (p,first.isoformat()) + os.linesep,
+               record('between',
+                      ('flight', flight.upper()),
+                      ('player_number', p.pnum),
+                      ('name', p.terse()),
+                      ('first_qualified', first.isoformat()),
+                      ('new', first >= start)))
+      yield ("Qualified by %s: %s" % (end.isoformat(),self.qualified_by(flight,end))
+             + os.linesep, None)
 
   def game_report(self,gameidx):
     """Produce a game report
@@ -406,46 +1493,188 @@ class Nap(object):
     Args:
       gameidx: one-based index into games list
     """
-    gamelist = self.get_game_list()
-    game = gamelist[int(gameidx)-1]
-    report = "Report for single game" + os.linesep
-    report += "%s" % game
-    report += os.linesep
+    return report_text(self.game_lines(gameidx))
+
+  def game_lines(self,gameidx):
+    """Generate the (text, record) lines of game_report(). See report.py."""
+    game = self.get_game(int(gameidx)-1)
+    yield ("Report for single game" + os.linesep, None)
+    yield ("%s" % game + os.linesep,
+           record('game',
+                  ('game_index', int(gameidx)),
+                  ('club_number', game.get_club().number),
+                  ('club_name', game.get_club().name),
+                  ('game_date', game.get_game_date()),
+                  ('session', GFUtils.SESSION_STRING[game.get_club_session_num()]),
+                  ('tables', game.table_count())))
 
     my_player_set = set()
     my_player_set.update(self.players_from_game(game))
 
-    report += self.player_summary_report(my_player_set)
+    for line in self.player_summary_lines(my_player_set):
+      yield line
+
+  def game_files_report(self):
+    """Report game files that were not loaded as games of their own.
 
-    return report
+    Lists files that duplicate another file's contents, games replaced by
+    another file's game with the same key, and skipped files.
+
+    Returns: report string
+    """
+    return report_text(self.game_files_lines())
+
+  def game_files_lines(self):
+    """Generate the (text, record) lines of game_files_report(). See report.py."""
+    yield (os.linesep + "Duplicate game files" + os.linesep, None)
+    for (gamefile, original) in self.duplicates:
+      yield ("  %s" % gamefile + os.linesep,
+             record('files', ('file', gamefile), ('status', DUPLICATE), ('detail', original)))
+      yield ("    same as %s" % original + os.linesep, None)
+    yield (os.linesep + "Replaced games" + os.linesep, None)
+    for (gamefile, previous) in self.replaced:
+      yield ("  %s" % previous + os.linesep,
+             record('files', ('file', previous), ('status', REPLACED), ('detail', gamefile)))
+      yield ("    replaced by %s" % gamefile + os.linesep, None)
+    yield (os.linesep + "Skipped files" + os.linesep, None)
+    for (gamefile, e) in self.skipped:
+      yield ("  %s" % gamefile + os.linesep,
+             record('files', ('file', gamefile), ('status', SKIPPED), ('detail', "%s" % e)))
+      yield ("    %s" % e + os.linesep, None)
+
+  def quarantine_lines(self):
+    """Generate the (text, record) lines of a report of the quarantined game
+    files of the trees loaded. See report.py.
+
+    Quarantined files failed to parse, and are not decoded again until they
+    change (see parse_game()). Only files as they are now, in a tree this
+    Nap object has walked, are listed.
+    """
+    yield (os.linesep + "Quarantined game files" + os.linesep, None)
+    count = 0
+    for (gamefile, identity, reason, since) in self.cache.failures():
+      if tuple(self.identities.get(gamefile) or ()) != identity:
+        continue
+      count += 1
+      since = date.fromtimestamp(since).strftime('%Y-%m-%d')
+      yield ("  %s" % gamefile + os.linesep,
+             record('quarantine',
+                    ('file', gamefile),
+                    ('reason', reason),
+                    ('since', since)))
+      yield ("    %s (since %s)" % (reason, since) + os.linesep, None)
+    yield (os.linesep + "Total: %s" % count + os.linesep, None)
 
   def find_player(self,player_number):
-    player_key = canonical_pnum(player_number)
-    for p in self.players:
-      if player_key == p.canon_pnum:
-        return p
-    return None
+    """The qualified Player with a player number, in either form, or None.
+
+    Assumes players have been loaded.
+    """
+    return self.player_index.find(player_number)
+
+  def search_players(self,text,limit=10):
+    """Qualified players whose name or player number starts with text.
+
+    Names are matched as "lname, fname", ignoring case and accents. See
+    PlayerIndex.search().
+
+    Args:
+      text: The start of a name or player number
+      limit: Most matches to return
+    Returns: list of Players
+    """
+    return self.player_index.search(text,limit)
+
+  def search_report(self,text,limit=10):
+    """Report players matching a search, with their flights"""
+    return report_text(self.search_lines(text,limit))
+
+  def search_lines(self,text,limit=10):
+    """Generate the (text, record) lines of search_report(). See report.py."""
+    yield ("Players matching \"%s\"" % text + os.linesep, None)
+    for p in self.search_players(text,limit):
+      flights = ''.join(f.upper() for f in ('a','b','c') if p.is_qual(f))
+      yield ("%s %s" % (p,flights) + os.linesep,
+             record('search',
+                    ('search', text),
+                    ('player_number', p.pnum),
+                    ('name', p.terse()),
+                    ('flights', flights)))
 
   def player_report(self,player_number):
-    report = ""
+    return report_text(self.player_lines(player_number))
+
+  def player_lines(self,player_number):
+    """Generate the (text, record) lines of player_report(). See report.py."""
     player = self.find_player(player_number)
     if not player:
-      report += "Not found in qualified player list"
-      return report
-    report += "%s" % player
-    report += os.linesep + "Qualification flights: "
+      yield ("Not found in qualified player list",
+             record('player', ('player_number', player_number), ('found', False)))
+      return
+    flights = ''.join(f.upper() for f in ('a','b','c') if player.is_qual(f))
+    text = "%s" % player
+    text += os.linesep + "Qualification flights: "
     if player.is_qual('a'):
-      report += "A "
+      text += "A "
     if player.is_qual('b'):
-      report += "B "
+      text += "B "
     if player.is_qual('c'):
-      report += "C"
-    report += os.linesep
-    report += "Played in qualifier games:" + os.linesep
+      text += "C"
+    yield (text + os.linesep,
+           record('player',
+                  ('player_number', player.pnum),
+                  ('found', True),
+                  ('name', player.terse()),
+                  ('flights', flights)))
+    yield ("Played in qualifier games:" + os.linesep, None)
     for qd in self.qualdates[player]:
-      report += "   %s" % qd
-      report += os.linesep
-    return report
+      yield ("   %s" % qd + os.linesep,
+             record('player_qualdate',
+                    ('player_number', player.pnum),
+                    *qualdate_fields(qd)))
+
+  def strat_totals_lines(self):
+    """Generate (text, record) lines of the pairs in each strat of each game.
+
+    Diagnostic. See EventDetails.compute_total_pairs().
+    """
+    for k in self.games.keys():
+      game = self.games[k]
+      details = game.get_event_details()
+      totals = details.compute_total_pairs()
+      yield ("%s" % game + os.linesep + "%s" % totals + os.linesep,
+             record('strat_totals',
+                    ('club_number', game.get_club().number),
+                    ('game_date', game.get_game_date()),
+                    ('session', GFUtils.SESSION_STRING[game.get_club_session_num()]),
+                    *sorted(totals.items())))
+
+  def dupe_lines(self,qualified_only=True):
+    """Generate (text, record) lines of players found under several spellings.
+
+    Each cluster of spellings likely to be one player is listed once, with
+    why its spellings were linked and the number of games each was seen
+    in. Qualifying spellings are marked Q. See identity.py.
+
+    Args:
+      qualified_only: If True, only clusters with a qualifying spelling
+    """
+    resolver = IdentityResolver(self.get_game_list())
+    clusters = resolver.clusters(qualified_only=qualified_only)
+    for (idx, (identities, reasons)) in enumerate(clusters):
+      yield ("Cluster %s: %s" % (idx + 1,", ".join(reasons)) + os.linesep, None)
+      for identity in identities:
+        p = identity.player
+        games = "%s game%s" % (identity.games,"" if identity.games == 1 else "s")
+        yield ("  %s %s %s" % (p,"Q" if identity.qualified else " ",games) + os.linesep,
+               record('dupe',
+                      ('cluster', idx + 1),
+                      ('reason', ", ".join(reasons)),
+                      ('player_number', p.pnum),
+                      ('name', p.terse()),
+                      ('games', identity.games),
+                      ('qualified', identity.qualified)))
+    yield (os.linesep + "Clusters: %s" % len(clusters) + os.linesep, None)
 
   def get_clubs(self):
     """Return a dictionary of clubs. The club number is the key. Value is the name.
@@ -509,26 +1738,13 @@ class Nap(object):
 # End of Nap object
 
 
-def main(scriptdir,arglist):
-  """Command line oriented report generator
+def arg_parser(parser_class=None):
+  """The argument parser of the qual command line, see main()
 
   Args:
-    scriptdir: 
-        If the gamefile_tree is relative, or default, it's assumed to be 
-        relative to the directory supplied in scriptdir. If gamefile_tree is 
-        supplied and starts with /, this argument is unnecessary.
-    arglist:
-        A string list, expected to be sys.argv from the command line. Will be
-        parsed by argparse.
-
-  The argument list may include a number of individual game files or with
-  the -t option, the top of a gamefile tree. Game files will be found by
-  walking the tree from that root.
+    parser_class: argparse.ArgumentParser, or a subclass of it
   """
-
-  import argparse
-
-  parser = argparse.ArgumentParser(description='Create NAP qualifer list')
+  parser = (parser_class or argparse.ArgumentParser)(description='Create NAP qualifer list')
   parser.add_argument('gamefiles', type=str, 
       help="gamefile file name(s)", nargs='*')
   parser.add_argument('-t', '--tree', default="./gamefiles",
@@ -541,6 +1757,8 @@ def main(scriptdir,arglist):
       help="Report for an individual game")
   parser.add_argument('-p', '--player', action="append", default=[],
       help="Report for an individual player, by player number")
+  parser.add_argument('-S', '--search', action="append", default=[],
+      help="Find qualified players by the start of their name or player number")
   parser.add_argument('-f', '--flight', action="append", default=[], 
       choices=("a","b","c"),
       help="Select A B or C to report qualifying players")
@@ -554,30 +1772,74 @@ def main(scriptdir,arglist):
       help="Generate an interesting report of player duplicates")
   parser.add_argument('--totals', action="store_true",
       help="Diagnostic report of flight totals")
+  parser.add_argument('--stats', action="store_true",
+      help="Club statistics from the appearance table (needs NumPy)")
+  parser.add_argument('--curve', choices=PERIODS, default=None,
+      help="Players qualified in each flight by the end of each week or month (needs NumPy)")
+  parser.add_argument('--between', nargs=2, type=iso_date, metavar=('START','END'),
+      help="Players who qualified from START to END, dates as YYYY-MM-DD")
+  parser.add_argument('-P', '--partition', action="append", default=[],
+      help="Load only these partitions of the tree: a directory name, season or stage")
+  parser.add_argument('--partitions', action="store_true",
+      help="List the partitions (top-level directories) of the tree")
+  parser.add_argument('--join', nargs=2, metavar=('QUALIFIED','PLAYED'),
+      help="Players who qualified in the QUALIFIED partitions and played in the PLAYED ones")
+  parser.add_argument('--join-club', default=None, metavar='CLUB',
+      help="With --join, only games of this club number count as played")
+  parser.add_argument('--compile', default=None, metavar='SNAPSHOT',
+      help="Write the loaded games and players to a SNAPSHOT file, for --snapshot")
+  parser.add_argument('--snapshot', default=None,
+      help="Load games and players from a SNAPSHOT file made by --compile, instead of the tree")
+  parser.add_argument('--serve', nargs='?', const=str(DEFAULT_PORT), default=None,
+      metavar='[HOST:]PORT',
+      help="Keep the games loaded and answer queries over HTTP on PORT (see server.py, "
+           "default port %s)" % DEFAULT_PORT)
+  parser.add_argument('--reload', type=int, default=DEFAULT_INTERVAL, metavar='SECONDS',
+      help="With --serve, rescan the tree every SECONDS, 0 never (default=%s)" % DEFAULT_INTERVAL)
+  parser.add_argument('--server', default=None, metavar='URL',
+      help="Have the qual server at URL (see --serve) run the reports, instead of loading games")
+  parser.add_argument('--files', action="store_true",
+      help="Report duplicate, replaced, and skipped game files")
+  parser.add_argument('--quarantine', action="store_true",
+      help="Report game files that failed to parse, and are not tried again until they change")
+  parser.add_argument('--check-players', action="store_true",
+      help="Check the players against a fresh load of the games, as after --serve rescans")
+  parser.add_argument('--format', choices=sorted(WRITERS.keys()), default="text",
+      help="Report format: fixed-pitch text, or CSV or JSON Lines records (default=text)")
   parser.add_argument('--test', action="store_true",
       help="For developmental test reports")
-  args = parser.parse_args(arglist)
-
-  # Encapsulate the games, players, and qualdates
-  nap = Nap()
-
-  # if gamefiles are specified on the command line, process those
-  # otherwise look for gamefiles on the gamefile tree
-  if args.gamefiles:
-    for filename in args.gamefiles:
-      nap.load_game(filename)
-  else:
-    if args.tree:
-      gamefile_tree = args.tree
-
-    if gamefile_tree[0] != '/':
-      gamefile_tree = join(scriptdir,gamefile_tree)
-
-    nap.load_games(gamefile_tree)
-
-  nap.load_players()
-  report = ""
+  parser.add_argument('--decoder', choices=sorted(DECODERS.keys()), default=None,
+      help="Game file decoder backend (default=python, or $NAP_DECODER)")
+  parser.add_argument('--boards', action="store_true",
+      help="Also decode boards and hand records (slower, rarely needed)")
+  parser.add_argument('-j', '--jobs', type=int, default=1,
+      help="Decode game files in JOBS parallel processes, 0 for one per CPU (default=1)")
+  parser.add_argument('--concurrency', type=int, default=None, metavar='N',
+      help="Decode N game files at once on threads, instead of in processes (see --jobs)")
+  parser.add_argument('--timeout', type=float, default=None, metavar='SECONDS',
+      help="Skip a game file that takes longer than SECONDS to decode")
+  parser.add_argument('--include', action="append", default=[], metavar='PATTERN',
+      help="Walk only the files of the tree matching PATTERN, such as '*.AC?' (may be repeated)")
+  parser.add_argument('--exclude', action="append", default=[], metavar='PATTERN',
+      help="Leave out the files of the tree matching PATTERN, such as 'old/*' (may be repeated)")
+  parser.add_argument('--cache-dir', default=None,
+      help="Directory of the parse cache (default=$NAP_CACHE or ~/.cache/nap)")
+  parser.add_argument('--no-cache', action="store_true",
+      help="Do not use or update the parse cache or the tree manifest")
+  return parser
+
+
+def write_reports(nap,args,writer,tree=None):
+  """Write the reports asked for on a qual command line.
 
+  Args:
+    nap: Nap, with games and players loaded
+    args: Parsed arguments, see arg_parser()
+    writer: ReportWriter to write to, see report.py
+    tree: PartitionedTree, for the partition reports
+  Exceptions:
+    ValueError if --join names no partition of the tree
+  """
   # Here I'm going to test various algorithms for data reduction
   if args.test:
     entry = 'UF1'
@@ -592,79 +1854,274 @@ def main(scriptdir,arglist):
   # (Note that higher strats should include the number of pairs from
   # lower strats as well, and do not at present.)
   if args.totals:
-    for k in nap.games.keys():
-      game = nap.games[k]
-      details = game.get_event_details()
-      totals = details.compute_total_pairs()
-      print game
-      print totals
+    writer.write(nap.strat_totals_lines())
 
   # Club games report
   # List all clubs and game dates in the data set
   # Print an index number useful for displaying an individual game result
   if args.clubgames:
-    report += nap.club_games_report()
+    writer.write(nap.club_games_lines())
 
   # Club report
   for club in args.club:
-    report += nap.club_report(club)
+    writer.write(nap.club_lines(club))
 
   # Game report
   for gameidx in args.game:
-    report += nap.game_report(gameidx)
+    writer.write(nap.game_lines(gameidx))
 
   # Player report
   for pnum in args.player:
-    report += nap.player_report(pnum)
-    report += os.linesep
+    writer.write(nap.player_lines(pnum))
+    writer.line(os.linesep,None)
+
+  # Player search
+  for text in args.search:
+    writer.write(nap.search_lines(text))
+    writer.line(os.linesep,None)
 
   # Flight report
   # This is the report for individual flight qualifiers. If multiple flights are
   # specified on the command line, each report will be generated
   for flight in args.flight:
-    report += nap.flight_report(flight,args.verbose)
+    writer.write(nap.flight_lines(flight,args.verbose))
 
   # Summary report
   # This report is a summary of all players and qualifying flights, emulating the
   # report from ACBLscore
   if args.summary:
-    report += nap.player_summary_report()
+    writer.write(nap.player_summary_lines())
+
+  # Club statistics
+  # Games, appearances and qualifiers per club, counted with NumPy
+  if args.stats:
+    try:
+      writer.write(nap.stats_lines())
+    except ImportError, e:
+      print >>sys.stderr, "Club statistics need NumPy:", e
+
+  # Qualification dates
+  # Cumulative qualifiers period by period, and who qualified in a date range
+  if args.curve:
+    try:
+      writer.write(nap.curve_lines(args.curve))
+    except ImportError, e:
+      print >>sys.stderr, "Qualifier curve needs NumPy:", e
+  if args.between:
+    writer.write(nap.between_lines(*args.between))
+
+  # Partitions
+  # The seasons and stages of the tree, and players joined across them
+  if args.partitions:
+    writer.write(tree.partitions_lines())
+  if args.join:
+    writer.write(tree.join_lines(args.join[0],args.join[1],club_number=args.join_club))
+
+  # Game files report
+  # Files that were collapsed as duplicates, replaced, or skipped while loading
+  if args.files:
+    writer.write(nap.game_files_lines())
+
+  # Quarantine report
+  # Files the parse cache holds as unparseable or not NAP games
+  if args.quarantine:
+    writer.write(nap.quarantine_lines())
+
+  # Player check
+  # Where the players, as kept up to date by rescans, differ from a fresh load
+  if args.check_players:
+    writer.write(nap.check_players_lines())
 
   # Dupe report
   # This report lists players who appear in multiple game files under slightly
-  # different names or player numbers
-  # (The dupe report isn't yet de-duped. :) )
+  # different names or player numbers, each cluster of spellings once
   if args.dupe:
-    report  += os.linesep + "Interesting player duplications" + os.linesep + os.linesep
-    napdupe = Nap()
-    if args.gamefiles:
-      for filename in args.gamefiles:
-        napdupe.load_game(filename)
-    else:
-      if args.tree:
-        gamefile_tree = args.tree
-
-      if gamefile_tree[0] != '/':
-        gamefile_tree = join(scriptdir,gamefile_tree)
-
-    napdupe.load_games(gamefile_tree)
-    qual_players = napdupe.load_players()
-    keys = {}
-    for qp in qual_players:
-      keys[qp.get_key()] = qp
-
-    for k in napdupe.games.keys():
-      game = napdupe.games[k]
-      players = game.all_players()
-      for p in players:
-        if p.get_key() in keys:
-          q = keys[p.get_key()]
-          if p.fname != q.fname or \
-              p.lname != q.lname or \
-              p.pnum != q.pnum:
-            report += "%s%s" % (p,q)
-            report += os.linesep
+    writer.line(os.linesep + "Interesting player duplications" + os.linesep + os.linesep,None)
+    writer.write(nap.dupe_lines())
+
+
+# Options of qual that load games, which a server has done already
+LOAD_OPTIONS = ('gamefiles', 'partition', 'partitions', 'join', 'compile',
+                'snapshot', 'serve', 'decoder', 'boards', 'timeout', 'include', 'exclude',
+                'cache_dir', 'no_cache')
+
+
+class QueryArgumentParser(argparse.ArgumentParser):
+  """An argument parser that raises ValueError instead of exiting"""
+
+  def error(self,message):
+    raise ValueError(message)
+
+  def exit(self,status=0,message=None):
+    raise ValueError(message or "qual exited")
+
+
+def server_reports(nap,arglist):
+  """Run the reports of a qual argument list on a loaded Nap, for a server.
+
+  Args:
+    nap: Nap, with games and players loaded
+    arglist: qual arguments, as for main()
+  Returns: the output of the reports, as a byte string
+  Exceptions:
+    ValueError if the arguments are bad, would load games, or would
+    write files (--test saves preregistrations)
+  """
+  parser = arg_parser(QueryArgumentParser)
+  args = parser.parse_args(arglist)
+  defaults = parser.parse_args([])
+  changed = [o for o in LOAD_OPTIONS + ('tree', 'jobs', 'concurrency')
+             if getattr(args,o) != getattr(defaults,o)]
+  if changed:
+    raise ValueError("The server has loaded its games already: %s" %
+                     ", ".join('--' + o.replace('_','-') for o in changed))
+  if args.test:
+    raise ValueError("The server does not run --test, which writes preregistrations")
+  out = ByteBuffer()
+  writer = get_writer(args.format,out)
+  write_reports(nap,args,writer)
+  writer.close()
+  return out.getvalue()
+
+
+def main(scriptdir,arglist,out=None):
+  """Command line oriented report generator
+
+  Args:
+    scriptdir: 
+        If the gamefile_tree is relative, or default, it's assumed to be 
+        relative to the directory supplied in scriptdir. If gamefile_tree is 
+        supplied and starts with /, this argument is unnecessary.
+    arglist:
+        A string list, expected to be sys.argv from the command line. Will be
+        parsed by argparse.
+    out:
+        File-like object to stream the reports to, line by line, as they
+        are generated. If None, the reports are returned as one string.
+
+  Returns: the reports as a string if out is None, otherwise None
+
+  The argument list may include a number of individual game files or with
+  the -t option, the top of a gamefile tree. Game files will be found by
+  walking the tree from that root.
+
+  With --serve, the games stay loaded and queries are answered until the
+  server is interrupted (see server.py). With --server, nothing is loaded
+  and the server at that URL runs the reports instead.
+  """
+
+  parser = arg_parser()
+  args = parser.parse_args(arglist)
+
+  # A thin client of a qual server: the server runs the reports
+  if args.server:
+    try:
+      output = NapClient(args.server).qual(arglist)
+    except ValueError, e:
+      parser.error(str(e))
+    except IOError, e:
+      parser.error("cannot reach server %s: %s" % (args.server,e))
+    if out is None:
+      return output
+    out.write(output)
+    return None
+
+  cache = False if args.no_cache or args.snapshot else (args.cache_dir or True)
+
+  def new_nap():
+    return Nap(decoder=args.decoder,boards=args.boards,cache=cache,manifest=not args.no_cache,
+               timeout=args.timeout,include=args.include,exclude=args.exclude)
+
+  # Encapsulate the games, players, and qualdates
+  nap = new_nap()
+
+  # The partition reports load only the partitions they name, so when they
+  # are all that is asked for, the tree as a whole is not loaded
+  partition_only = (args.partitions or args.join) and not (
+      args.clubgames or args.club or args.game or args.player or args.search or
+      args.flight or args.summary or args.stats or args.curve or args.between or
+      args.files or args.quarantine or args.check_players or args.dupe or args.totals or args.test)
+
+  # if gamefiles are specified on the command line, process those
+  # otherwise look for gamefiles on the gamefile tree
+  tree = None
+  trees = []
+  if args.snapshot:
+    if args.gamefiles or args.partition or args.partitions or args.join:
+      parser.error("--snapshot replaces gamefiles and partitions")
+    try:
+      nap.load_snapshot(args.snapshot)
+    except (IOError, OSError, ValueError), e:
+      parser.error("cannot load snapshot: %s" % e)
+  elif args.gamefiles:
+    if args.partition or args.partitions or args.join:
+      parser.error("partitions are of a gamefile tree, not of gamefiles named")
+    for filename in args.gamefiles:
+      nap.load_game(filename)
+  else:
+    if args.tree:
+      gamefile_tree = args.tree
+
+    if gamefile_tree[0] != '/':
+      gamefile_tree = join(scriptdir,gamefile_tree)
+
+    if args.partition or args.partitions or args.join:
+      tree = PartitionedTree(gamefile_tree,new_nap,jobs=args.jobs,concurrency=args.concurrency)
+
+    if args.partition:
+      selected = []
+      try:
+        for selector in args.partition:
+          selected.extend(p for p in tree.select(selector) if p not in selected)
+      except ValueError, e:
+        parser.error(str(e))
+      if len(selected) == 1:
+        nap = selected[0].load(args.jobs,args.concurrency)
+      else:
+        for partition in selected:
+          nap.load_games(partition.path,jobs=args.jobs,concurrency=args.concurrency)
+      trees = [p.path for p in selected]
+    elif not partition_only:
+      nap.load_games(gamefile_tree,jobs=args.jobs,concurrency=args.concurrency)
+      trees = [gamefile_tree]
+
+  if not nap.players_loaded:
+    nap.load_players()
+
+  if args.compile:
+    try:
+      nap.compile_snapshot(args.compile)
+    except (IOError, OSError, ValueError), e:
+      parser.error("cannot compile snapshot: %s" % e)
+
+  # Query server: answer queries until interrupted, reloading the tree as
+  # it changes
+  if args.serve:
+    (host, sep, port) = args.serve.rpartition(':')
+    try:
+      server = NapServer((host or '127.0.0.1', int(port)),nap,trees=trees,jobs=args.jobs,
+                         concurrency=args.concurrency,
+                         interval=args.reload,reports=server_reports)
+    except ValueError:
+      parser.error("--serve needs a port number, not '%s'" % args.serve)
+    except IOError, e:
+      parser.error("cannot serve on %s: %s" % (args.serve,e))
+    server.serve()
+    return None
+
+  buf = None
+  if out is None:
+    out = buf = StringIO()
+  writer = get_writer(args.format,out)
+
+  try:
+    write_reports(nap,args,writer,tree)
+  except ValueError, e:
+    parser.error(str(e))
+
+  writer.close()
 
   # End of nap.main()
-  return report
+  if buf is not None:
+    return buf.getvalue()
 
@@ -0,0 +1,236 @@
+"""Season and stage partitions of a game file tree
+
+A game file tree keeps each season's games, and each stage of the season,
+in a directory of its own: gamefiles/2017 for the club qualifiers and
+gamefiles/2017-unit-finals for the unit finals, say. Each top-level
+directory is a partition with its own Nap: its own games, players and
+indexes, loaded only when a query needs it. Questions that span
+partitions, such as players who qualified in the 2017 club games and
+played in the unit finals, are answered by joining the partitions' player
+keys, so only the partitions named are ever in memory.
+
+Classes:
+    Partition: One top-level directory of a tree, loaded on demand
+    PartitionedTree: The partitions of a tree, and joins across them
+
+Functions:
+    classify: The season and stage of a partition, from its name
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import os
+import re
+from os.path import join, isdir
+from collections import OrderedDict
+from gamefile import Player
+from report import record
+
+# Stages of a season
+CLUB = 'club'
+UNIT_FINALS = 'unit-finals'
+STAGES = (CLUB, UNIT_FINALS)
+
+
+def classify(name):
+  """(season, stage) of a partition directory name.
+
+  The season is the first four-digit year in the name, or None. A name
+  that mentions unit finals ("2017-unit-finals", "UnitFinal2018") is the
+  unit finals stage, any other the club qualifiers.
+  """
+  m = re.search(r'(?<!\d)(\d{4})(?!\d)',name)
+  season = m.group(1) if m else None
+  stage = UNIT_FINALS if re.search(r'unit[\W_]*finals?',name,re.I) else CLUB
+  return (season, stage)
+
+
+class Partition(object):
+  """One top-level directory of a game file tree
+
+  Attributes:
+    name: Directory name
+    path: Path string of the directory
+    season: Season year string, or None, see classify()
+    stage: CLUB or UNIT_FINALS
+    nap: The partition's Nap, with games and players loaded, or None
+        until load() is called
+  """
+
+  def __init__(self,name,path,factory):
+    """Args:
+      name, path: Name and path of the directory
+      factory: Called with no arguments for a new, empty Nap
+    """
+    self.name = name
+    self.path = path
+    (self.season, self.stage) = classify(name)
+    self.factory = factory
+    self.nap = None
+
+  def load(self,jobs=None,concurrency=None):
+    """The partition's Nap, loading its games and players the first time"""
+    if self.nap is None:
+      nap = self.factory()
+      nap.load_games(self.path,jobs=jobs,concurrency=concurrency)
+      nap.load_players()
+      self.nap = nap
+    return self.nap
+
+  def unload(self):
+    """Let go of the partition's games and players"""
+    self.nap = None
+
+  def file_count(self):
+    count = 0
+    for (root, dirs, files) in os.walk(self.path):
+      count += len(files)
+    return count
+
+
+class PartitionedTree(object):
+  """The partitions of a game file tree, each loaded when first queried
+
+  Partitions are named by selectors: a partition's directory name, or
+  else a season or a stage, so "2017" is the 2017 directory if there is
+  one, and "unit-finals" is every unit finals partition. Selectors may be
+  joined with commas. Game files at the top of the tree, outside any
+  directory, are in no partition.
+
+  Attributes:
+    gamefile_tree: Top directory of the tree
+    partitions: OrderedDict of directory name to Partition, sorted by name
+  """
+
+  def __init__(self,gamefile_tree,factory,jobs=None,concurrency=None):
+    """Args:
+      gamefile_tree: Top directory of the tree
+      factory: Called with no arguments for a new, empty Nap
+      jobs: Parallel decode jobs for loading a partition, see Nap.load_games()
+      concurrency: Decode threads for loading a partition, likewise
+    """
+    self.gamefile_tree = gamefile_tree
+    self.jobs = jobs
+    self.concurrency = concurrency
+    self.partitions = OrderedDict()
+    for name in sorted(os.listdir(gamefile_tree)):
+      path = join(gamefile_tree,name)
+      if isdir(path):
+        self.partitions[name] = Partition(name,path,factory)
+
+  def select(self,selector):
+    """The partitions named by a selector, in name order.
+
+    Exceptions:
+      ValueError if some part of the selector names no partition
+    """
+    selected = set()
+    for part in selector.split(','):
+      part = part.strip()
+      if part in self.partitions:
+        matches = [part]
+      else:
+        matches = [n for (n, p) in self.partitions.items() if p.season == part]
+        if not matches:
+          matches = [n for (n, p) in self.partitions.items() if p.stage == part]
+      if not matches:
+        raise ValueError("No partition of %s is named '%s' (partitions: %s)" %
+                         (self.gamefile_tree, part, ", ".join(self.partitions)))
+      selected.update(matches)
+    return [self.partitions[n] for n in self.partitions if n in selected]
+
+  def load(self,selector):
+    """The Naps of the partitions named by a selector, loaded if need be"""
+    return [p.load(self.jobs,self.concurrency) for p in self.select(selector)]
+
+  def qualified(self,selector,flight=None):
+    """Players who qualified in the partitions named by a selector.
+
+    Args:
+      selector: See select()
+      flight: If given, only players who qualified in this flight
+    Returns: dictionary of player key to Player, the first partition's
+    """
+    players = {}
+    for nap in self.load(selector):
+      for (key, p) in nap.registry.items():
+        if flight is None or p.is_qual(flight):
+          players.setdefault(key,p)
+    return players
+
+  def played(self,selector,club_number=None):
+    """Players who played in the partitions named by a selector.
+
+    Args:
+      selector: See select()
+      club_number: If given, only players in games of this club number
+          (a unit final session has a club number of its own, U568-1 say)
+    Returns: dictionary of player key to Player
+    """
+    players = {}
+    for nap in self.load(selector):
+      if club_number:
+        games = nap.get_club_games(club_number)
+      else:
+        games = nap.sorted_games()
+      for game in games:
+        for p in game.all_players():
+          if p.pnum != 'dummy':
+            players.setdefault(p.get_key(),p)
+    return players
+
+  def join(self,qualified_in,played_in,flight=None,club_number=None):
+    """Players who qualified in some partitions and played in others.
+
+    Args:
+      qualified_in: Selector of the partitions to have qualified in
+      played_in: Selector of the partitions to have played in
+      flight: If given, only players who qualified in this flight
+      club_number: If given, only games of this club number count as
+          having played
+    Returns: list of the qualifying Players, sorted by name and number
+    """
+    qualified = self.qualified(qualified_in,flight)
+    played = self.played(played_in,club_number)
+    return sorted((qualified[k] for k in qualified if k in played),key=Player.sort_key)
+
+  def partitions_lines(self):
+    """Generate the (text, record) lines of a list of the partitions. See report.py."""
+    fmt = "{:24} {:6} {:12} {:>5} {:6}"
+    yield (os.linesep + "Partitions of %s" % self.gamefile_tree + os.linesep, None)
+    yield (os.linesep, None)
+    yield (fmt.format("Partition","Season","Stage","Files","Loaded") + os.linesep, None)
+    for p in self.partitions.values():
+      files = p.file_count()
+      loaded = p.nap is not None
+      yield (fmt.format(p.name,p.season or '',p.stage,files,"yes" if loaded else "no")
+             + os.linesep,
+             record('partition',
+                    ('partition', p.name),
+                    ('season', p.season),
+                    ('stage', p.stage),
+                    ('files', files),
+                    ('loaded', loaded)))
+
+  def join_lines(self,qualified_in,played_in,flight=None,club_number=None):
+    """Generate the (text, record) lines of a join() report. See report.py."""
+    players = self.join(qualified_in,played_in,flight,club_number)
+    title = "Qualified in %s" % qualified_in
+    if flight:
+      title += " flight %s" % flight.upper()
+    title += ", played in %s" % played_in
+    if club_number:
+      title += " club %s" % club_number
+    yield (os.linesep + title + os.linesep, None)
+    yield (os.linesep, None)
+    for p in players:
+      flights = ''.join(f.upper() for f in ('a','b','c') if p.is_qual(f))
+      yield ("%s %s" % (p,flights) + os.linesep,
+             record('join',
+                    ('qualified_in', qualified_in),
+                    ('played_in', played_in),
+                    ('player_number', p.pnum),
+                    ('name', p.terse()),
+                    ('flights', flights)))
+    yield (os.linesep + "Total: %s" % len(players) + os.linesep, None)
@@ -0,0 +1,168 @@
+"""Lookup and type-ahead search of qualified players
+
+Classes:
+    PlayerIndex: Players by player number, and sorted name and number
+        lists for prefix search
+
+Functions:
+    normalize: Fold a name or player number for searching
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import bisect
+import unicodedata
+from collections import OrderedDict
+from gamefile.player import canonical_pnum
+
+
+def normalize(s):
+  """Fold a string for searching: lower case, accents and extra spaces removed.
+
+  Byte strings are taken as UTF-8 (command line arguments) if they
+  decode as such, otherwise as Latin-1 (CSV exports), like the strings
+  in ACBLscore game files.
+  """
+  if isinstance(s,str):
+    try:
+      s = s.decode('utf-8')
+    except UnicodeDecodeError:
+      s = s.decode('latin-1')
+  try:
+    # Most names are plain ASCII, which has no accents to remove
+    s.encode('ascii')
+  except UnicodeEncodeError:
+    s = unicodedata.normalize('NFKD',s)
+    s = u''.join(c for c in s if not unicodedata.combining(c))
+  return u' '.join(s.lower().split())
+
+
+class PlayerIndex(object):
+  """Players by canonical player number, and by name and number prefix
+
+  The prefix indexes are sorted lists of (folded string, player key)
+  tuples, searched with bisect. A lookup takes time in proportion to the
+  log of the number of players plus the number of matches returned.
+  Adding or removing a player keeps the lists sorted.
+
+  Attributes:
+    players: Dictionary of Player.get_key() to Player
+    by_pnum: Dictionary of canonical player number to Player. Where
+        non-members share a number, the first one indexed.
+    names: Sorted list of ("lname, fname", key), folded
+    pnums: Sorted list of (player number, key), folded, for both the
+        player number as given and its canonical form
+  """
+
+  def __init__(self):
+    self.players = {}
+    self.by_pnum = {}
+    self.names = []
+    self.pnums = []
+
+  def __len__(self):
+    return len(self.players)
+
+  def entries(self,player):
+    """The (names, pnums) entries of a player in the prefix indexes"""
+    key = player.get_key()
+    name = normalize(player.lname + ", " + player.fname)
+    pnums = set([normalize(player.pnum), normalize(player.canon_pnum)])
+    pnums.discard(u'')
+    return ([(name, key)], [(p, key) for p in sorted(pnums)])
+
+  def add(self,player):
+    """Index a player. A player already indexed under its key is replaced."""
+    key = player.get_key()
+    if key in self.players:
+      self.remove(self.players[key])
+    self.players[key] = player
+    if player.canon_pnum:
+      self.by_pnum.setdefault(player.canon_pnum,player)
+    (names, pnums) = self.entries(player)
+    for entry in names:
+      bisect.insort(self.names,entry)
+    for entry in pnums:
+      bisect.insort(self.pnums,entry)
+
+  def extend(self,players):
+    """Index many players at once, sorting the prefix indexes once.
+
+    Faster than add() for each of them, as when a whole players set is
+    loaded. A player already indexed under its key is replaced.
+    """
+    batch = OrderedDict((p.get_key(), p) for p in players)
+    for key in batch:
+      if key in self.players:
+        self.remove(self.players[key])
+    for (key, player) in batch.items():
+      self.players[key] = player
+      if player.canon_pnum:
+        self.by_pnum.setdefault(player.canon_pnum,player)
+      (names, pnums) = self.entries(player)
+      self.names.extend(names)
+      self.pnums.extend(pnums)
+    self.names.sort()
+    self.pnums.sort()
+
+  def remove(self,player):
+    """Take a player out of the index"""
+    key = player.get_key()
+    player = self.players.pop(key,None)
+    if player is None:
+      return
+    (names, pnums) = self.entries(player)
+    for (entries, index) in ((names, self.names), (pnums, self.pnums)):
+      for entry in entries:
+        i = bisect.bisect_left(index,entry)
+        if i < len(index) and index[i] == entry:
+          del index[i]
+    if self.by_pnum.get(player.canon_pnum) is player:
+      # Non-members can share a short player number, such as "NM"
+      del self.by_pnum[player.canon_pnum]
+      for other in self.prefixed(self.pnums,normalize(player.canon_pnum)):
+        other = self.players[other]
+        if other.canon_pnum == player.canon_pnum:
+          self.by_pnum[other.canon_pnum] = other
+          break
+
+  def find(self,player_number):
+    """The Player with a player number, in either form, or None"""
+    return self.by_pnum.get(canonical_pnum(player_number))
+
+  def prefixed(self,index,prefix):
+    """Yield the keys of index entries starting with a folded prefix"""
+    i = bisect.bisect_left(index,(prefix,))
+    while i < len(index) and index[i][0].startswith(prefix):
+      yield index[i][1]
+      i += 1
+
+  def search(self,text,limit=10):
+    """Players whose name or player number starts with the text.
+
+    Names are matched as "lname, fname", so "smi" finds every Smith and
+    "smith, j" finds John and Jane. Case and accents do not matter.
+    Player numbers match as given or in canonical form, so "J36" and
+    "136" both find J367110.
+
+    Args:
+      text: The start of a name or player number
+      limit: Most matches to return
+    Returns:
+      list of Players, name matches first in name order, then player
+      number matches in number order
+    """
+    prefix = normalize(text)
+    if not prefix:
+      return []
+    found = []
+    keys = set()
+    for index in (self.names, self.pnums):
+      for key in self.prefixed(index,prefix):
+        if len(found) >= limit:
+          return found
+        if key not in keys:
+          keys.add(key)
+          found.append(self.players[key])
+    return found
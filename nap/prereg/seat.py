@@ -25,16 +25,12 @@ class Seat(object):
     return output
 
 
+  def sort_key(self):
+    """Seats sort by table, East-West before North-South"""
+    return (self.table, self.direction == Seat.NS)
+
   def __cmp__(self,other):
-    if self.table > other.table:
-      return 1
-    if self.table < other.table:
-      return -1
-    if self.direction == Seat.NS and other.direction == Seat.EW:
-      return 1
-    if self.direction == Seat.EW and other.direction == Seat.NS:
-      return -1
-    return 0
+    return cmp(self.sort_key(),other.sort_key())
 
   def __key__(self):
     return (self.table,self.direction)
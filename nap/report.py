@@ -0,0 +1,184 @@
+"""Report writers, streaming report lines to a file-like object
+
+Reports are generators of (text, record) pairs. The text is a fragment of
+the fixed-pitch report, usually one line with its line separator, and is
+None where the fixed-pitch report shows nothing. The record is an ordered
+dictionary of the same line's data for machine formats, starting with the
+name of the report it belongs to, or None for headings, spacing and other
+lines that are only there to be read.
+
+A writer consumes the pairs as they are generated, so a report starts
+coming out at once and is never held in memory whole.
+
+Classes:
+    ReportWriter: Base class of the writers
+    TextWriter: The fixed-pitch text reports
+    CSVWriter: Records as CSV rows, with a header row whenever the fields change
+    JSONLinesWriter: Records as JSON objects, one per line
+    ByteBuffer: A file-like buffer of the bytes a report writes
+
+Functions:
+    record: Build a record for a report line
+    get_writer: A writer of the given format
+    report_text: The fixed-pitch text of a report, as a string
+    report_json: The text and records of a report, for JSON
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import csv
+import json
+from collections import OrderedDict
+from StringIO import StringIO
+
+
+def record(report,*fields):
+  """A record of a report line.
+
+  Args:
+    report: Name of the report, the first field of the record
+    fields: (name, value) pairs, in order
+  Returns: OrderedDict
+  """
+  rec = OrderedDict([('report', report)])
+  rec.update(fields)
+  return rec
+
+
+def text_value(value):
+  """Unicode for a byte string: UTF-8 if it decodes as such, else Latin-1"""
+  if isinstance(value,str):
+    try:
+      return value.decode('utf-8')
+    except UnicodeDecodeError:
+      return value.decode('latin-1')
+  return value
+
+
+class ReportWriter(object):
+  """Writes report lines to a file-like object
+
+  Attributes:
+    out: File-like object with a write() method
+  """
+
+  def __init__(self,out):
+    self.out = out
+
+  def write(self,lines):
+    """Write the (text, record) pairs of a report as they are generated"""
+    for (text, rec) in lines:
+      self.line(text,rec)
+
+  def line(self,text,rec):
+    raise NotImplementedError
+
+  def close(self):
+    """Flush the output, if it can be. The output is not closed."""
+    if hasattr(self.out,'flush'):
+      self.out.flush()
+
+
+class TextWriter(ReportWriter):
+  """The fixed-pitch text of each line, records ignored"""
+
+  def line(self,text,rec):
+    if text is not None:
+      self.out.write(text)
+
+
+class CSVWriter(ReportWriter):
+  """Each record as a CSV row, text ignored
+
+  Reports of different shapes can follow one another, so a header row of
+  field names is written before the first record, and again whenever a
+  record's fields differ from the one before. Unicode is written as UTF-8.
+  """
+
+  def __init__(self,out):
+    super(CSVWriter,self).__init__(out)
+    self.csv = csv.writer(out)
+    self.fields = None
+
+  @staticmethod
+  def encode(value):
+    if value is None:
+      return ''
+    if isinstance(value,unicode):
+      return value.encode('utf-8')
+    return value
+
+  def line(self,text,rec):
+    if rec is None:
+      return
+    fields = rec.keys()
+    if fields != self.fields:
+      self.csv.writerow(fields)
+      self.fields = fields
+    self.csv.writerow([CSVWriter.encode(v) for v in rec.values()])
+
+
+class JSONLinesWriter(ReportWriter):
+  """Each record as a JSON object on a line of its own, text ignored"""
+
+  def line(self,text,rec):
+    if rec is None:
+      return
+    rec = OrderedDict((k, text_value(v)) for (k, v) in rec.items())
+    self.out.write(json.dumps(rec))
+    self.out.write('\n')
+
+
+class ByteBuffer(object):
+  """A file-like buffer of bytes, as a report would write them to a file
+
+  Unicode is written as UTF-8, and byte strings as they are, so names in
+  either form can be mixed, as on a terminal.
+  """
+
+  def __init__(self):
+    self.chunks = []
+
+  def write(self,s):
+    if isinstance(s,unicode):
+      s = s.encode('utf-8')
+    self.chunks.append(s)
+
+  def getvalue(self):
+    return ''.join(self.chunks)
+
+
+WRITERS = {
+  'text': TextWriter,
+  'csv': CSVWriter,
+  'jsonl': JSONLinesWriter,
+}
+
+
+def get_writer(format,out):
+  """A ReportWriter for one of the WRITERS formats, writing to out"""
+  if format not in WRITERS:
+    raise ValueError("Unknown report format '%s', not one of %s" %
+                     (format, ", ".join(sorted(WRITERS))))
+  return WRITERS[format](out)
+
+
+def report_text(lines):
+  """The fixed-pitch text of a report's lines, as one string"""
+  buf = StringIO()
+  TextWriter(buf).write(lines)
+  return buf.getvalue()
+
+
+def report_json(lines):
+  """A report's lines as a dictionary of its text (unicode) and a list of
+  its records, ready for json.dumps()"""
+  text = []
+  records = []
+  for (t, rec) in lines:
+    if t is not None:
+      text.append(text_value(t))
+    if rec is not None:
+      records.append(OrderedDict((k, text_value(v)) for (k, v) in rec.items()))
+  return {'text': u''.join(text), 'records': records}
@@ -0,0 +1,337 @@
+"""A resident query server holding one loaded Nap, and its client
+
+Loading a season's games and players is the slow part of every report.
+The server loads them once, then answers queries over HTTP for as long as
+it runs, rescanning its game file trees in the background so new and
+changed files are picked up without a restart (see Nap.rescan()).
+
+Queries are GET requests, answered with JSON:
+
+  /status                           Games, players and the last reload
+  /club_games?club=N&game=I         Nap.club_games(), either filter optional
+  /flight_players?flight=a          Nap.flight_players()
+  /player?number=N                  The player report, as text and records
+  /clubs                            Nap.get_clubs()
+  /prereg?number=N&event=E&flight=F Whether a player is preregistered, in
+                                    one event and flight, or either if
+                                    omitted
+
+POST /qual with a JSON body of {"args": [...]} runs the reports of a qual
+argument list on the loaded games and answers with their output, as
+qual would write it. qual --server does this, as a thin client.
+
+Each query holds the server's lock while it reads the Nap, as does each
+reload while it changes it. A reload walks the trees and decodes their
+files before it takes the lock, so queries wait only while the games
+already decoded are swapped in.
+
+A query that fails with an unexpected error is answered with status 500
+and the error, and the traceback is printed on the server's stderr.
+
+Classes:
+    NapServer: Holds a Nap, reloads it in the background, serves queries
+    NapRequestHandler: Dispatches requests to NapServer query methods
+    NapClient: Queries a NapServer
+
+Functions:
+    jsonable: A report value made safe for JSON
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import sys
+import json
+import time
+import urllib
+import urllib2
+import urlparse
+import threading
+import traceback
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from report import text_value, report_json
+from __init__ import __version__
+
+DEFAULT_PORT = 8642
+
+# Seconds between background reloads
+DEFAULT_INTERVAL = 60
+
+
+def jsonable(value):
+  """A value with its byte strings made unicode, recursively, for json.dumps()"""
+  if isinstance(value,dict):
+    return dict((jsonable(k), jsonable(v)) for (k, v) in value.items())
+  if isinstance(value,(list, tuple)):
+    return [jsonable(v) for v in value]
+  return text_value(value)
+
+
+def qualdate_json(qd):
+  return {
+    'date': qd.ptime.strftime('%Y-%m-%d'),
+    'session': qd.session,
+    'club_number': qd.club.number,
+    'club_name': qd.club.name,
+  }
+
+
+class NapServer(ThreadingMixIn, HTTPServer):
+  """An HTTP server answering queries from one loaded Nap
+
+  Attributes:
+    nap: The Nap, with games and players loaded
+    trees: Game file trees to rescan on each reload
+    jobs: Decode jobs for a rescan, see Nap.rescan()
+    concurrency: Decode threads for a rescan, likewise
+    interval: Seconds between reloads, 0 for none
+    reports: Called with the Nap and a qual argument list to run a POST
+        /qual. Returns the output as a byte string, or raises ValueError
+        for arguments it will not run.
+    lock: Held while the Nap is read or reloaded
+    loaded: time.time() of the last load or reload
+    reloads: Number of reloads so far
+  """
+
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self,address,nap,trees=(),jobs=None,concurrency=None,interval=DEFAULT_INTERVAL,
+               reports=None):
+    """Args:
+      address: (host, port) to listen on
+      Others as the attributes of the same names
+    """
+    HTTPServer.__init__(self,address,NapRequestHandler)
+    self.nap = nap
+    self.trees = list(trees)
+    self.jobs = jobs
+    self.concurrency = concurrency
+    self.interval = interval
+    self.reports = reports
+    self.lock = threading.Lock()
+    self.loaded = time.time()
+    self.reloads = 0
+    self.stopping = threading.Event()
+
+  def reload(self):
+    """Rescan the trees for new, changed and removed game files, and reread
+    the preregistrations.
+
+    The lock is held only while the Nap is changed, not while the files
+    are read and decoded (see Nap.rescan()).
+    """
+    for tree in self.trees:
+      self.nap.rescan(tree,self.jobs,self.concurrency,lock=self.lock)
+    prereg = dict((event, dict((flight, self.nap.load_prereg(event,flight))
+                               for flight in self.nap.prereg[event]))
+                  for event in self.nap.prereg)
+    with self.lock:
+      self.nap.prereg.update(prereg)
+      self.loaded = time.time()
+      self.reloads += 1
+
+  def reload_loop(self):
+    while not self.stopping.wait(self.interval):
+      try:
+        self.reload()
+      except Exception:
+        # A bad reload is reported and tried again next time, without
+        # taking down the server
+        traceback.print_exc()
+
+  def serve(self):
+    """Serve until interrupted, reloading every interval seconds"""
+    if self.trees and self.interval:
+      reloader = threading.Thread(target=self.reload_loop,name='nap-reload')
+      reloader.daemon = True
+      reloader.start()
+    (host, port) = self.server_address[0:2]
+    print >>sys.stderr, "Serving %s games on http://%s:%s/" % (len(self.nap.games),host,port)
+    try:
+      self.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self.stopping.set()
+      self.server_close()
+
+  def query_status(self,params):
+    return {
+      'version': __version__,
+      'trees': self.trees,
+      'games': len(self.nap.games),
+      'players': len(self.nap.players),
+      'loaded': time.strftime('%Y-%m-%dT%H:%M:%S',time.localtime(self.loaded)),
+      'reloads': self.reloads,
+    }
+
+  def query_club_games(self,params):
+    game_index = params.get('game')
+    if game_index is not None:
+      try:
+        game_index = int(game_index)
+      except ValueError:
+        raise ValueError("game must be a game index, not '%s'" % game_index)
+    games = self.nap.club_games(club_number=params.get('club'),game_index=game_index)
+    return [dict((k, v) for (k, v) in g.items() if k != 'game') for g in games]
+
+  def query_flight_players(self,params):
+    flight = params.get('flight','').lower()
+    if flight not in ('a','b','c'):
+      raise ValueError("flight must be a, b or c")
+    players = self.nap.flight_players(flight)
+    for p in players:
+      p['qualdates'] = [qualdate_json(qd) for qd in p['qualdates']]
+    return players
+
+  def query_player(self,params):
+    if not params.get('number'):
+      raise ValueError("number, a player number, is required")
+    return report_json(self.nap.player_lines(params['number']))
+
+  def query_clubs(self,params):
+    return self.nap.get_clubs()
+
+  def query_prereg(self,params):
+    number = params.get('number')
+    event = params.get('event')
+    flight = params.get('flight')
+    if not number:
+      raise ValueError("number, a player number, is required")
+    if event is not None and event not in self.nap.prereg:
+      raise ValueError("event must be one of %s" % ", ".join(sorted(self.nap.prereg)))
+    if flight is not None and flight not in ('a','b','c'):
+      raise ValueError("flight must be a, b or c")
+    if event and flight:
+      registered = self.nap.prereg[event][flight].is_already_registered(number)
+    elif event:
+      registered = self.nap.is_already_in_game(number,event)
+    elif flight:
+      registered = self.nap.is_already_in_flight(number,flight)
+    else:
+      registered = any(self.nap.is_already_in_game(number,e) for e in self.nap.prereg)
+    return {'number': number, 'event': event, 'flight': flight, 'registered': registered}
+
+  def query_qual(self,arglist):
+    if self.reports is None:
+      raise ValueError("This server does not run reports")
+    return self.reports(self.nap,arglist)
+
+
+class NapRequestHandler(BaseHTTPRequestHandler):
+  """GET /<query> calls NapServer.query_<query>(params), POST /qual runs reports"""
+
+  server_version = "nap/" + __version__
+
+  def send_body(self,status,body,content_type):
+    self.send_response(status)
+    self.send_header('Content-Type',content_type)
+    self.send_header('Content-Length',str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def send_json(self,status,value):
+    self.send_body(status,json.dumps(jsonable(value)),'application/json')
+
+  def do_GET(self):
+    url = urlparse.urlparse(self.path)
+    params = dict((k, v[-1]) for (k, v) in urlparse.parse_qs(url.query).items())
+    name = url.path.strip('/')
+    query = getattr(self.server,'query_' + name,None) if name != 'qual' else None
+    if query is None:
+      self.send_json(404,{'error': "No query %s" % url.path})
+      return
+    try:
+      with self.server.lock:
+        result = query(params)
+    except ValueError, e:
+      self.send_json(400,{'error': str(e)})
+      return
+    except Exception, e:
+      traceback.print_exc()
+      self.send_json(500,{'error': "%s: %s" % (e.__class__.__name__,e)})
+      return
+    self.send_json(200,result)
+
+  def do_POST(self):
+    if urlparse.urlparse(self.path).path.strip('/') != 'qual':
+      self.send_json(404,{'error': "No query %s" % self.path})
+      return
+    try:
+      body = json.loads(self.rfile.read(int(self.headers.get('Content-Length',0))))
+      arglist = body.get('args') if isinstance(body,dict) else None
+      if not isinstance(arglist,list):
+        raise ValueError("The body must be a JSON object with a list of args")
+      arglist = [a.encode('utf-8') if isinstance(a,unicode) else a for a in arglist]
+      with self.server.lock:
+        output = self.server.query_qual(arglist)
+    except ValueError, e:
+      self.send_json(400,{'error': str(e)})
+      return
+    except Exception, e:
+      traceback.print_exc()
+      self.send_json(500,{'error': "%s: %s" % (e.__class__.__name__,e)})
+      return
+    self.send_body(200,output,'text/plain')
+
+
+class NapClient(object):
+  """Queries a NapServer, one method per query
+
+  Methods raise IOError if the server cannot be reached, and ValueError
+  with the server's message if it rejects a query.
+
+  Attributes:
+    url: Base URL of the server, such as http://localhost:8642
+    timeout: Seconds to wait for an answer
+  """
+
+  def __init__(self,url,timeout=60):
+    self.url = url.rstrip('/')
+    self.timeout = timeout
+
+  def request(self,path,params=None,body=None):
+    """The body of the server's answer to a query, as a byte string"""
+    url = self.url + path
+    params = dict((k, v) for (k, v) in (params or {}).items() if v is not None)
+    if params:
+      url += '?' + urllib.urlencode(params)
+    request = urllib2.Request(url)
+    if body is not None:
+      request.add_data(json.dumps(body))
+      request.add_header('Content-Type','application/json')
+    try:
+      return urllib2.urlopen(request,timeout=self.timeout).read()
+    except urllib2.HTTPError, e:
+      try:
+        message = json.loads(e.read())['error']
+      except (ValueError, KeyError, TypeError):
+        message = "%s %s" % (e.code,e.msg)
+      raise ValueError(message.encode('utf-8') if isinstance(message,unicode) else message)
+
+  def query(self,name,**params):
+    return json.loads(self.request('/' + name,params))
+
+  def status(self):
+    return self.query('status')
+
+  def club_games(self,club_number=None,game_index=None):
+    return self.query('club_games',club=club_number,game=game_index)
+
+  def flight_players(self,flight):
+    return self.query('flight_players',flight=flight)
+
+  def player(self,player_number):
+    return self.query('player',number=player_number)
+
+  def clubs(self):
+    return self.query('clubs')
+
+  def prereg(self,player_number,event=None,flight=None):
+    return self.query('prereg',number=player_number,event=event,flight=flight)['registered']
+
+  def qual(self,arglist):
+    """The output of qual with these arguments, run by the server"""
+    return self.request('/qual',body={'args': list(arglist)})
@@ -0,0 +1,511 @@
+"""Compiled snapshots of the games and players of a Nap, opened with mmap
+
+Loading a tree builds every game, player and qualdate object by object,
+even from the parse cache. A snapshot holds the same state already
+tallied, so a report query or a web worker can start from it instead:
+
+  * The qualified players, each with the games and flights they qualified
+    in, are rebuilt when it is opened, and their qualdates from those. No
+    game needs decoding for the flight, summary, player or search reports.
+  * Games are kept as their marshalled game file dicts, and a game is only
+    built when something asks for it (see SnapshotGames).
+  * The appearance table's columns are read by NumPy straight from the
+    mapped file, without a copy.
+
+The file is opened with mmap, read only, so processes that open the same
+snapshot share its pages rather than each holding a copy. A snapshot is
+written to a temporary file and renamed into place, so one can be
+recompiled while workers still have the old one open.
+
+Layout, all integers little-endian: a header of the magic string, format
+version and number of sections, a table of sections by four-letter name,
+offset and length, then the sections themselves, each aligned to 8 bytes.
+Strings are kept once each in a pool, and referred to by their index.
+
+Classes:
+    Snapshot: An open snapshot file
+    SnapshotGames: The games dictionary of a Nap opened from a snapshot
+    SnapshotGameList: The sorted game list of a snapshot, built as used
+    SkippedFile: Why a file was skipped, as recorded in a snapshot
+
+Functions:
+    write_snapshot: Compile the state of a Nap to a snapshot file
+
+This software is released under the GNU General Public License GPLv3
+See: http://www.gnu.org/licenses/gpl.html for full license.
+"""
+
+import os
+import mmap
+import time
+import array
+import struct
+import marshal
+from collections import MutableMapping, Sequence
+from gamefile import Gamefile, GamefileException, Club, Player, QualDate, GFUtils
+from __init__ import __version__
+
+MAGIC = 'NAPSNAP\0'
+
+# Bump when the layout of the file or of any section changes
+SNAPSHOT_VERSION = 1
+
+HEADER = struct.Struct('<8sII')         # magic, version, section count
+SECTION = struct.Struct('<4sII')        # name, offset, length
+STRING = struct.Struct('<II')           # offset, length | UNICODE
+GAME = struct.Struct('<IIIiIII')        # club number, club name, date,
+                                        # session, source, blob offset, length
+PLAYER = struct.Struct('<IIIIII')       # lname, fname, pnum, home game,
+                                        # quals start, count
+QUAL = struct.Struct('<II')             # game, qual_map bits
+PERSON = struct.Struct('<III')          # lname, fname, pnum
+
+# Sections every snapshot has; the appearance columns are optional
+REQUIRED_SECTIONS = ('GAME', 'BLOB', 'PLAY', 'QUAL', 'META', 'SIDX', 'STRS')
+
+# What reading a damaged snapshot raises, made a ValueError
+DAMAGE_ERRORS = (EOFError, TypeError, ValueError, IndexError, KeyError, struct.error)
+
+# Length bit of a string stored as UTF-8 that was unicode
+UNICODE = 0x80000000
+
+# Home game of a player not found in any game
+NO_GAME = 0xFFFFFFFF
+
+# qual_map bit of each flight, as in appearances.py
+FLIGHT_BITS = {
+  'a': 4,
+  'b': 2,
+  'c': 1,
+}
+
+# Appearance table columns: section name, attribute and array type code
+COLUMNS = (
+  ('APLR', 'player', 'i'),
+  ('AGAM', 'game', 'i'),
+  ('ACLB', 'club', 'i'),
+  ('ADAT', 'date', 'i'),
+  ('ASTR', 'strat', 'b'),
+  ('AQMP', 'qual_map', 'B'),
+  ('AGCL', 'game_club', 'i'),
+)
+
+# NumPy dtype of each array type code
+DTYPES = {
+  'i': '<i4',
+  'b': 'i1',
+  'B': 'u1',
+}
+
+
+def qual_bits(flights):
+  """qual_map bit mask of a string or set of flight letters"""
+  return sum(FLIGHT_BITS[f] for f in flights)
+
+
+class SkippedFile(GamefileException):
+  """Why a file was skipped, as the text recorded in a snapshot"""
+
+  def __str__(self):
+    return self.value
+
+
+class StringPool(object):
+  """Each distinct string once, by index, for writing a snapshot"""
+
+  def __init__(self):
+    self.ids = {}
+    self.entries = array.array('I')
+    self.data = []
+    self.size = 0
+
+  def add(self,s):
+    """The index of a string, str or unicode, adding it if new"""
+    idx = self.ids.get((type(s), s))
+    if idx is None:
+      idx = self.ids[(type(s), s)] = len(self.entries) // 2
+      data = s.encode('utf-8') if isinstance(s,unicode) else s
+      self.entries.append(self.size)
+      self.entries.append(len(data) | (UNICODE if isinstance(s,unicode) else 0))
+      self.data.append(data)
+      self.size += len(data)
+    return idx
+
+
+def little_endian(a):
+  """The bytes of an array.array, little-endian whatever the machine"""
+  if struct.pack('=I',1) != struct.pack('<I',1):
+    a = array.array(a.typecode,a)
+    a.byteswap()
+  return a.tostring()
+
+
+def write_snapshot(nap,path):
+  """Compile the games and players of a Nap to a snapshot file.
+
+  Players must have been loaded (see Nap.load_players()), and the games
+  must still have their game file dicts, so a Nap created with
+  compact=True cannot be compiled. The appearance table is included if
+  NumPy is installed.
+
+  Args:
+    nap: Nap
+    path: Path string of the snapshot file, replaced if it exists
+  Exceptions:
+    ValueError if players are not loaded, or a game has no dict
+  """
+  if not nap.players_loaded:
+    raise ValueError("Players must be loaded before compiling a snapshot")
+  games = nap.sorted_games()
+  pool = StringPool()
+  sections = []
+
+  game_ids = {}
+  homes = {}
+  game_records = []
+  blobs = []
+  blob_size = 0
+  for (idx, game) in enumerate(games):
+    if game.gamefiledict is None:
+      raise ValueError("Game %s was released, and cannot be compiled" % game)
+    key = game.get_key()
+    game_ids[key] = idx
+    for (p, flights) in game.qualifiers():
+      homes.setdefault(id(p),idx)
+    blob = marshal.dumps(game.gamefiledict)
+    club = game.get_club()
+    game_records.append(GAME.pack(pool.add(club.number),pool.add(club.name),
+                                  pool.add(game.get_game_date()),game.get_club_session_num(),
+                                  pool.add(nap.sources.get(key,'')),blob_size,len(blob)))
+    blobs.append(blob)
+    blob_size += len(blob)
+  sections.append(('GAME', ''.join(game_records)))
+  sections.append(('BLOB', ''.join(blobs)))
+
+  player_records = []
+  quals = array.array('I')
+  for p in nap.get_player_list():
+    key = p.get_key()
+    qualified = sorted((game_ids[g], qual_bits(flights))
+                       for (g, flights) in nap.qualifications.get(key,{}).items())
+    player_records.append(PLAYER.pack(pool.add(p.lname),pool.add(p.fname),pool.add(p.pnum),
+                                      homes.get(id(p),NO_GAME),len(quals) // 2,len(qualified)))
+    for (g, bits) in qualified:
+      quals.append(g)
+      quals.append(bits)
+  sections.append(('PLAY', ''.join(player_records)))
+  sections.append(('QUAL', little_endian(quals)))
+
+  try:
+    table = nap.appearance_table()
+  except ImportError:
+    table = None
+  if table is not None:
+    sections.append(('APPL', ''.join(PERSON.pack(pool.add(p.lname),pool.add(p.fname),
+                                                 pool.add(p.pnum)) for p in table.players)))
+    for (name, attribute, typecode) in COLUMNS:
+      sections.append((name, getattr(table,attribute).astype(DTYPES[typecode]).tostring()))
+
+  meta = {
+    'version': __version__,
+    'profile': nap.decoder.profile,
+    'compiled': time.time(),
+    'duplicates': list(nap.duplicates),
+    'replaced': list(nap.replaced),
+    'skipped': [(f, "%s" % e) for (f, e) in nap.skipped],
+  }
+  sections.append(('META', marshal.dumps(meta)))
+  sections.append(('SIDX', little_endian(pool.entries)))
+  sections.append(('STRS', ''.join(pool.data)))
+
+  tmp = path + '.tmp'
+  with open(tmp,'wb') as f:
+    offset = HEADER.size + SECTION.size * len(sections)
+    table_of_sections = []
+    for (name, data) in sections:
+      offset += -offset % 8
+      table_of_sections.append(SECTION.pack(name,offset,len(data)))
+      offset += len(data)
+    f.write(HEADER.pack(MAGIC,SNAPSHOT_VERSION,len(sections)))
+    f.write(''.join(table_of_sections))
+    for (name, data) in sections:
+      f.write('\0' * (-f.tell() % 8))
+      f.write(data)
+  os.rename(tmp,path)
+
+
+class Snapshot(object):
+  """A snapshot file, mapped read only
+
+  Strings, qualdates and games are built from the file when first asked
+  for. The mapping stays open as long as the Snapshot does, since arrays
+  from appearance_table() are views of it.
+
+  Attributes:
+    path: Path string of the file
+    meta: Dictionary of version, profile (of the decoder), compiled (time)
+        and the duplicates, replaced and skipped files of the load
+    game_keys: Gamefile.get_key() of each game, in sorted order
+  """
+
+  def __init__(self,path):
+    """Exceptions:
+      IOError, OSError if the file cannot be read
+      ValueError if it is not a snapshot, of another format version, or
+      truncated or otherwise damaged
+    """
+    self.path = path
+    with open(path,'rb') as f:
+      # An empty file cannot be mapped
+      if os.fstat(f.fileno()).st_size < HEADER.size:
+        raise ValueError("%s is not a nap snapshot" % path)
+      self.mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+    (magic, version, count) = HEADER.unpack_from(self.mm,0)
+    if magic != MAGIC:
+      raise ValueError("%s is not a nap snapshot" % path)
+    if version != SNAPSHOT_VERSION:
+      raise ValueError("Snapshot %s is format version %s, not %s; compile it again" %
+                       (path, version, SNAPSHOT_VERSION))
+    if HEADER.size + SECTION.size * count > len(self.mm):
+      raise ValueError("Snapshot %s is truncated" % path)
+    self.sections = {}
+    for i in range(count):
+      (name, offset, length) = SECTION.unpack_from(self.mm,HEADER.size + SECTION.size * i)
+      if offset + length > len(self.mm):
+        raise ValueError("Snapshot %s is truncated: its %s section ends past the end of the file"
+                         % (path, name))
+      self.sections[name] = (offset, length)
+    missing = [n for n in REQUIRED_SECTIONS if n not in self.sections]
+    if missing:
+      raise ValueError("Snapshot %s has no %s section" % (path, ", ".join(missing)))
+    try:
+      self.strings = [None] * self.count('SIDX',STRING)
+      self.meta = marshal.loads(self.section('META'))
+      self.games = [GAME.unpack_from(self.mm,record)
+                    for record in self.offsets('GAME',GAME)]
+      self.game_keys = [(self.string(g[0]), self.string(g[2]), g[3]) for g in self.games]
+    except DAMAGE_ERRORS, e:
+      raise self.damaged(e)
+    self.qualdates = [None] * len(self.games)
+    self.people = None
+
+  def damaged(self,e):
+    """The ValueError for an error raised reading the snapshot's contents"""
+    return ValueError("Snapshot %s is damaged: %s: %s" % (self.path, e.__class__.__name__, e))
+
+  def section(self,name):
+    (offset, length) = self.sections[name]
+    return self.mm[offset:offset + length]
+
+  def count(self,name,record):
+    """Number of records of a struct in a section"""
+    return self.sections[name][1] // record.size
+
+  def offsets(self,name,record):
+    """Offset of each record of a struct in a section"""
+    start = self.sections[name][0]
+    return [start + record.size * i for i in range(self.count(name,record))]
+
+  def string(self,idx):
+    """String number idx of the pool, as the str or unicode it was"""
+    s = self.strings[idx]
+    if s is None:
+      (offset, length) = STRING.unpack_from(self.mm,self.sections['SIDX'][0] + STRING.size * idx)
+      start = self.sections['STRS'][0] + offset
+      s = self.mm[start:start + (length & ~UNICODE)]
+      if length & UNICODE:
+        s = s.decode('utf-8')
+      s = self.strings[idx] = s
+    return s
+
+  def source(self,idx):
+    """Path string of the game file of game idx"""
+    return self.string(self.games[idx][4])
+
+  def club(self,idx):
+    (number, name) = self.games[idx][0:2]
+    return Club(self.string(name),self.string(number))
+
+  def qualdate(self,idx):
+    """The QualDate of game idx, one shared by every player"""
+    qd = self.qualdates[idx]
+    if qd is None:
+      (number, name, date, session) = self.games[idx][0:4]
+      qd = self.qualdates[idx] = QualDate(self.club(idx),self.string(date),session=session)
+    return qd
+
+  def game(self,idx):
+    """Build game idx from its game file dict. Its players wait until used.
+
+    Exceptions:
+      ValueError if the snapshot is damaged
+    """
+    (start, length) = self.games[idx][5:7]
+    offset = self.sections['BLOB'][0] + start
+    try:
+      game_dict = marshal.loads(self.mm[offset:offset + length])
+    except DAMAGE_ERRORS, e:
+      raise self.damaged(e)
+    game = Gamefile(lazy=True)
+    game.init_from_dict(game_dict)
+    game.qualdate = self.qualdate(idx)
+    return game
+
+  def files(self):
+    """(duplicates, replaced, skipped) lists of the load, as in a Nap"""
+    skipped = [(f, SkippedFile(text)) for (f, text) in self.meta['skipped']]
+    return (list(self.meta['duplicates']), list(self.meta['replaced']), skipped)
+
+  def players(self):
+    """The qualified players, sorted by name and number.
+
+    Returns:
+      list of (Player, home, qualifications): the home game index of the
+      Player (NO_GAME if none), and a list of (game index, flights) it
+      qualified in, in game order. The Player's flags are set.
+    Exceptions:
+      ValueError if the snapshot is damaged
+    """
+    quals_offset = self.sections['QUAL'][0]
+    players = []
+    try:
+      for offset in self.offsets('PLAY',PLAYER):
+        (lname, fname, pnum, home, qstart, qcount) = PLAYER.unpack_from(self.mm,offset)
+        p = Player(self.string(lname),self.string(fname),self.string(pnum))
+        quals = []
+        for i in range(qstart,qstart + qcount):
+          (g, bits) = QUAL.unpack_from(self.mm,quals_offset + QUAL.size * i)
+          flights = GFUtils.QUAL_MAP_FLIGHTS[bits]
+          quals.append((g, flights))
+          for f in flights:
+            p.set_qual(f,True)
+        players.append((p, home, quals))
+    except DAMAGE_ERRORS, e:
+      raise self.damaged(e)
+    return players
+
+  def has_appearances(self):
+    """True if the snapshot was compiled with NumPy, and has appearances"""
+    return 'APPL' in self.sections
+
+  def appearance_table(self,games):
+    """The AppearanceTable of the snapshot, its columns views of the file.
+
+    Args:
+      games: Sequence of the games in sorted order, such as a
+          SnapshotGameList
+    Exceptions:
+      ImportError if NumPy is not installed
+    """
+    import numpy
+    from appearances import AppearanceTable
+    columns = {}
+    for (name, attribute, typecode) in COLUMNS:
+      (offset, length) = self.sections[name]
+      dtype = numpy.dtype(DTYPES[typecode])
+      columns[attribute] = numpy.frombuffer(self.mm,dtype=dtype,
+                                            count=length // dtype.itemsize,offset=offset)
+    people = []
+    for offset in self.offsets('APPL',PERSON):
+      (lname, fname, pnum) = PERSON.unpack_from(self.mm,offset)
+      people.append(Player(self.string(lname),self.string(fname),self.string(pnum)))
+    clubs = []
+    numbers = set()
+    for idx in range(len(self.games)):
+      club = self.club(idx)
+      if club.number not in numbers:
+        numbers.add(club.number)
+        clubs.append(club)
+    return AppearanceTable.from_columns(columns,people,games,self.game_keys,clubs)
+
+
+class SnapshotGames(MutableMapping):
+  """The games dictionary of a Nap opened from a snapshot
+
+  A dictionary of game key to Gamefile, whose games are only built from
+  the snapshot when first looked up. Games can be added and dropped as
+  in a plain dictionary.
+
+  The players set of the Nap was rebuilt from the snapshot, so its Player
+  objects are not those of any game. When a game is built, the Player of
+  each player whose home it is (the game their Player was first found in,
+  see Nap.load_players()) takes the flags of the players set's copy, as
+  it would have had in a Nap that loaded the tree.
+
+  Attributes:
+    snapshot: Snapshot
+    rows: Dictionary of game key to the index of a game of the snapshot
+    loaded: Dictionary of game key to the games built, or added
+    homes: Dictionary of game index to the Players at home in it
+    compact: If True, a game lets go of its raw dicts once it is built
+  """
+
+  def __init__(self,snapshot,homes=None,compact=False):
+    self.snapshot = snapshot
+    self.rows = dict((key, idx) for (idx, key) in enumerate(snapshot.game_keys))
+    self.loaded = {}
+    self.homes = homes or {}
+    self.compact = compact
+
+  def __getitem__(self,key):
+    game = self.loaded.get(key)
+    if game is None:
+      idx = self.rows[key]
+      game = self.snapshot.game(idx)
+      players = self.homes.get(idx)
+      if players:
+        found = dict((p.get_key(), p) for p in players)
+        for (p, flights) in game.qualifiers():
+          player = found.pop(p.get_key(),None)
+          if player is not None:
+            for f in ('a','b','c'):
+              p.set_qual(f,player.is_qual(f))
+      if self.compact:
+        game.release()
+      self.loaded[key] = game
+    return game
+
+  def __setitem__(self,key,game):
+    self.rows.pop(key,None)
+    self.loaded[key] = game
+
+  def __delitem__(self,key):
+    if key not in self:
+      raise KeyError(key)
+    self.rows.pop(key,None)
+    self.loaded.pop(key,None)
+
+  def __contains__(self,key):
+    return key in self.rows or key in self.loaded
+
+  def __iter__(self):
+    for key in self.snapshot.game_keys:
+      if key in self.rows:
+        yield key
+    for key in self.loaded:
+      if key not in self.rows:
+        yield key
+
+  def __len__(self):
+    return len(self.rows) + len([k for k in self.loaded if k not in self.rows])
+
+
+class SnapshotGameList(Sequence):
+  """The sorted game list of a snapshot, each game built when first used
+
+  Args:
+    games: SnapshotGames
+    keys: Game keys in sorted order
+  """
+
+  def __init__(self,games,keys):
+    self.games = games
+    self.keys = keys
+
+  def __getitem__(self,idx):
+    if isinstance(idx,slice):
+      return [self.games[k] for k in self.keys[idx]]
+    return self.games[self.keys[idx]]
+
+  def __len__(self):
+    return len(self.keys)
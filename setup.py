@@ -8,5 +8,6 @@ setup(name='nap',
       packages=find_packages(),
       package_data={'nap': ['ACBLgame*']},
       install_requires=['python-memcached'],
+      extras_require={'stats': ['numpy']},
       )
 